@@ -0,0 +1,221 @@
+"""
+Benchmark every API endpoint against a seeded dataset and check for regressions.
+
+Creates the test database (``test_<NAME>``) on the MongoDB server from
+settings, seeds it with populate_db (same document shapes, reproducible
+with --seed), then drives each endpoint in-process through the Django test
+client and records latency percentiles, single-client throughput and the
+SQL queries and Mongo commands per request (from the instrumentation
+middleware). The test database is dropped afterwards unless --keep.
+
+    cd octofit-tracker/backend
+    python -m benchmarks.api --users 1000 --output baseline.json
+    # ... change something ...
+    python -m benchmarks.api --users 1000 --compare baseline.json --threshold 0.2
+
+--compare exits with status 1 when an endpoint's --metric latency grew by
+more than --threshold (a fraction of the baseline), when it makes more
+queries or Mongo commands per request, or when it returned more errors
+than in the baseline.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+from datetime import datetime, timezone
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'octofit_tracker.settings')
+django.setup()
+
+from django.core.management import call_command  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test import Client, override_settings  # noqa: E402
+from django.test.utils import setup_test_environment  # noqa: E402
+from django.urls import reverse  # noqa: E402
+
+from octofit_tracker.instrumentation import endpoint_stats  # noqa: E402
+from octofit_tracker.mongo import get_db  # noqa: E402
+
+LATENCY_METRICS = ('p50_ms', 'p95_ms', 'p99_ms')
+
+
+def endpoints(db):
+    """(name, method, url name, params) for each benchmarked endpoint, using seeded ids"""
+    user = db.users.find_one({}, sort=[('email', 1)])
+    user_id, team_id = str(user['_id']), user['team_id']
+    search = user['hero_name'].split()[0][:3]
+    return [
+        ('teams', 'GET', 'team-list', {}),
+        ('users', 'GET', 'user-list', {}),
+        ('users_filtered', 'GET', 'user-list', {'team_id': team_id}),
+        ('users_search', 'GET', 'user-list', {'search': search}),
+        ('users_by_team', 'GET', 'user-by-team', {'team_id': team_id}),
+        ('users_stats', 'GET', 'user-stats', {'team_id': team_id}),
+        ('workouts', 'GET', 'workout-list', {}),
+        ('workouts_filtered', 'GET', 'workout-list', {'type': 'cardio'}),
+        ('activities', 'GET', 'activity-list', {}),
+        ('activities_filtered', 'GET', 'activity-list', {'team_id': team_id, 'activity_type': 'running'}),
+        ('activities_search', 'GET', 'activity-list', {'search': search}),
+        ('activities_by_user', 'GET', 'activity-by-user', {'user_id': user_id}),
+        ('activities_by_team', 'GET', 'activity-by-team', {'team_id': team_id}),
+        ('activities_stats', 'GET', 'activity-stats', {'group_by': 'week'}),
+        ('leaderboard', 'GET', 'leaderboard-list', {}),
+        ('leaderboard_individual', 'GET', 'leaderboard-individual', {}),
+        ('leaderboard_team', 'GET', 'leaderboard-team', {}),
+        ('leaderboard_rank', 'GET', 'leaderboard-rank', {'user_id': user_id}),
+        # Writes last, so the reads above all see the seeded dataset
+        ('activities_create', 'POST', 'activity-list', {
+            'user_id': user_id, 'user_email': user['email'], 'user_name': user['name'],
+            'hero_name': user['hero_name'], 'team_id': team_id, 'activity_type': 'running',
+            'workout_name': 'Speed Force Cardio', 'duration_minutes': 30, 'calories_burned': 350,
+            'points': 35, 'date': datetime.now(timezone.utc).isoformat(),
+        }),
+    ]
+
+
+def percentile(samples, rank):
+    """Nearest-rank percentile of sorted ``samples``"""
+    index = max(int(round(rank / 100 * len(samples) + 0.5)) - 1, 0)
+    return samples[min(index, len(samples) - 1)]
+
+
+def run_endpoint(client, method, url_name, params, requests, warmup):
+    url = reverse(url_name)
+    if method == 'GET':
+        call = lambda: client.get(url, params, HTTP_ACCEPT='application/json')  # noqa: E731
+    else:
+        body = json.dumps(params)
+        call = lambda: client.post(url, body, content_type='application/json')  # noqa: E731
+    for _ in range(warmup):
+        call()
+
+    endpoint_stats.reset()
+    samples, errors = [], 0
+    started = time.perf_counter()
+    for _ in range(requests):
+        start = time.perf_counter()
+        response = call()
+        samples.append((time.perf_counter() - start) * 1000)
+        if response.status_code >= 400:
+            errors += 1
+    elapsed = time.perf_counter() - started
+
+    totals = {'count': 0, 'queries': 0, 'mongo_commands': 0}
+    for stats in endpoint_stats.snapshot().values():
+        for key in totals:
+            totals[key] += stats[key]
+    count = totals['count'] or 1
+    samples.sort()
+    return {
+        'requests': requests,
+        'errors': errors,
+        'rps': round(requests / elapsed, 1),
+        'mean_ms': round(sum(samples) / len(samples), 3),
+        'p50_ms': round(percentile(samples, 50), 3),
+        'p95_ms': round(percentile(samples, 95), 3),
+        'p99_ms': round(percentile(samples, 99), 3),
+        'queries': round(totals['queries'] / count, 2),
+        'mongo_commands': round(totals['mongo_commands'] / count, 2),
+    }
+
+
+def compare(baseline, results, metric, threshold):
+    """Print each endpoint against the baseline; returns the regressed endpoint names"""
+    regressions = []
+    print(f'\n{"endpoint":<24}{"baseline":>10}{"current":>10}{"change":>9}   queries')
+    for name, current in results['endpoints'].items():
+        previous = baseline['endpoints'].get(name)
+        if previous is None:
+            print(f'{name:<24}{"-":>10}{current[metric]:>10.2f}{"new":>9}')
+            continue
+        change = current[metric] / previous[metric] - 1 if previous[metric] else 0.0
+        more_round_trips = (current['queries'] > previous['queries']
+                            or current['mongo_commands'] > previous['mongo_commands'])
+        more_errors = current['errors'] > previous.get('errors', 0)
+        regressed = change > threshold or more_round_trips or more_errors
+        if regressed:
+            regressions.append(name)
+        errors = f'   errors {previous.get("errors", 0)} -> {current["errors"]}' if more_errors else ''
+        print(f'{name:<24}{previous[metric]:>10.2f}{current[metric]:>10.2f}{change:>+9.1%}   '
+              f'{previous["queries"]:g}+{previous["mongo_commands"]:g} -> '
+              f'{current["queries"]:g}+{current["mongo_commands"]:g}{errors}'
+              f'{"   REGRESSION" if regressed else ""}')
+    if baseline.get('dataset') != results['dataset']:
+        print('\nWarning: the baseline was recorded on a different dataset', file=sys.stderr)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--teams', type=int, default=8)
+    parser.add_argument('--activities-per-user', type=int, default=15)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--requests', type=int, default=200, help='Measured requests per endpoint')
+    parser.add_argument('--warmup', type=int, default=10, help='Unmeasured requests per endpoint first')
+    parser.add_argument('--only', nargs='+', metavar='ENDPOINT', help='Benchmark these endpoints only')
+    parser.add_argument('--fast-reads', nargs='*', metavar='BASENAME',
+                        help='Override OCTOFIT_FAST_READS (no values: all disabled)')
+    parser.add_argument('--response-cache', action='store_true',
+                        help='Leave the response cache on (off by default, to time the full read path)')
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    parser.add_argument('--compare', metavar='BASELINE', help='Fail on regressions against this JSON file')
+    parser.add_argument('--metric', choices=LATENCY_METRICS, default='p95_ms')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='Allowed latency growth as a fraction of the baseline')
+    parser.add_argument('--keep', action='store_true', help='Keep the test database')
+    options = parser.parse_args()
+
+    dataset = {'users': options.users, 'teams': options.teams,
+               'activities_per_user': options.activities_per_user, 'seed': options.seed}
+    overrides = {'OCTOFIT_RESPONSE_CACHE': options.response_cache, 'OCTOFIT_SLOW_REQUEST_MS': None}
+    if options.fast_reads is not None:
+        overrides['OCTOFIT_FAST_READS'] = options.fast_reads
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        call_command('populate_db', users=options.users, teams=options.teams,
+                     activities_per_user=options.activities_per_user, seed=options.seed,
+                     stdout=open(os.devnull, 'w'))
+        client = Client()
+        results = {
+            'dataset': dataset,
+            'environment': {'python': platform.python_version(), 'django': django.get_version(),
+                            'recorded_at': datetime.now(timezone.utc).isoformat(timespec='seconds')},
+            'settings': overrides,
+            'endpoints': {},
+        }
+        with override_settings(**overrides):
+            for name, method, url_name, params in endpoints(get_db()):
+                if options.only and name not in options.only:
+                    continue
+                result = run_endpoint(client, method, url_name, params, options.requests, options.warmup)
+                results['endpoints'][name] = result
+                print(f'{name:<24}{result["rps"]:8.0f} req/s   p50 {result["p50_ms"]:7.2f} ms   '
+                      f'p95 {result["p95_ms"]:7.2f} ms   p99 {result["p99_ms"]:7.2f} ms   '
+                      f'{result["queries"]:g} queries   {result["mongo_commands"]:g} mongo   '
+                      f'errors {result["errors"]}')
+    finally:
+        if not options.keep:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    if options.output:
+        with open(options.output, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+            output.write('\n')
+    if options.compare:
+        with open(options.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare(baseline, results, options.metric, options.threshold)
+        if regressions:
+            print(f'\n{len(regressions)} endpoint(s) regressed: {", ".join(regressions)}', file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
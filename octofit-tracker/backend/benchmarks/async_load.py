@@ -0,0 +1,94 @@
+"""
+Load test the sync (WSGI) read endpoints against their async (ASGI) twins.
+
+Start both servers against a local mongod populated with populate_db, one
+worker process each so the comparison is per process:
+
+    pip install -r requirements.txt uvicorn gunicorn
+    python manage.py populate_db --users 10000 --seed 1
+    gunicorn octofit_tracker.wsgi -w 1 --threads 16 -b 127.0.0.1:8000
+    uvicorn octofit_tracker.asgi:application --workers 1 --port 8001
+
+then, from octofit-tracker/backend:
+
+    python -m benchmarks.async_load --concurrency 16 64 256 --requests 2000
+
+Each level keeps ``concurrency`` requests in flight and reports throughput
+and latency percentiles per endpoint and server.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from urllib.parse import urlsplit
+
+ENDPOINTS = [
+    ('leaderboard', '/api/leaderboard/individual/', '/api/async/leaderboard/individual/'),
+    ('activities', '/api/activities/?page_size=50', '/api/async/activities/?page_size=50'),
+    ('users', '/api/users/?search=hero', '/api/async/users/?search=hero'),
+]
+
+
+async def fetch(base_url, path):
+    """One GET over a fresh connection; returns the status code"""
+    url = urlsplit(base_url)
+    reader, writer = await asyncio.open_connection(url.hostname, url.port or 80)
+    writer.write(
+        f'GET {path} HTTP/1.1\r\nHost: {url.netloc}\r\nAccept: application/json\r\n'
+        f'Connection: close\r\n\r\n'.encode('ascii')
+    )
+    await writer.drain()
+    status_line = await reader.readline()
+    await reader.read()
+    writer.close()
+    return int(status_line.split()[1])
+
+
+async def drive(base_url, path, concurrency, total):
+    latencies, errors = [], 0
+    remaining = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for _ in remaining:
+            start = time.perf_counter()
+            try:
+                status = await fetch(base_url, path)
+            except OSError:
+                status = None
+            latencies.append((time.perf_counter() - start) * 1000)
+            if status != 200:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    quantile = lambda q: latencies[min(int(len(latencies) * q), len(latencies) - 1)]  # noqa: E731
+    return {
+        'rps': total / elapsed,
+        'p50': statistics.median(latencies),
+        'p95': quantile(0.95),
+        'p99': quantile(0.99),
+        'errors': errors,
+    }
+
+
+async def main(options):
+    for concurrency in options.concurrency:
+        print(f'concurrency {concurrency}, {options.requests} requests each')
+        for name, sync_path, async_path in ENDPOINTS:
+            for label, base_url, path in (('sync', options.sync_url, sync_path),
+                                          ('async', options.async_url, async_path)):
+                result = await drive(base_url, path, concurrency, options.requests)
+                print(f'  {name:<12}{label:<6}{result["rps"]:8.0f} req/s   p50 {result["p50"]:7.1f} ms   '
+                      f'p95 {result["p95"]:7.1f} ms   p99 {result["p99"]:7.1f} ms   errors {result["errors"]}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sync-url', default='http://127.0.0.1:8000')
+    parser.add_argument('--async-url', default='http://127.0.0.1:8001')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[16, 64, 256])
+    parser.add_argument('--requests', type=int, default=2000)
+    asyncio.run(main(parser.parse_args()))
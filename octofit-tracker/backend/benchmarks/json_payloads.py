@@ -0,0 +1,94 @@
+"""
+Compare JSON rendering and parsing of a large activity payload.
+
+Times DRF's stock JSONRenderer/JSONParser (with the ObjectId-aware encoder,
+which the stock one needs to handle ObjectId at all) against
+octofit_tracker.renderers.FastJSONRenderer/parsers.FastJSONParser.
+
+    cd octofit-tracker/backend
+    python -m benchmarks.json_payloads --rows 10000 --repeat 20
+"""
+import argparse
+import io
+import os
+import random
+import statistics
+import time
+from datetime import timedelta
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'octofit_tracker.settings')
+django.setup()
+
+from bson import ObjectId  # noqa: E402
+from django.utils import timezone  # noqa: E402
+from rest_framework.parsers import JSONParser  # noqa: E402
+from rest_framework.renderers import JSONRenderer  # noqa: E402
+
+from octofit_tracker import fastjson  # noqa: E402
+from octofit_tracker.parsers import FastJSONParser  # noqa: E402
+from octofit_tracker.renderers import FastJSONRenderer  # noqa: E402
+
+
+class StockJSONRenderer(JSONRenderer):
+    encoder_class = fastjson.OctofitJSONEncoder
+
+
+def activity_rows(count, seed=0):
+    """Rows shaped like ActivitySerializer output, with raw ObjectId _ids"""
+    rng = random.Random(seed)
+    now = timezone.now()
+    return [{
+        '_id': ObjectId(),
+        'user_id': str(ObjectId()),
+        'user_email': f'user{n}@octofit.dev',
+        'user_name': f'Generated User {n}',
+        'hero_name': f'Hero {n}',
+        'team_id': f'team_{n % 8}',
+        'activity_type': rng.choice(['running', 'cycling', 'swimming', 'yoga']),
+        'workout_name': 'Speed Force Cardio',
+        'duration_minutes': rng.randint(20, 60),
+        'calories_burned': rng.randint(150, 500),
+        'points': rng.randint(15, 70),
+        'date': (now - timedelta(minutes=n)).isoformat().replace('+00:00', 'Z'),
+        'notes': 'Saving the world one workout at a time!',
+    } for n in range(count)]
+
+
+def timed(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=20)
+    options = parser.parse_args()
+
+    data = {'next': None, 'previous': None, 'results': activity_rows(options.rows)}
+    body = StockJSONRenderer().render(data)
+
+    results = [
+        ('render', 'stock', timed(lambda: StockJSONRenderer().render(data), options.repeat)),
+        ('render', 'fast', timed(lambda: FastJSONRenderer().render(data), options.repeat)),
+        ('parse', 'stock', timed(lambda: JSONParser().parse(io.BytesIO(body)), options.repeat)),
+        ('parse', 'fast', timed(lambda: FastJSONParser().parse(io.BytesIO(body)), options.repeat)),
+    ]
+
+    print(f'{options.rows} activity rows, {len(body) / 1024:.0f} KiB, '
+          f'orjson {"installed" if fastjson.HAVE_ORJSON else "not installed"}')
+    for operation, variant, median in results:
+        print(f'  {operation:<7}{variant:<7}{median:9.2f} ms')
+    for operation in ('render', 'parse'):
+        stock, fast = [median for op, _, median in results if op == operation]
+        print(f'  {operation} speedup: {stock / fast:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""
+Compare ?search= on the users collection: the SearchFilter-style
+case-insensitive regex over name/hero_name/email against the ``_search``
+prefix index with relevance ranking.
+
+Seeds a scratch database on the MongoDB server from settings (dropped
+afterwards unless --keep) at several collection sizes, so the flat latency
+of the index seek can be compared with the regex scan growing linearly.
+
+    cd octofit-tracker/backend
+    python -m benchmarks.search --sizes 10000 100000 --queries 50
+"""
+import argparse
+import os
+import random
+import re
+import statistics
+import time
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'octofit_tracker.settings')
+django.setup()
+
+from bson import ObjectId  # noqa: E402
+from django.conf import settings  # noqa: E402
+from pymongo import MongoClient  # noqa: E402
+
+from octofit_tracker.models import User  # noqa: E402
+from octofit_tracker.search import (  # noqa: E402
+    SEARCH_FIELD, add_search_terms, ranked_pipeline, search_clause,
+)
+
+SYLLABLES = ['ka', 'ro', 'mi', 'tor', 'van', 'el', 'shi', 'dra', 'lux', 'bel', 'quin', 'zo']
+
+
+def word(rng):
+    return ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).capitalize()
+
+
+def users(count, rng):
+    for n in range(count):
+        first, last, hero = word(rng), word(rng), word(rng)
+        yield {
+            '_id': ObjectId(),
+            'name': f'{first} {last}',
+            'hero_name': f'{hero} {word(rng)}',
+            'email': f'{first.lower()}.{last.lower()}{n}@octofit.dev',
+            'team_id': f'team_{n % 8}',
+            'total_points': rng.randint(0, 5000),
+        }
+
+
+def seed(collection, count, rng, chunk_size=10000):
+    batch = []
+    for user in users(count, rng):
+        batch.append(user)
+        if len(batch) >= chunk_size:
+            collection.insert_many(add_search_terms(User, batch), ordered=False)
+            batch = []
+    if batch:
+        collection.insert_many(add_search_terms(User, batch), ordered=False)
+    collection.create_index(SEARCH_FIELD)
+
+
+def regex_search(collection, text, limit):
+    clauses = []
+    for term in text.split():
+        pattern = {'$regex': re.escape(term), '$options': 'i'}
+        clauses.append({'$or': [{field: pattern} for field in User.search_weights]})
+    return list(collection.find({'$and': clauses}).sort('total_points', -1).limit(limit))
+
+
+def index_search(collection, text, limit):
+    return list(collection.aggregate(ranked_pipeline(search_clause(text), text, limit=limit)))
+
+
+def timed(func, queries):
+    samples = []
+    for text in queries:
+        start = time.perf_counter()
+        func(text)
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.95) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--limit', type=int, default=50, help='Results per query (one page)')
+    parser.add_argument('--database', default='octofit_search_benchmark')
+    parser.add_argument('--keep', action='store_true', help='Keep the scratch database')
+    options = parser.parse_args()
+
+    client = MongoClient(**settings.DATABASES['default'].get('CLIENT', {}))
+    db = client[options.database]
+    rng = random.Random(0)
+    try:
+        for size in options.sizes:
+            db.users.drop()
+            seed(db.users, size, rng)
+            sample = list(db.users.aggregate([{'$sample': {'size': options.queries}}]))
+            # Typeahead-style queries: a first word plus the prefix of a second
+            queries = [f'{user["name"].split()[0]} {user["hero_name"][:3]}' for user in sample]
+
+            print(f'{size} users, {len(queries)} queries')
+            for label, func in (('regex', regex_search), ('index', index_search)):
+                median, p95 = timed(lambda text: func(db.users, text, options.limit), queries)
+                print(f'  {label:<7}p50 {median:8.2f} ms   p95 {p95:8.2f} ms')
+    finally:
+        if not options.keep:
+            client.drop_database(options.database)
+        client.close()
+
+
+if __name__ == '__main__':
+    main()
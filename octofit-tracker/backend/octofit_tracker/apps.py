@@ -0,0 +1,10 @@
+from django.apps import AppConfig
+
+
+class OctofitTrackerConfig(AppConfig):
+    name = 'octofit_tracker'
+
+    def ready(self):
+        from .instrumentation import install_command_listener
+        install_command_listener()
+        from . import signals, tasks  # noqa: F401
@@ -0,0 +1,83 @@
+"""
+Non-blocking MongoDB access for the async views.
+
+With motor installed, reads go through an AsyncIOMotorClient built from the
+'default' database settings, one per event loop. Without it they fall back
+to the pymongo connection run on a worker thread, so the async endpoints
+keep working (without the concurrency gain) on installs that lack motor.
+"""
+import asyncio
+import weakref
+
+from asgiref.sync import sync_to_async
+from django.db import connections
+
+from .mongo import get_db
+
+try:
+    from motor.motor_asyncio import AsyncIOMotorClient
+except ImportError:  # pragma: no cover - exercised when motor is absent
+    AsyncIOMotorClient = None
+
+HAVE_MOTOR = AsyncIOMotorClient is not None
+
+# event loop -> {alias: motor database}; a motor client is bound to the
+# loop it first runs on
+_databases = weakref.WeakKeyDictionary()
+
+
+def get_async_db(using='default'):
+    """The motor database for the current event loop, or None without motor"""
+    if not HAVE_MOTOR:
+        return None
+    databases = _databases.setdefault(asyncio.get_running_loop(), {})
+    if using not in databases:
+        settings_dict = connections[using].settings_dict
+        client = AsyncIOMotorClient(**settings_dict.get('CLIENT', {}))
+        databases[using] = client[settings_dict['NAME']]
+    return databases[using]
+
+
+async def find(collection, query, projection=None, sort=None, limit=0):
+    """collection.find(...) as a list"""
+    db = get_async_db()
+    if db is None:
+        return await sync_to_async(_find, thread_sensitive=False)(collection, query, projection, sort, limit)
+    cursor = db[collection].find(query, projection)
+    if sort:
+        cursor = cursor.sort(sort)
+    if limit:
+        cursor = cursor.limit(limit)
+    return await cursor.to_list(length=limit or None)
+
+
+async def find_one(collection, query, projection=None):
+    db = get_async_db()
+    if db is None:
+        return await sync_to_async(_find_one, thread_sensitive=False)(collection, query, projection)
+    return await db[collection].find_one(query, projection)
+
+
+async def aggregate(collection, pipeline):
+    """collection.aggregate(pipeline) as a list"""
+    db = get_async_db()
+    if db is None:
+        return await sync_to_async(_aggregate, thread_sensitive=False)(collection, pipeline)
+    return await db[collection].aggregate(pipeline).to_list(length=None)
+
+
+def _find(collection, query, projection, sort, limit):
+    cursor = get_db()[collection].find(query, projection)
+    if sort:
+        cursor = cursor.sort(sort)
+    if limit:
+        cursor = cursor.limit(limit)
+    return list(cursor)
+
+
+def _find_one(collection, query, projection):
+    return get_db()[collection].find_one(query, projection)
+
+
+def _aggregate(collection, pipeline):
+    return list(get_db()[collection].aggregate(pipeline))
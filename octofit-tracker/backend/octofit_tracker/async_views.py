@@ -0,0 +1,128 @@
+"""
+Async (ASGI-native) versions of the hot read endpoints.
+
+DRF 3.14 views are synchronous, so these are plain Django async views
+mounted under /api/async/. They reuse the DRF viewsets for everything that
+does no I/O (filter, search and ordering parameters, sparse fieldsets,
+keyset cursors, the compiled document mappers) and run the Mongo reads on
+the async driver (see async_mongo.py). Responses have the same shape as
+the synchronous endpoints; the response cache and conditional GET are not
+applied here.
+"""
+from bson.errors import InvalidId
+from django.http import HttpResponse
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+
+from . import async_mongo, fastjson
+from .fastpath import compile_query, leaderboard_context_from, leaderboard_context_queries, mongo_projection
+from .search import RANKED_ORDERING, ranked_pipeline, ranked_search_text
+from .views import ActivityViewSet, LeaderboardViewSet, UserViewSet
+
+
+def json_response(data, status=200):
+    return HttpResponse(fastjson.dumps(data), status=status, content_type='application/json')
+
+
+def readonly(view_function):
+    """Allow GET/HEAD only and render DRF exceptions the way the sync API does"""
+    async def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return json_response({'detail': f'Method "{request.method}" not allowed.'}, status=405)
+        try:
+            return await view_function(request, *args, **kwargs)
+        except APIException as exc:
+            detail = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+            return json_response(detail, status=exc.status_code)
+    wrapper.__name__ = view_function.__name__
+    wrapper.__doc__ = view_function.__doc__
+    return wrapper
+
+
+def viewset_for(viewset_class, request, action, **kwargs):
+    """A configured (but not dispatched) viewset, for its query compilation"""
+    return viewset_class(
+        request=Request(request), args=(), kwargs=kwargs, action=action, format_kwarg=None
+    )
+
+
+async def document_context(view, documents):
+    if not isinstance(view, LeaderboardViewSet) or not view.aggregates_selected():
+        return {}
+    teams_query, totals_pipeline = leaderboard_context_queries(documents)
+    teams = await async_mongo.find('teams', teams_query, {'name': 1}) if teams_query else []
+    totals = await async_mongo.aggregate('activities', totals_pipeline) if totals_pipeline else []
+    return leaderboard_context_from(teams, totals)
+
+
+async def list_documents(view, query=None, ordering=None):
+    """
+    The async counterpart of MongoReadMixin.list; ``query`` and ``ordering``
+    replace the ones compiled from the request parameters.
+    """
+    request = view.request
+    model, compiled, compiled_ordering = compile_query(view, request)
+    query = compiled if query is None else query
+    ordering = compiled_ordering if ordering is None else ordering
+    serializer = view.get_serializer_class()(context=view.get_serializer_context())
+    collection = model._meta.db_table
+    paginator = view.paginator
+
+    text = ranked_search_text(view, request) if query is compiled else None
+    if text is not None:
+        page_query, sort, limit = paginator.document_page_query({}, RANKED_ORDERING, request, model)
+        documents = await async_mongo.aggregate(
+            collection, ranked_pipeline(query, text, page_query, sort, limit, mongo_projection(serializer))
+        )
+        page = paginator.finish_document_page(documents)
+    else:
+        page_query, sort, limit = paginator.document_page_query(query, ordering, request, model)
+        documents = await async_mongo.find(
+            collection, page_query, mongo_projection(serializer, ordering), sort, limit
+        )
+        page = paginator.finish_document_page(documents)
+
+    results = view.serialize_documents(page, await document_context(view, page))
+    return json_response(paginator.get_paginated_response(results).data)
+
+
+@readonly
+async def activity_list(request):
+    """Async GET /api/activities/"""
+    return await list_documents(viewset_for(ActivityViewSet, request, 'list'))
+
+
+@readonly
+async def user_list(request):
+    """Async GET /api/users/"""
+    return await list_documents(viewset_for(UserViewSet, request, 'list'))
+
+
+@readonly
+async def user_detail(request, pk):
+    """Async GET /api/users/<pk>/"""
+    view = viewset_for(UserViewSet, request, 'retrieve', pk=pk)
+    model = view.get_queryset().model
+    try:
+        pk = model._meta.pk.to_python(pk)
+    except (InvalidId, TypeError, ValueError):
+        return json_response({'detail': 'Not found.'}, status=404)
+    serializer = view.get_serializer_class()(context=view.get_serializer_context())
+    document = await async_mongo.find_one(
+        model._meta.db_table, {model._meta.pk.column: pk}, mongo_projection(serializer)
+    )
+    if document is None:
+        return json_response({'detail': 'Not found.'}, status=404)
+    return json_response(view.serialize_documents([document], {})[0])
+
+
+@readonly
+async def leaderboard_list(request, leaderboard_type=None):
+    """Async GET /api/leaderboard/ and its individual/ and team/ standings"""
+    view = viewset_for(LeaderboardViewSet, request, leaderboard_type or 'list')
+    if leaderboard_type is None:
+        return await list_documents(view)
+    if request.GET.get('window', 'all') != 'all':
+        return json_response({'error': 'Only window=all standings are served here'}, status=400)
+    # Like the sync actions: every entry of the board, in rank order
+    return await list_documents(view, {'leaderboard_type': leaderboard_type}, ['rank'])
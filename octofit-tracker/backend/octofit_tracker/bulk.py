@@ -0,0 +1,106 @@
+"""
+Bulk activity ingestion.
+
+Wearable sync clients upload many activities at once. The batch is
+denormalized from a single users lookup, validated item by item, written
+with one unordered insert_many per chunk and applied to the leaderboards in
+aggregate, one points delta per user and team. Invalid items are reported
+by index without failing the rest of the batch.
+"""
+from collections import defaultdict
+
+from pymongo.errors import BulkWriteError
+from rest_framework.exceptions import ValidationError
+
+from . import leaderboard
+from .models import Activity
+from .mongo import get_db, id_variants
+from .parsers import MalformedLine
+from .search import add_search_terms
+
+BATCH_SIZE = 500
+MAX_BULK_ITEMS = 5000
+
+USER_FIELDS = {
+    'user_email': 'email',
+    'user_name': 'name',
+    'hero_name': 'hero_name',
+    'team_id': 'team_id',
+}
+
+
+def ingest_activities(items, serializer, db=None):
+    """
+    Validate and insert ``items`` using ``serializer`` (an unbound
+    ActivitySerializer) for validation. Returns (inserted documents, errors),
+    where errors is a list of {'index', 'errors'} dicts.
+    """
+    db = db if db is not None else get_db()
+    errors = []
+
+    user_ids = {str(item['user_id']) for item in items
+                if isinstance(item, dict) and item.get('user_id')}
+    lookup = []
+    for user_id in user_ids:
+        lookup.extend(id_variants(user_id))
+    users = {
+        str(user['_id']): user
+        for user in db.users.find({'_id': {'$in': lookup}}, {value: 1 for value in USER_FIELDS.values()})
+    }
+
+    inserted = []
+    for start in range(0, len(items), BATCH_SIZE):
+        documents, positions = [], []
+        for index, item in enumerate(items[start:start + BATCH_SIZE], start):
+            if isinstance(item, MalformedLine):
+                errors.append({'index': index, 'errors': {'non_field_errors': [str(item)]}})
+                continue
+            if not isinstance(item, dict):
+                errors.append({'index': index, 'errors': {'non_field_errors': ['Expected a JSON object.']}})
+                continue
+            user = users.get(str(item.get('user_id')))
+            if user is None:
+                errors.append({'index': index, 'errors': {'user_id': ['Unknown user.']}})
+                continue
+            # The user's fields always come from the lookup, like the
+            # single-create path, so a client cannot credit another team
+            item = dict(item)
+            for field, source in USER_FIELDS.items():
+                item[field] = user.get(source)
+            try:
+                documents.append(dict(serializer.run_validation(item)))
+            except ValidationError as exc:
+                errors.append({'index': index, 'errors': exc.detail})
+                continue
+            positions.append(index)
+
+        if not documents:
+            continue
+        add_search_terms(Activity, documents)
+        failed = set()
+        try:
+            db.activities.insert_many(documents, ordered=False)
+        except BulkWriteError as exc:
+            for write_error in exc.details.get('writeErrors', []):
+                failed.add(write_error['index'])
+                errors.append({'index': positions[write_error['index']],
+                               'errors': {'non_field_errors': [write_error.get('errmsg', 'Write failed.')]}})
+        inserted.extend(document for offset, document in enumerate(documents) if offset not in failed)
+
+    apply_to_leaderboards(inserted, db)
+    errors.sort(key=lambda error: error['index'])
+    return inserted, errors
+
+
+def apply_to_leaderboards(documents, db):
+    """Fold a batch into one points delta per user and team, plus the rollups"""
+    deltas = defaultdict(int)
+    profiles = {}
+    for document in documents:
+        key = (document['user_id'], document['team_id'])
+        deltas[key] += document['points']
+        profiles[key] = {field: document.get(field) for field in leaderboard.PROFILE_FIELDS}
+    for (user_id, team_id), delta in deltas.items():
+        leaderboard.apply_points(user_id, team_id, delta, profile=profiles[(user_id, team_id)], db=db)
+    if documents:
+        leaderboard.update_rollups(documents, db=db)
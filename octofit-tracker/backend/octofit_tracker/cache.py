@@ -0,0 +1,144 @@
+"""
+Versioned response cache.
+
+Read-heavy actions are cached under a key made of the endpoint, its query
+parameters and the current version of every collection the response is
+built from. Writes through the API bump those versions, so stale entries are
+never served and simply age out of the backend. The versions are documents
+in the ``collection_versions`` Mongo collection, shared by every process,
+which also record when each collection was last written (conditional.py).
+
+The backend is the ``responses`` alias in ``settings.CACHES``: LocMemCache
+(LRU, bounded by MAX_ENTRIES) by default, or any other Django cache backend
+such as RedisCache pointed at a local Redis.
+"""
+import functools
+import hashlib
+import threading
+import time
+
+from bson import ObjectId
+from django.conf import settings
+from django.core.cache import caches
+from pymongo import UpdateOne
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.response import Response
+
+from .mongo import get_db
+
+CACHE_ALIAS = 'responses'
+VERSIONS_COLLECTION = 'collection_versions'
+
+_stats_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0}
+
+
+def response_cache():
+    return caches[CACHE_ALIAS]
+
+
+def _version_documents(collections):
+    """{collection: its version document, or None if never written}"""
+    found = {
+        document['_id']: document
+        for document in get_db()[VERSIONS_COLLECTION].find({'_id': {'$in': list(collections)}})
+    }
+    return {collection: found.get(collection) for collection in collections}
+
+
+def collection_state(collections, request=None):
+    """
+    (versions, last modified) of ``collections``: the current version of
+    each, and the time (epoch seconds) of the newest write to any of them.
+    Collections never written have version None. Given the ``request``,
+    each collection's record is read once per request and remembered on
+    it, so the ETag and the cache key of a response share one read.
+    """
+    if request is None:
+        documents = _version_documents(collections)
+    else:
+        http_request = getattr(request, '_request', request)
+        if not hasattr(http_request, 'collection_versions'):
+            http_request.collection_versions = {}
+        documents = http_request.collection_versions
+        missing = [collection for collection in collections if collection not in documents]
+        if missing:
+            documents.update(_version_documents(missing))
+    versions = [documents[collection]['version'] if documents[collection] else None
+                for collection in collections]
+    modified = [documents[collection]['modified_at'] for collection in collections if documents[collection]]
+    return versions, max(modified) if modified else None
+
+
+def collection_versions(collections, request=None):
+    """Current version of each collection"""
+    return collection_state(collections, request)[0]
+
+
+def bump_versions(*collections):
+    if not collections:
+        return
+    now = time.time()
+    # A fresh id rather than a counter, so a version never comes back
+    get_db()[VERSIONS_COLLECTION].bulk_write([
+        UpdateOne({'_id': collection}, {'$set': {'version': str(ObjectId())}, '$max': {'modified_at': now}},
+                  upsert=True)
+        for collection in collections
+    ], ordered=False)
+
+
+def record(hit):
+    with _stats_lock:
+        _stats['hits' if hit else 'misses'] += 1
+
+
+def cache_stats():
+    with _stats_lock:
+        hits, misses = _stats['hits'], _stats['misses']
+    total = hits + misses
+    return {'hits': hits, 'misses': misses, 'hit_ratio': hits / total if total else 0.0}
+
+
+def cached_response(*collections):
+    """
+    Cache a viewset action's successful GET responses, keyed on the request
+    and the versions of ``collections``.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, request, *args, **kwargs):
+            if request.method != 'GET' or not getattr(settings, 'OCTOFIT_RESPONSE_CACHE', True):
+                return method(self, request, *args, **kwargs)
+
+            versions = collection_versions(collections, request)
+            params = sorted(request.query_params.lists())
+            raw_key = repr((request.path, params, request.accepted_renderer.format, versions))
+            key = 'response:' + hashlib.sha1(raw_key.encode('utf-8')).hexdigest()
+
+            cache = response_cache()
+            cached = cache.get(key)
+            if cached is not None:
+                record(hit=True)
+                response = Response(cached)
+                response['X-Cache'] = 'HIT'
+                return response
+
+            record(hit=False)
+            response = method(self, request, *args, **kwargs)
+            if response.status_code == 200 and isinstance(response, Response):
+                cache.set(key, response.data)
+            response['X-Cache'] = 'MISS'
+            return response
+        return wrapper
+    return decorator
+
+
+class InvalidatesCacheMixin:
+    """Bump the versions of ``invalidates`` after every successful write"""
+    invalidates = ()
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            bump_versions(*self.invalidates)
+        return response
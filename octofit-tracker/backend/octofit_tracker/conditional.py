@@ -0,0 +1,69 @@
+"""
+Conditional GET (ETag / Last-Modified / 304) for the REST API.
+
+Validators come from the version records of the collections the endpoint
+reads (bumped on every write and shared by every process, see cache.py),
+so they cost one small read and nothing is counted or serialized: the ETag
+hashes the request with the versions, and Last-Modified is the time of the
+newest write to any of the collections. A matching If-None-Match or
+If-Modified-Since is answered with 304 before the action runs.
+"""
+import hashlib
+import time
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from .cache import collection_state
+
+
+class NotModified(Exception):
+    def __init__(self, response):
+        self.response = response
+
+
+class ConditionalGetMixin:
+    # Collections whose writes change this viewset's responses
+    conditional_collections = ()
+
+    def get_conditional_collections(self):
+        return self.conditional_collections
+
+    def get_validators(self, request):
+        versions, modified_at = collection_state(self.get_conditional_collections(), request)
+        raw = repr((
+            request.path, sorted(request.query_params.lists()), request.accepted_renderer.format, versions,
+        ))
+        etag = quote_etag(hashlib.sha1(raw.encode('utf-8')).hexdigest())
+        # Last-Modified has whole seconds: until the second of the last write
+        # is over, another write could land in it unnoticed
+        last_modified = None
+        if modified_at is not None and int(modified_at) < int(time.time()):
+            last_modified = int(modified_at)
+        return etag, last_modified
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.validators = None
+        if request.method not in ('GET', 'HEAD'):
+            return
+        self.validators = self.get_validators(request)
+        etag, last_modified = self.validators
+        response = get_conditional_response(request._request, etag=etag, last_modified=last_modified)
+        if response is not None:
+            raise NotModified(response)
+
+    def handle_exception(self, exc):
+        if isinstance(exc, NotModified):
+            return exc.response
+        return super().handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        validators = getattr(self, 'validators', None)
+        if validators and response.status_code in (200, 304):
+            etag, last_modified = validators
+            response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+        return response
@@ -0,0 +1,90 @@
+"""
+Propagation of User changes to the denormalized copies.
+
+Activities and leaderboard entries carry copies of the user's email, name,
+hero name and team. When a user is updated, propagate_user() queues a
+``propagate_user`` job (see jobs.py), which rewrites the copies with
+chunked update_many calls:
+
+- activities, a chunk of _ids at a time, refreshing their ``_search``
+  terms; the last _id done is checkpointed in the job
+- the individual leaderboard entry and the user's rollup buckets
+- on a team change, the user's points (and live rollup buckets) move from
+  the old team's leaderboard entry to the new one's
+
+Every write sets the final values, so replaying a chunk is harmless, and an
+interrupted job continues from its checkpoint. The point transfer is keyed
+by the job id, which every team entry and bucket records as it takes its
+share, so resuming the job completes a partial transfer without applying
+any part twice. At most one propagation job runs at a time, in any
+process, and they are claimed in creation order, so successive edits of a
+user land in order.
+"""
+from . import leaderboard
+from .cache import bump_versions
+from .jobs import enqueue, id_chunks, task
+from .models import Activity
+from .mongo import id_variants
+from .search import reindex, search_columns
+
+# User field -> the copy's field in activities and leaderboard entries
+USER_FIELDS = {
+    'email': 'user_email',
+    'name': 'user_name',
+    'hero_name': 'hero_name',
+    'team_id': 'team_id',
+}
+
+
+def changed_fields(previous, user):
+    """The copied fields whose value differs between two versions of a user"""
+    return {
+        copy: getattr(user, field)
+        for field, copy in USER_FIELDS.items()
+        if getattr(previous, field) != getattr(user, field)
+    }
+
+
+def propagate_user(previous, user, db=None):
+    """Queue the fan-out of ``user``'s changes since ``previous``; returns the job id or None"""
+    changes = changed_fields(previous, user)
+    if not changes:
+        return None
+    return enqueue('propagate_user', {
+        'user_id': str(user._id),
+        'set': changes,
+        'from_team_id': previous.team_id,
+        'to_team_id': user.team_id,
+        'points': user.total_points if previous.team_id != user.team_id else 0,
+    }, db=db)
+
+
+@task('propagate_user', max_concurrency=1)
+def run_propagation(context):
+    db = context.db
+    params = context.params
+    checkpoint = dict(context.checkpoint)
+    user_ids = {'$in': id_variants(params['user_id'])}
+    changes = params['set']
+    reindex_search = bool(set(changes) & set(search_columns(Activity)))
+
+    done = checkpoint.get('done', 0)
+    for ids in id_chunks(db.activities, {'user_id': user_ids}, checkpoint.get('last_id')):
+        db.activities.update_many({'_id': {'$in': ids}}, {'$set': changes})
+        if reindex_search:
+            reindex(Activity, db, {'_id': {'$in': ids}})
+        done += len(ids)
+        checkpoint.update(last_id=ids[-1], done=done)
+        context.save(dict(checkpoint), done=done)
+
+    db.leaderboard.update_many({'leaderboard_type': 'individual', 'user_id': user_ids}, {'$set': changes})
+    db.leaderboard_rollups.update_many({'leaderboard_type': 'individual', 'key': params['user_id']},
+                                       {'$set': changes})
+
+    if params['from_team_id'] != params['to_team_id'] and not checkpoint.get('transferred'):
+        leaderboard.transfer_team_points(params['user_id'], params['points'], params['from_team_id'],
+                                         params['to_team_id'], str(context.id), db=db)
+        checkpoint['transferred'] = True
+        context.save(dict(checkpoint))
+
+    bump_versions('activities', 'leaderboard')
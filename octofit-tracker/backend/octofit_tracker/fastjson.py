@@ -0,0 +1,50 @@
+"""
+JSON encoding and decoding with orjson when it is installed, falling back to
+the stdlib json module otherwise. Both paths encode ObjectId (as its hex
+string) and timezone-aware datetimes natively, so serializers can hand them
+through untouched.
+"""
+import json
+
+from bson import ObjectId
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - exercised when orjson is absent
+    orjson = None
+
+HAVE_ORJSON = orjson is not None
+
+
+class OctofitJSONEncoder(JSONEncoder):
+    """DRF's encoder plus ObjectId support, for the stdlib fallback"""
+
+    def default(self, obj):
+        if isinstance(obj, ObjectId):
+            return str(obj)
+        return super().default(obj)
+
+
+_fallback_encoder = OctofitJSONEncoder()
+
+if HAVE_ORJSON:
+    _ORJSON_OPTIONS = orjson.OPT_UTC_Z | orjson.OPT_NAIVE_UTC | orjson.OPT_NON_STR_KEYS
+
+    def _default(obj):
+        if isinstance(obj, ObjectId):
+            return str(obj)
+        return _fallback_encoder.default(obj)
+
+    def dumps(data):
+        return orjson.dumps(data, default=_default, option=_ORJSON_OPTIONS)
+
+    def loads(data):
+        return orjson.loads(data)
+else:
+    def dumps(data):
+        return json.dumps(data, cls=OctofitJSONEncoder, ensure_ascii=False,
+                          separators=(',', ':')).encode('utf-8')
+
+    def loads(data):
+        return json.loads(data)
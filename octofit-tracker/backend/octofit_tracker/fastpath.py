@@ -0,0 +1,258 @@
+"""
+Native pymongo read path.
+
+For the viewsets listed in ``settings.OCTOFIT_FAST_READS`` the list and
+retrieve actions skip djongo's SQL translation: the filterset, search and
+ordering parameters are compiled straight into a Mongo query, and the
+returned documents are mapped to the serializer's output without building
+model instances. Responses (including pagination cursors) are the same as
+on the ORM path.
+"""
+import re
+
+from bson.errors import InvalidId
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.http import Http404
+from django_filters.rest_framework import DjangoFilterBackend
+from rest_framework import filters, serializers
+from rest_framework.fields import ModelField
+from rest_framework.response import Response
+
+from .instrumentation import timer
+from .mongo import get_db
+from .search import RANKED_ORDERING, SearchIndexFilter, ranked_pipeline, ranked_search_text, search_clause
+
+
+class DocumentRow:
+    """Attribute access over a raw document, for fields that read attributes"""
+
+    __slots__ = ('_document',)
+
+    def __init__(self, document):
+        self._document = document
+
+    def __getattr__(self, name):
+        return self._document.get(name)
+
+
+def _to_string(value):
+    return str(value)
+
+
+def _converter(serializer, field):
+    """
+    One callable per field turning a raw document value into its output,
+    resolved once per request instead of once per row.
+    """
+    if isinstance(field, serializers.SerializerMethodField):
+        method = getattr(serializer, field.method_name)
+        return lambda document, value: method(DocumentRow(document))
+    if isinstance(field, (ModelField, serializers.CharField)):
+        return lambda document, value: _to_string(value)
+    if isinstance(field, serializers.IntegerField):
+        return lambda document, value: int(value)
+    return lambda document, value: field.to_representation(value)
+
+
+def document_mapper(serializer):
+    """Build a function mapping a Mongo document to the serializer's output"""
+    columns = []
+    for field in serializer._readable_fields:
+        source = field.source
+        if source == '*':
+            source = None
+        elif field.source_attrs and len(field.source_attrs) == 1:
+            model = serializer.Meta.model
+            try:
+                source = model._meta.get_field(source).column
+            except FieldDoesNotExist:
+                pass
+        columns.append((field.field_name, source, _converter(serializer, field)))
+
+    def to_representation(document):
+        row = {}
+        for name, source, convert in columns:
+            value = document.get(source) if source else document
+            row[name] = None if value is None else convert(document, value)
+        return row
+
+    return to_representation
+
+
+def mongo_projection(serializer, ordering=()):
+    """Columns the serializer's fields read, plus the ordering columns"""
+    meta = serializer.Meta.model._meta
+    columns = {meta.get_field(name).column for name in serializer.get_model_fields()}
+    columns.update(term.lstrip('-') for term in ordering)
+    return {column: 1 for column in columns}
+
+
+def leaderboard_context_queries(documents):
+    """
+    The two reads behind leaderboard_document_context, as
+    (teams query, activities pipeline); either is None when not needed.
+    """
+    individual = [document for document in documents
+                  if document.get('leaderboard_type') == 'individual']
+    user_ids = list({str(document['user_id']) for document in individual if document.get('user_id')})
+    team_ids = list({str(document['team_id']) for document in individual if document.get('team_id')})
+    teams_query = {'_id': {'$in': team_ids}} if team_ids else None
+    totals_pipeline = [
+        {'$match': {'user_id': {'$in': user_ids}}},
+        {'$group': {'_id': '$user_id', 'calories': {'$sum': '$calories_burned'}, 'count': {'$sum': 1}}},
+    ] if user_ids else None
+    return teams_query, totals_pipeline
+
+
+def leaderboard_context_from(teams, totals):
+    return {
+        'team_names': {str(team['_id']): team['name'] for team in teams},
+        'activity_totals': {str(row['_id']): (row['calories'], row['count']) for row in totals},
+    }
+
+
+def leaderboard_document_context(documents):
+    """
+    Team names and per-user activity totals for a page of leaderboard
+    documents, using one native $group pipeline for the totals.
+    """
+    db = get_db()
+    teams_query, totals_pipeline = leaderboard_context_queries(documents)
+    teams = db.teams.find(teams_query, {'name': 1}) if teams_query else []
+    totals = db.activities.aggregate(totals_pipeline) if totals_pipeline else []
+    return leaderboard_context_from(teams, totals)
+
+
+def build_query(view, request):
+    """
+    Compile the view's DjangoFilterBackend, SearchFilter and OrderingFilter
+    parameters into (collection, query, ordering).
+    """
+    model, query, ordering = compile_query(view, request)
+    return get_db()[model._meta.db_table], query, ordering
+
+
+def compile_query(view, request):
+    """build_query without touching the database: (model, query, ordering)"""
+    model = view.get_queryset().model
+    backends = view.filter_backends
+    clauses = []
+
+    if DjangoFilterBackend in backends:
+        for name in getattr(view, 'filterset_fields', None) or []:
+            value = request.query_params.get(name)
+            if value in (None, ''):
+                continue
+            field = model._meta.get_field(name)
+            clauses.append({field.column: field.get_prep_value(field.to_python(value))})
+
+    if SearchIndexFilter in backends and hasattr(model, 'search_weights'):
+        clause = search_clause(SearchIndexFilter().get_search_text(request))
+        if clause is not None:
+            clauses.append(clause)
+    elif filters.SearchFilter in backends:
+        terms = filters.SearchFilter().get_search_terms(request)
+        search_fields = getattr(view, 'search_fields', None) or []
+        for term in terms:
+            pattern = {'$regex': re.escape(term), '$options': 'i'}
+            clauses.append({'$or': [{model._meta.get_field(name).column: pattern} for name in search_fields]})
+
+    if hasattr(view, 'get_mongo_clauses'):
+        clauses.extend(view.get_mongo_clauses())
+
+    ordering = None
+    if filters.OrderingFilter in backends:
+        ordering = filters.OrderingFilter().get_ordering(request, view.get_queryset(), view)
+    ordering = list(ordering or model._meta.ordering or ['pk'])
+    ordering = [
+        ('-' if term.startswith('-') else '') + (model._meta.pk.column if term.lstrip('-') == 'pk' else term.lstrip('-'))
+        for term in ordering
+    ]
+
+    if not clauses:
+        query = {}
+    elif len(clauses) == 1:
+        query = clauses[0]
+    else:
+        query = {'$and': clauses}
+    return model, query, ordering
+
+
+class MongoReadMixin:
+    """
+    Serve list/retrieve from pymongo when the viewset's basename is listed in
+    ``settings.OCTOFIT_FAST_READS``.
+    """
+
+    def fast_reads_enabled(self):
+        return self.basename in getattr(settings, 'OCTOFIT_FAST_READS', ())
+
+    def get_mongo_clauses(self):
+        """Extra query clauses mirroring filters applied in filter_queryset"""
+        return []
+
+    def get_document_context(self, documents):
+        """Extra serializer context for a page of documents"""
+        return {}
+
+    def serialize_documents(self, documents, document_context=None):
+        context = self.get_serializer_context()
+        if document_context is None:
+            document_context = self.get_document_context(documents)
+        context.update(document_context)
+        serializer = self.get_serializer_class()(context=context)
+        to_representation = document_mapper(serializer)
+        with timer('serialize'):
+            return [to_representation(document) for document in documents]
+
+    def get_projection(self, ordering=()):
+        serializer = self.get_serializer_class()(context=self.get_serializer_context())
+        return mongo_projection(serializer, ordering)
+
+    def ranked_list(self, request, text):
+        """?search= results in relevance order, on either read path"""
+        collection, query, _ = build_query(self, request)
+        model = self.get_queryset().model
+        projection = self.get_projection()
+        if self.paginator is None:
+            documents = collection.aggregate(ranked_pipeline(query, text, projection=projection), allowDiskUse=True)
+            return Response(self.serialize_documents(list(documents)))
+        page_query, sort, limit = self.paginator.document_page_query({}, RANKED_ORDERING, request, model)
+        documents = collection.aggregate(
+            ranked_pipeline(query, text, page_query, sort, limit, projection), allowDiskUse=True
+        )
+        page = self.paginator.finish_document_page(list(documents))
+        return self.get_paginated_response(self.serialize_documents(page))
+
+    def list(self, request, *args, **kwargs):
+        text = ranked_search_text(self, request)
+        if text is not None:
+            return self.ranked_list(request, text)
+        if not self.fast_reads_enabled():
+            return super().list(request, *args, **kwargs)
+        collection, query, ordering = build_query(self, request)
+        projection = self.get_projection(ordering)
+        model = self.get_queryset().model
+        if self.paginator is not None:
+            documents = self.paginator.paginate_documents(collection, query, ordering, request, model, projection)
+            return self.get_paginated_response(self.serialize_documents(documents))
+        sort = [(term.lstrip('-'), -1 if term.startswith('-') else 1) for term in ordering]
+        documents = list(collection.find(query, projection).sort(sort))
+        return Response(self.serialize_documents(documents))
+
+    def retrieve(self, request, *args, **kwargs):
+        if not self.fast_reads_enabled():
+            return super().retrieve(request, *args, **kwargs)
+        model = self.get_queryset().model
+        lookup = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+        try:
+            pk = model._meta.pk.to_python(lookup)
+        except (InvalidId, TypeError, ValueError):
+            raise Http404
+        document = get_db()[model._meta.db_table].find_one(
+            {model._meta.pk.column: pk}, self.get_projection()
+        )
+        if document is None:
+            raise Http404
+        return Response(self.serialize_documents([document])[0])
@@ -0,0 +1,67 @@
+"""
+Sparse fieldsets.
+
+``?fields=a,b`` keeps only the named fields of the response and
+``?exclude=c`` drops fields from it. The selection trims the serializer and
+is pushed down into the read itself: ``.only()`` on the ORM path and a Mongo
+projection on the fast path, so unselected columns are never loaded.
+"""
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import SAFE_METHODS
+
+
+class SparseFieldsetMixin:
+    """Honour ?fields= and ?exclude= on the viewset's read actions"""
+    fields_query_param = 'fields'
+    exclude_query_param = 'exclude'
+
+    def get_fieldset(self):
+        """
+        The requested selection as serializer context ({'fields': set,
+        'exclude': set}), validated against the serializer's fields. Empty
+        for writes, whose serializer needs every field.
+        """
+        if getattr(self, '_fieldset', None) is not None:
+            return self._fieldset
+        request = getattr(self, 'request', None)
+        if request is None or request.method not in SAFE_METHODS:
+            return {}
+
+        fieldset = {}
+        available = None
+        for key, param in (('fields', self.fields_query_param), ('exclude', self.exclude_query_param)):
+            value = request.query_params.get(param)
+            if value is None:
+                continue
+            if available is None:
+                available = set(self.get_serializer_class()().fields)
+            names = {name.strip() for name in value.split(',') if name.strip()}
+            unknown = names - available
+            if unknown:
+                raise ValidationError({param: f'Unknown field(s): {", ".join(sorted(unknown))}'})
+            fieldset[key] = names
+        self._fieldset = fieldset
+        return fieldset
+
+    def field_selected(self, name):
+        """Whether the response will contain the serializer field ``name``"""
+        fieldset = self.get_fieldset()
+        if 'fields' in fieldset and name not in fieldset['fields']:
+            return False
+        return name not in fieldset.get('exclude', ())
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context.update(self.get_fieldset())
+        return context
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if not self.get_fieldset():
+            return queryset
+        serializer = self.get_serializer_class()(context=self.get_serializer_context())
+        names = set(serializer.get_model_fields())
+        # Keyset pagination reads the ordering field off the last row
+        ordering = queryset.query.order_by or queryset.model._meta.ordering or getattr(self, 'ordering', None) or ()
+        names.update(term.lstrip('-') for term in ordering if term.lstrip('-') != 'pk')
+        return queryset.only(*names)
@@ -0,0 +1,95 @@
+"""
+Declarative MongoDB index definitions.
+
+Models list the indexes their queries need in a ``mongo_indexes`` attribute;
+``sync_indexes`` diffs those declarations against the live database and
+creates or drops indexes to match.
+"""
+from django.apps import apps
+from pymongo import ASCENDING, DESCENDING
+
+
+class MongoIndex:
+    """An index over one or more fields; prefix a field with '-' for descending"""
+
+    def __init__(self, *fields, name=None, unique=False, expire_after_seconds=None):
+        self.keys = [
+            (field[1:], DESCENDING) if field.startswith('-') else (field, ASCENDING)
+            for field in fields
+        ]
+        self.name = name or '_'.join(f'{field}_{direction}' for field, direction in self.keys)
+        self.unique = unique
+        self.expire_after_seconds = expire_after_seconds
+
+    def __repr__(self):
+        return f'<MongoIndex {self.name}>'
+
+    @property
+    def fields(self):
+        return [field for field, _ in self.keys]
+
+    def matches(self, info):
+        """Whether a live index (from index_information()) is equivalent"""
+        keys = [(field, int(direction)) for field, direction in info['key']]
+        return (
+            keys == self.keys
+            and bool(info.get('unique')) == self.unique
+            and info.get('expireAfterSeconds') == self.expire_after_seconds
+        )
+
+    def create(self, collection):
+        options = {'name': self.name}
+        if self.unique:
+            options['unique'] = True
+        if self.expire_after_seconds is not None:
+            options['expireAfterSeconds'] = self.expire_after_seconds
+        return collection.create_index(self.keys, **options)
+
+
+def declared_indexes():
+    """Map of collection name -> declared MongoIndex list"""
+    from .leaderboard import ROLLUP_INDEXES
+
+    declared = {}
+    for model in apps.get_app_config('octofit_tracker').get_models():
+        indexes = getattr(model, 'mongo_indexes', None)
+        if indexes:
+            declared[model._meta.db_table] = list(indexes)
+    declared['leaderboard_rollups'] = list(ROLLUP_INDEXES)
+    return declared
+
+
+def _is_primary(info):
+    return [field for field, _ in info['key']] == ['_id']
+
+
+def diff_indexes(db):
+    """
+    Compare declarations with the live database. Returns (missing, extra):
+    lists of (collection, MongoIndex) to create and (collection, name) to drop.
+    """
+    missing, extra = [], []
+    for collection_name, indexes in declared_indexes().items():
+        live = db[collection_name].index_information()
+        for index in indexes:
+            if not any(index.matches(info) for info in live.values()):
+                missing.append((collection_name, index))
+        for name, info in live.items():
+            if _is_primary(info):
+                continue
+            if not any(index.matches(info) for index in indexes):
+                extra.append((collection_name, name))
+    return missing, extra
+
+
+def ensure_indexes(db):
+    """Create any declared index that is missing; never drops anything"""
+    missing, _ = diff_indexes(db)
+    for collection_name, index in missing:
+        index.create(db[collection_name])
+    return missing
+
+
+def live_leading_fields(db, collection_name):
+    """Fields that lead some live index and can therefore be seeked on"""
+    return {info['key'][0][0] for info in db[collection_name].index_information().values()}
@@ -0,0 +1,326 @@
+"""
+Per-request performance instrumentation.
+
+PerformanceMiddleware measures every request and attributes the time to:
+
+- ``db``: SQL statements executed through djongo (translation plus Mongo),
+  counted per round trip via connection.execute_wrapper
+- ``mongo``: MongoDB commands, from a pymongo CommandListener, whether they
+  came from djongo or from the native pymongo paths
+- ``translate``: the part of ``db`` not spent in Mongo, i.e. djongo's SQL
+  parsing and translation
+- ``serialize`` and ``render``: serializer output and JSON encoding
+
+The breakdown is returned in a Server-Timing header, aggregated per
+endpoint (the resolved URL name, e.g. ``leaderboard-individual``) for the
+Prometheus text endpoint at /metrics, and logged for requests slower than
+``settings.OCTOFIT_SLOW_REQUEST_MS``.
+"""
+import asyncio
+import contextvars
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection, connections
+from django.http import HttpResponse
+from pymongo import monitoring
+
+from .cache import cache_stats
+
+logger = logging.getLogger('octofit_tracker.performance')
+
+# Upper bounds (seconds) of the request duration histogram buckets
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_current = contextvars.ContextVar('octofit_request_metrics', default=None)
+_captures = contextvars.ContextVar('octofit_round_trip_captures', default=())
+
+
+class RequestMetrics:
+    __slots__ = ('started', 'queries', 'db_seconds', 'mongo_commands', 'mongo_seconds',
+                 'translate_seconds', 'timers', '_active')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.mongo_commands = 0
+        self.mongo_seconds = 0.0
+        self.translate_seconds = 0.0
+        self.timers = {}
+        self._active = set()
+
+
+def current_metrics():
+    return _current.get()
+
+
+@contextmanager
+def timer(name):
+    """Add the enclosed time to the current request's ``name`` timer (outermost use only)"""
+    metrics = _current.get()
+    if metrics is None or name in metrics._active:
+        yield
+        return
+    metrics._active.add(name)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.timers[name] = metrics.timers.get(name, 0.0) + time.perf_counter() - started
+        metrics._active.discard(name)
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Count Mongo round trips and their server time for the current request"""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._record(event)
+
+    def failed(self, event):
+        self._record(event)
+
+    def _record(self, event):
+        record_mongo_command(event.duration_micros / 1e6)
+
+
+def install_command_listener():
+    """Register the listener; must run before djongo opens its MongoClient"""
+    monitoring.register(MongoCommandListener())
+
+
+def record_mongo_command(seconds):
+    """Attribute one Mongo round trip to the current request and any open captures"""
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.mongo_commands += 1
+        metrics.mongo_seconds += seconds
+    for capture in _captures.get():
+        capture.mongo_commands += 1
+
+
+class RoundTrips:
+    """SQL queries and Mongo commands counted by capture_round_trips()"""
+
+    def __init__(self):
+        self.queries = 0
+        self.mongo_commands = 0
+
+
+def _counting_wrapper(capture):
+    def wrapper(execute, sql, params, many, context):
+        capture.queries += 1
+        return execute(sql, params, many, context)
+    return wrapper
+
+
+@contextmanager
+def capture_round_trips(using='default'):
+    """Count the round trips made inside the block, across any requests it serves"""
+    capture = RoundTrips()
+    token = _captures.set(_captures.get() + (capture,))
+    try:
+        with connections[using].execute_wrapper(_counting_wrapper(capture)):
+            yield capture
+    finally:
+        _captures.reset(token)
+
+
+def _execute_wrapper(execute, sql, params, many, context):
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    mongo_before = metrics.mongo_seconds
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics.queries += 1
+        metrics.db_seconds += elapsed
+        metrics.translate_seconds += max(elapsed - (metrics.mongo_seconds - mongo_before), 0.0)
+
+
+class EndpointStats:
+    """Per-endpoint aggregates since process start, for /metrics"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def record(self, key, status, seconds, metrics, response_bytes):
+        with self._lock:
+            stats = self._endpoints.get(key)
+            if stats is None:
+                stats = self._endpoints[key] = {
+                    'statuses': {}, 'buckets': [0] * len(DURATION_BUCKETS), 'count': 0,
+                    'seconds': 0.0, 'queries': 0, 'db_seconds': 0.0, 'mongo_commands': 0,
+                    'mongo_seconds': 0.0, 'translate_seconds': 0.0, 'timers': {}, 'bytes': 0,
+                }
+            stats['statuses'][status] = stats['statuses'].get(status, 0) + 1
+            for index, bound in enumerate(DURATION_BUCKETS):
+                if seconds <= bound:
+                    stats['buckets'][index] += 1
+            stats['count'] += 1
+            stats['seconds'] += seconds
+            stats['queries'] += metrics.queries
+            stats['db_seconds'] += metrics.db_seconds
+            stats['mongo_commands'] += metrics.mongo_commands
+            stats['mongo_seconds'] += metrics.mongo_seconds
+            stats['translate_seconds'] += metrics.translate_seconds
+            for name, value in metrics.timers.items():
+                stats['timers'][name] = stats['timers'].get(name, 0.0) + value
+            stats['bytes'] += response_bytes
+
+    def snapshot(self):
+        with self._lock:
+            return {key: dict(stats, statuses=dict(stats['statuses']), buckets=list(stats['buckets']),
+                              timers=dict(stats['timers']))
+                    for key, stats in self._endpoints.items()}
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+
+
+endpoint_stats = EndpointStats()
+
+
+def endpoint_key(request):
+    match = getattr(request, 'resolver_match', None)
+    name = match.view_name if match is not None and match.view_name else 'unresolved'
+    return request.method, name
+
+
+def server_timing(seconds, metrics):
+    parts = [f'total;dur={seconds * 1000:.1f}',
+             f'db;dur={metrics.db_seconds * 1000:.1f};desc="{metrics.queries} queries"',
+             f'mongo;dur={metrics.mongo_seconds * 1000:.1f};desc="{metrics.mongo_commands} commands"',
+             f'translate;dur={metrics.translate_seconds * 1000:.1f}']
+    parts.extend(f'{name};dur={value * 1000:.1f}' for name, value in sorted(metrics.timers.items()))
+    return ', '.join(parts)
+
+
+class PerformanceMiddleware:
+    """Measure each request; see the module docstring"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            # Mark the instance as a coroutine function, as MiddlewareMixin does
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        try:
+            with connection.execute_wrapper(_execute_wrapper):
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, metrics)
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, metrics)
+
+    def finish(self, request, response, metrics):
+        seconds = time.perf_counter() - metrics.started
+        response_bytes = 0 if response.streaming else len(response.content)
+        method, name = endpoint_key(request)
+        endpoint_stats.record((method, name), response.status_code, seconds, metrics, response_bytes)
+        if getattr(settings, 'OCTOFIT_SERVER_TIMING', True):
+            response['Server-Timing'] = server_timing(seconds, metrics)
+
+        threshold = getattr(settings, 'OCTOFIT_SLOW_REQUEST_MS', None)
+        if threshold is not None and seconds * 1000 >= threshold:
+            logger.warning(
+                'Slow request %s %s (%s): %.1f ms, %d queries %.1f ms, %d mongo commands %.1f ms, '
+                'translate %.1f ms, %s, %d bytes',
+                method, request.get_full_path(), name, seconds * 1000, metrics.queries,
+                metrics.db_seconds * 1000, metrics.mongo_commands, metrics.mongo_seconds * 1000,
+                metrics.translate_seconds * 1000,
+                ', '.join(f'{key} {value * 1000:.1f} ms' for key, value in sorted(metrics.timers.items())) or '-',
+                response_bytes,
+            )
+        return response
+
+
+def _labels(**labels):
+    escaped = (f'{key}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+               for key, value in labels.items())
+    return '{' + ','.join(escaped) + '}'
+
+
+def prometheus_text():
+    """All endpoint aggregates and cache counters in the Prometheus text format"""
+    lines = []
+
+    def family(name, kind, help_text):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+
+    snapshot = sorted(endpoint_stats.snapshot().items())
+
+    family('octofit_requests_total', 'counter', 'Requests by endpoint and status.')
+    for (method, name), stats in snapshot:
+        for status, count in sorted(stats['statuses'].items()):
+            lines.append(f'octofit_requests_total{_labels(method=method, endpoint=name, status=status)} {count}')
+
+    family('octofit_request_duration_seconds', 'histogram', 'Request wall time.')
+    for (method, name), stats in snapshot:
+        for bound, count in zip(DURATION_BUCKETS, stats['buckets']):
+            lines.append(f'octofit_request_duration_seconds_bucket'
+                         f'{_labels(method=method, endpoint=name, le=bound)} {count}')
+        lines.append(f'octofit_request_duration_seconds_bucket'
+                     f'{_labels(method=method, endpoint=name, le="+Inf")} {stats["count"]}')
+        lines.append(f'octofit_request_duration_seconds_sum{_labels(method=method, endpoint=name)} '
+                     f'{stats["seconds"]:.6f}')
+        lines.append(f'octofit_request_duration_seconds_count{_labels(method=method, endpoint=name)} '
+                     f'{stats["count"]}')
+
+    counters = [
+        ('octofit_db_queries_total', 'queries', 'SQL statements executed through djongo.'),
+        ('octofit_db_seconds_total', 'db_seconds', 'Time in djongo SQL execution, translation included.'),
+        ('octofit_mongo_commands_total', 'mongo_commands', 'MongoDB commands sent.'),
+        ('octofit_mongo_seconds_total', 'mongo_seconds', 'MongoDB command time.'),
+        ('octofit_translate_seconds_total', 'translate_seconds', 'Time in djongo SQL translation.'),
+        ('octofit_response_bytes_total', 'bytes', 'Response body bytes (streaming responses excluded).'),
+    ]
+    for metric, key, help_text in counters:
+        family(metric, 'counter', help_text)
+        for (method, name), stats in snapshot:
+            lines.append(f'{metric}{_labels(method=method, endpoint=name)} {stats[key]}')
+
+    family('octofit_phase_seconds_total', 'counter', 'Time in serializer output and rendering.')
+    for (method, name), stats in snapshot:
+        for phase, value in sorted(stats['timers'].items()):
+            lines.append(f'octofit_phase_seconds_total{_labels(method=method, endpoint=name, phase=phase)} '
+                         f'{value:.6f}')
+
+    stats = cache_stats()
+    family('octofit_response_cache_requests_total', 'counter', 'Response cache lookups.')
+    lines.append(f'octofit_response_cache_requests_total{_labels(result="hit")} {stats["hits"]}')
+    lines.append(f'octofit_response_cache_requests_total{_labels(result="miss")} {stats["misses"]}')
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    """GET /metrics for Prometheus scraping"""
+    return HttpResponse(prometheus_text(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,287 @@
+"""
+In-process background jobs with a persistent queue.
+
+Jobs are documents in the ``jobs`` collection:
+
+    {task, params, state: queued|running|done|failed, progress: {done, total},
+     checkpoint, error, attempts, created_at, started_at, finished_at, heartbeat_at}
+
+enqueue() stores a job and wakes the process's worker pool
+(``settings.OCTOFIT_JOB_WORKERS`` threads). Workers claim the oldest queued
+job atomically, so several processes can share the queue. A task with a
+``max_concurrency`` has that many slots, lock documents (mongo.MongoLock)
+shared by every process: a worker takes a free slot before it claims one
+of the task's jobs, so no more than ``max_concurrency`` of them run at once
+anywhere, and with one slot they run in creation order. Tasks report
+progress and save a checkpoint after each chunk through their JobContext,
+which also renews the slot's lease; a job that is re-run (after a crash,
+via requeue_stale()) gets its last checkpoint back and continues from there.
+
+Tasks are plain functions registered with ``@task('name')`` (see
+tasks.py); ``manage.py enqueue_job`` and ``manage.py run_jobs`` and the
+/api/jobs/ endpoints drive them.
+"""
+import logging
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import timedelta
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from django.conf import settings
+from django.utils import timezone
+from pymongo import ASCENDING, DESCENDING, ReturnDocument
+
+from .mongo import MongoLock, get_db
+
+logger = logging.getLogger(__name__)
+
+JOBS_COLLECTION = 'jobs'
+# Documents per chunk for the tasks that checkpoint
+CHUNK_SIZE = 1000
+# A running job whose heartbeat is older than this is considered abandoned,
+# and its concurrency slot is freed
+LEASE_SECONDS = 300
+
+STATES = ('queued', 'running', 'done', 'failed')
+
+
+class Task:
+    def __init__(self, name, function, max_concurrency=None, validate=None):
+        self.name = name
+        self.function = function
+        self.max_concurrency = max_concurrency
+        self.validate = validate
+
+
+_tasks = {}
+
+
+def task(name, max_concurrency=None, validate=None):
+    """
+    Register ``function(context)`` as a job task. ``validate(params)`` may
+    raise ValueError to refuse a job at enqueue time.
+    """
+    def register(function):
+        _tasks[name] = Task(name, function, max_concurrency, validate)
+        return function
+    return register
+
+
+def task_names():
+    return sorted(_tasks)
+
+
+class JobContext:
+    """What a running task sees of its job"""
+
+    def __init__(self, job, db, slot=None):
+        self.id = job['_id']
+        self.params = job.get('params') or {}
+        self.checkpoint = job.get('checkpoint') or {}
+        self.db = db
+        self.slot = slot
+
+    def progress(self, done, total=None):
+        """Report progress; also the job's heartbeat, so call it at least every LEASE_SECONDS"""
+        update = {'progress.done': done}
+        if total is not None:
+            update['progress.total'] = total
+        self._heartbeat(update)
+
+    def save(self, checkpoint, done=None, total=None):
+        """Persist ``checkpoint`` (and progress) once a chunk is durable"""
+        self.checkpoint = checkpoint
+        update = {'checkpoint': checkpoint}
+        if done is not None:
+            update['progress.done'] = done
+        if total is not None:
+            update['progress.total'] = total
+        self._heartbeat(update)
+
+    def _heartbeat(self, update):
+        if self.slot is not None:
+            self.slot.renew()
+        update['heartbeat_at'] = timezone.now()
+        self.db[JOBS_COLLECTION].update_one({'_id': self.id}, {'$set': update})
+
+
+def id_chunks(collection, query, last_id=None):
+    """Successive lists of up to CHUNK_SIZE matching _ids after ``last_id``, in _id order"""
+    while True:
+        chunk_query = dict(query)
+        if last_id is not None:
+            chunk_query['_id'] = {'$gt': last_id}
+        ids = [document['_id'] for document in
+               collection.find(chunk_query, {'_id': 1}).sort('_id', ASCENDING).limit(CHUNK_SIZE)]
+        if not ids:
+            return
+        yield ids
+        last_id = ids[-1]
+
+
+class Runner:
+    def __init__(self, workers):
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='octofit-job')
+        self._lock = threading.Lock()
+        self._futures = set()
+
+    def kick(self):
+        """Make sure a worker is looking at the queue"""
+        # Workers that find nothing to claim exit at once, so over-kicking is cheap
+        with self._lock:
+            future = self._executor.submit(self._work)
+            self._futures.add(future)
+        future.add_done_callback(self._discard)
+
+    def _discard(self, future):
+        with self._lock:
+            self._futures.discard(future)
+
+    def wait(self, timeout=None):
+        """Block until this process's workers have drained the queue"""
+        while True:
+            with self._lock:
+                futures = list(self._futures)
+            if not futures:
+                return
+            done, pending = wait(futures, timeout)
+            if pending:
+                raise TimeoutError(f'{len(pending)} job workers still busy')
+
+    def _reserve(self, name, db):
+        """A free concurrency slot of task ``name``, held, or None when all are taken"""
+        for slot in range(_tasks[name].max_concurrency):
+            lock = MongoLock(f'job:{name}:{slot}', lease=LEASE_SECONDS, db=db)
+            if lock.try_acquire():
+                return lock
+        return None
+
+    def _claim(self, db):
+        """The oldest queued job this worker may run, claimed, and its slot"""
+        full = set()
+        while True:
+            names = [name for name in task_names() if name not in full]
+            if not names:
+                return None, None
+            job = db[JOBS_COLLECTION].find_one({'state': 'queued', 'task': {'$in': names}}, {'task': 1},
+                                               sort=[('created_at', ASCENDING), ('_id', ASCENDING)])
+            if job is None:
+                return None, None
+
+            slot = None
+            if _tasks[job['task']].max_concurrency is not None:
+                slot = self._reserve(job['task'], db)
+                if slot is None:
+                    full.add(job['task'])
+                    continue
+            now = timezone.now()
+            claimed = db[JOBS_COLLECTION].find_one_and_update(
+                {'_id': job['_id'], 'state': 'queued'},
+                {'$set': {'state': 'running', 'started_at': now, 'heartbeat_at': now}, '$inc': {'attempts': 1}},
+                return_document=ReturnDocument.AFTER
+            )
+            if claimed is not None:
+                return claimed, slot
+            # Another worker got there first
+            if slot is not None:
+                slot.release()
+
+    def _work(self):
+        db = get_db()
+        while True:
+            job, slot = self._claim(db)
+            if job is None:
+                return
+            try:
+                run(job, db, slot)
+            finally:
+                if slot is not None:
+                    slot.release()
+
+
+def run(job, db, slot=None):
+    """Run a claimed job to completion and record the outcome"""
+    jobs = db[JOBS_COLLECTION]
+    try:
+        _tasks[job['task']].function(JobContext(job, db, slot))
+    except Exception as exc:
+        logger.exception('Job %s (%s) failed', job['_id'], job['task'])
+        jobs.update_one({'_id': job['_id']}, {'$set': {
+            'state': 'failed', 'error': f'{type(exc).__name__}: {exc}',
+            'traceback': traceback.format_exc(), 'finished_at': timezone.now(),
+        }})
+    else:
+        jobs.update_one({'_id': job['_id']}, {'$set': {'state': 'done', 'error': None,
+                                                        'finished_at': timezone.now()}})
+
+
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def get_runner():
+    global _runner
+    with _runner_lock:
+        if _runner is None:
+            _runner = Runner(getattr(settings, 'OCTOFIT_JOB_WORKERS', 2))
+        return _runner
+
+
+def enqueue(name, params=None, db=None, start=True):
+    """Store a job and (unless ``start`` is False) wake the workers; returns its id"""
+    if name not in _tasks:
+        raise ValueError(f'Unknown task {name!r}; expected one of: {", ".join(task_names())}')
+    params = params or {}
+    if not isinstance(params, dict):
+        raise ValueError('params must be an object')
+    if _tasks[name].validate is not None:
+        _tasks[name].validate(params)
+    db = db if db is not None else get_db()
+    now = timezone.now()
+    job_id = db[JOBS_COLLECTION].insert_one({
+        'task': name, 'params': params, 'state': 'queued', 'progress': {'done': 0, 'total': None},
+        'checkpoint': {}, 'error': None, 'attempts': 0, 'created_at': now, 'started_at': None,
+        'finished_at': None, 'heartbeat_at': None,
+    }).inserted_id
+    if start:
+        get_runner().kick()
+    return job_id
+
+
+def wait_for_jobs(timeout=None):
+    """Block until the queued jobs have run (tests, management commands)"""
+    get_runner().wait(timeout)
+
+
+def requeue_stale(db=None):
+    """Put running jobs whose worker stopped heartbeating back in the queue"""
+    db = db if db is not None else get_db()
+    cutoff = timezone.now() - timedelta(seconds=LEASE_SECONDS)
+    return db[JOBS_COLLECTION].update_many(
+        {'state': 'running', 'heartbeat_at': {'$lt': cutoff}}, {'$set': {'state': 'queued'}}
+    ).modified_count
+
+
+def get_job(job_id, db=None):
+    db = db if db is not None else get_db()
+    try:
+        job_id = ObjectId(str(job_id))
+    except InvalidId:
+        return None
+    return db[JOBS_COLLECTION].find_one({'_id': job_id}, {'traceback': 0})
+
+
+def recent_jobs(state=None, limit=50, db=None):
+    db = db if db is not None else get_db()
+    query = {'state': state} if state else {}
+    return list(db[JOBS_COLLECTION].find(query, {'traceback': 0}).sort('created_at', DESCENDING).limit(limit))
+
+
+def job_data(job):
+    """A job document as API output"""
+    data = dict(job, id=str(job['_id']))
+    del data['_id']
+    return data
@@ -0,0 +1,488 @@
+"""
+Incremental leaderboard maintenance.
+
+Every Activity write is turned into a points delta that is applied to the
+user's total, the individual leaderboard entry and the team leaderboard
+entry. Ranks are kept contiguous by shifting only the band of entries the
+mover passed, so a write never rescans the activities collection. Moves
+are serialised across processes by a lock document (mongo.MongoLock), as
+every move reads ranks that the others shift.
+
+Time-windowed leaderboards are served from the ``leaderboard_rollups``
+collection: one bucket per user or team per day, ISO week and month,
+incremented as activities arrive and expired by a TTL index once they fall
+out of their retention period.
+"""
+import heapq
+import multiprocessing
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from contextlib import contextmanager
+from datetime import timedelta
+
+from bson import ObjectId
+from django.db import connections
+from django.utils import timezone
+from pymongo import ASCENDING, UpdateOne
+
+from . import live, rebuild
+from .indexes import MongoIndex
+from .models import Leaderboard
+from .mongo import MongoLock, get_db, id_variants
+
+# Rank shifts read an entry and then move its neighbours, so two concurrent
+# writes must not interleave the band: threads queue on _rank_lock, and
+# processes on the RANK_LOCK document
+_rank_lock = threading.Lock()
+RANK_LOCK = 'leaderboard_ranks'
+RANK_LOCK_LEASE = 30
+
+PROFILE_FIELDS = ('user_email', 'user_name', 'hero_name', 'team_id')
+
+# Team entries and buckets remember this many of the point transfers
+# applied to them, so that a resumed transfer skips the ones already done
+TRANSFER_MARKERS = 50
+
+# window -> (period key format, how long a bucket is kept after its activity)
+WINDOWS = {
+    'day': ('%Y-%m-%d', timedelta(days=35)),
+    'week': ('%G-W%V', timedelta(weeks=26)),
+    'month': ('%Y-%m', timedelta(days=731)),
+}
+
+ROLLUP_INDEXES = [
+    MongoIndex('window', 'period', 'leaderboard_type', '-total_points', '-_id'),
+    MongoIndex('expires_at', expire_after_seconds=0),
+]
+
+_rollup_indexes_ready = False
+
+# Full rebuilds are written to a scratch collection named with this prefix
+# and renamed over the leaderboard; REBUILD_LOCK admits one at a time
+REBUILD_COLLECTION = 'leaderboard_rebuild'
+REBUILD_LOCK = 'leaderboard_rebuild'
+REBUILD_BATCH_SIZE = 1000
+# Users per partition at most, which bounds each $group's $in list and the
+# time between progress reports
+REBUILD_PARTITION_USERS = 20000
+# Longest gap between progress() calls during a rebuild, which job
+# heartbeats rely on
+REBUILD_HEARTBEAT_SECONDS = 30
+
+# Entries either side of the requested one returned by the rank lookup
+DEFAULT_RANK_AROUND = 5
+MAX_RANK_AROUND = 50
+
+
+def _value(activity, name):
+    if isinstance(activity, dict):
+        return activity.get(name)
+    return getattr(activity, name, None)
+
+
+def record_activity(activity, sign=1, db=None):
+    """Apply an activity's points to the leaderboards (sign=-1 retracts it)"""
+    db = db if db is not None else get_db()
+    points = _value(activity, 'points') or 0
+    profile = {field: _value(activity, field) for field in PROFILE_FIELDS}
+    apply_points(_value(activity, 'user_id'), _value(activity, 'team_id'),
+                 sign * points, profile=profile, db=db)
+    update_rollups([activity], sign=sign, db=db)
+
+
+def replace_activity(previous, activity, db=None):
+    """Apply the difference between two versions of the same activity"""
+    db = db if db is not None else get_db()
+    same_owner = (
+        str(_value(previous, 'user_id')) == str(_value(activity, 'user_id'))
+        and _value(previous, 'team_id') == _value(activity, 'team_id')
+    )
+    if same_owner:
+        delta = (_value(activity, 'points') or 0) - (_value(previous, 'points') or 0)
+        profile = {field: _value(activity, field) for field in PROFILE_FIELDS}
+        apply_points(_value(activity, 'user_id'), _value(activity, 'team_id'),
+                     delta, profile=profile, db=db)
+        update_rollups([previous], sign=-1, db=db)
+        update_rollups([activity], db=db)
+    else:
+        record_activity(previous, sign=-1, db=db)
+        record_activity(activity, db=db)
+
+
+def apply_points(user_id, team_id, delta, profile=None, db=None):
+    """
+    Add ``delta`` points to a user and their team and move both leaderboard
+    entries to their new rank.
+    """
+    if not delta or user_id is None:
+        return
+    db = db if db is not None else get_db()
+    now = timezone.now()
+
+    db.users.update_one({'_id': {'$in': id_variants(user_id)}}, {'$inc': {'total_points': delta}})
+
+    individual = dict(profile or {}, user_id=str(user_id), team_id=team_id)
+    if team_id:
+        team = db.teams.find_one({'_id': team_id}, {'name': 1})
+        team_defaults = {'team_id': team_id, 'team_name': team['name'] if team else None}
+
+    with ranks_locked(db):
+        moves = [_move_entry(db, 'individual', {'user_id': {'$in': id_variants(user_id)}}, str(user_id),
+                             delta, individual, now)]
+        if team_id:
+            moves.append(_move_entry(db, 'team', {'team_id': team_id}, team_id, delta, team_defaults, now))
+        # Still under the lock, so subscribers get the moves in the order they were applied
+        live.broker.publish(moves)
+
+
+def transfer_team_points(user_id, points, from_team_id, to_team_id, transfer_id, db=None):
+    """
+    Move a user's ``points`` from one team's leaderboard entry to another's,
+    along with the user's live rollup buckets, when the user changes team.
+
+    Each team entry and bucket records ``transfer_id`` in the same update
+    that moves its points, and is skipped when it already has it, so a
+    transfer interrupted part way can simply be run again.
+    """
+    db = db if db is not None else get_db()
+    now = timezone.now()
+    team_names = {team['_id']: team['name']
+                  for team in db.teams.find({'_id': {'$in': [from_team_id, to_team_id]}}, {'name': 1})}
+
+    moves = []
+    with ranks_locked(db):
+        for team_id, delta in ((from_team_id, -points), (to_team_id, points)):
+            if not team_id or not delta:
+                continue
+            defaults = {'team_id': team_id, 'team_name': team_names.get(team_id)}
+            move = _move_entry(db, 'team', {'team_id': team_id}, team_id, delta, defaults, now,
+                               transfer_id=transfer_id)
+            if move is not None:
+                moves.append(move)
+        live.broker.publish(moves)
+
+    operations = []
+    buckets = db.leaderboard_rollups.find(
+        {'leaderboard_type': 'individual', 'key': str(user_id), 'activity_count': {'$gt': 0}}
+    )
+    for bucket in buckets:
+        for team_id, sign in ((from_team_id, -1), (to_team_id, 1)):
+            if not team_id:
+                continue
+            bucket_id = f'{bucket["window"]}:{bucket["period"]}:team:{team_id}'
+            match = {'window': bucket['window'], 'period': bucket['period'],
+                     'leaderboard_type': 'team', 'key': team_id}
+            # Create the bucket first, so the guarded update below never
+            # has to upsert past a bucket that already has this transfer
+            operations.append(UpdateOne({'_id': bucket_id}, {'$setOnInsert': match}, upsert=True))
+            operations.append(UpdateOne(
+                {'_id': bucket_id, 'transfers': {'$ne': transfer_id}},
+                {
+                    '$inc': {field: sign * bucket.get(field, 0)
+                             for field in ('total_points', 'total_calories', 'activity_count')},
+                    '$set': {'team_id': team_id, 'team_name': team_names.get(team_id), 'last_updated': now},
+                    '$max': {'expires_at': bucket['expires_at']},
+                    '$push': _transfer_marker(transfer_id),
+                }
+            ))
+    if operations:
+        ensure_rollup_indexes(db)
+        db.leaderboard_rollups.bulk_write(operations, ordered=True)
+
+
+def _transfer_marker(transfer_id):
+    """$push of a transfer id, keeping the last TRANSFER_MARKERS of them"""
+    return {'transfers': {'$each': [transfer_id], '$slice': -TRANSFER_MARKERS}}
+
+
+@contextmanager
+def ranks_locked(db):
+    """Hold the rank lock, first within the process and then across processes"""
+    with _rank_lock, MongoLock(RANK_LOCK, lease=RANK_LOCK_LEASE, db=db):
+        yield
+
+
+def _move_entry(db, leaderboard_type, match, key, delta, defaults, now, transfer_id=None):
+    """
+    Move an entry by ``delta`` points; returns the move for
+    live.broker.publish, or None when the entry already has ``transfer_id``.
+    """
+    # Callers hold ranks_locked()
+    collection = db.leaderboard
+    entry = collection.find_one(dict(match, leaderboard_type=leaderboard_type),
+                                {'rank': 1, 'total_points': 1, 'transfers': 1})
+    if entry is not None and transfer_id is not None and transfer_id in entry.get('transfers', ()):
+        return None
+    if entry is None:
+        # New entries start at the bottom with no points and climb from there
+        entry = dict(defaults, leaderboard_type=leaderboard_type, total_points=0,
+                     rank=collection.count_documents({'leaderboard_type': leaderboard_type}) + 1,
+                     last_updated=now)
+        entry['_id'] = collection.insert_one(entry).inserted_id
+
+    rank = from_rank = entry['rank']
+    points = entry['total_points'] + delta
+    if delta > 0:
+        passed = collection.update_many(
+            {'leaderboard_type': leaderboard_type, 'rank': {'$lt': rank}, 'total_points': {'$lt': points}},
+            {'$inc': {'rank': 1}}
+        )
+        rank -= passed.modified_count
+    else:
+        passed = collection.update_many(
+            {'leaderboard_type': leaderboard_type, 'rank': {'$gt': rank}, 'total_points': {'$gt': points}},
+            {'$inc': {'rank': -1}}
+        )
+        rank += passed.modified_count
+
+    update = {'$inc': {'total_points': delta}, '$set': {'rank': rank, 'last_updated': now}}
+    if transfer_id is not None:
+        update['$push'] = _transfer_marker(transfer_id)
+    collection.update_one({'_id': entry['_id']}, update)
+    return {'leaderboard_type': leaderboard_type, 'key': key, 'from_rank': from_rank, 'rank': rank,
+            'total_points': points}
+
+
+def period_key(window, when):
+    """The rollup period a datetime falls into for the given window"""
+    return when.strftime(WINDOWS[window][0])
+
+
+def ensure_rollup_indexes(db):
+    global _rollup_indexes_ready
+    if _rollup_indexes_ready:
+        return
+    for index in ROLLUP_INDEXES:
+        index.create(db.leaderboard_rollups)
+    _rollup_indexes_ready = True
+
+
+def update_rollups(activities, sign=1, db=None):
+    """
+    Add (or with sign=-1 remove) activities to their day, week and month
+    buckets. Activities sharing a bucket are folded into a single update.
+    """
+    db = db if db is not None else get_db()
+    now = timezone.now()
+    buckets = {}
+    for activity in activities:
+        date = _value(activity, 'date')
+        if date is None:
+            continue
+        owners = [('individual', str(_value(activity, 'user_id')),
+                   {field: _value(activity, field) for field in PROFILE_FIELDS})]
+        if _value(activity, 'team_id'):
+            owners.append(('team', _value(activity, 'team_id'), {'team_id': _value(activity, 'team_id')}))
+        for window, (fmt, retention) in WINDOWS.items():
+            expires_at = date + retention
+            if expires_at.replace(tzinfo=None) <= now.replace(tzinfo=None):
+                continue
+            period = date.strftime(fmt)
+            for leaderboard_type, key, profile in owners:
+                bucket_id = f'{window}:{period}:{leaderboard_type}:{key}'
+                bucket = buckets.setdefault(bucket_id, {
+                    'match': {'window': window, 'period': period,
+                              'leaderboard_type': leaderboard_type, 'key': key},
+                    'profile': profile, 'expires_at': expires_at,
+                    'total_points': 0, 'total_calories': 0, 'activity_count': 0,
+                })
+                bucket['expires_at'] = max(bucket['expires_at'], expires_at)
+                bucket['total_points'] += sign * (_value(activity, 'points') or 0)
+                bucket['total_calories'] += sign * (_value(activity, 'calories_burned') or 0)
+                bucket['activity_count'] += sign
+
+    if not buckets:
+        return
+    team_ids = {b['profile']['team_id'] for b in buckets.values() if b['match']['leaderboard_type'] == 'team'}
+    team_names = {team['_id']: team['name'] for team in db.teams.find({'_id': {'$in': list(team_ids)}}, {'name': 1})}
+
+    operations = []
+    for bucket_id, bucket in buckets.items():
+        profile = bucket['profile']
+        if bucket['match']['leaderboard_type'] == 'team':
+            profile = dict(profile, team_name=team_names.get(profile['team_id']))
+        operations.append(UpdateOne(
+            {'_id': bucket_id},
+            {
+                '$inc': {field: bucket[field] for field in ('total_points', 'total_calories', 'activity_count')},
+                '$set': dict(profile, last_updated=now),
+                '$max': {'expires_at': bucket['expires_at']},
+                '$setOnInsert': bucket['match'],
+            },
+            upsert=True
+        ))
+    ensure_rollup_indexes(db)
+    db.leaderboard_rollups.bulk_write(operations, ordered=False)
+
+
+def windowed_query(leaderboard_type, window, when=None):
+    """
+    The rollup buckets of the current period of a window. Standings list
+    them by (total_points, _id), both descending, a walk of the rollup
+    index; the _id ends with the user or team id, which breaks ties.
+    windowed_rank() numbers them.
+    """
+    return {'window': window, 'period': period_key(window, when or timezone.now()),
+            'leaderboard_type': leaderboard_type, 'activity_count': {'$gt': 0}}
+
+
+def windowed_rank(query, bucket, db=None):
+    """Rank of a bucket among those matching ``query``: one counted index range"""
+    db = db if db is not None else get_db()
+    return db.leaderboard_rollups.count_documents({'$and': [query, {'$or': [
+        {'total_points': {'$gt': bucket['total_points']}},
+        {'total_points': bucket['total_points'], '_id': {'$gt': bucket['_id']}},
+    ]}]}) + 1
+
+
+def rank_window(leaderboard_type, match, around, db=None):
+    """
+    An entry and the ``around`` entries on either side of it, in rank order.
+    Ranks are contiguous, so this is one seek on (leaderboard_type, rank)
+    for the entry and one range scan of 2 * around + 1 for the band.
+    Returns (entry, band), or (None, []) when there is no such entry.
+    """
+    db = db if db is not None else get_db()
+    entry = db.leaderboard.find_one(dict(match, leaderboard_type=leaderboard_type))
+    if entry is None:
+        return None, []
+    band = db.leaderboard.find({
+        'leaderboard_type': leaderboard_type,
+        'rank': {'$gte': entry['rank'] - around, '$lte': entry['rank'] + around},
+    }).sort([('rank', ASCENDING), ('_id', ASCENDING)])
+    return entry, list(band)
+
+
+def rebuild_standings(db=None, progress=None, workers=1, partitions=None):
+    """
+    Rebuild both leaderboards from scratch out of the activities.
+
+    Users are hash-partitioned (``partitions``, by default one per worker
+    and at most REBUILD_PARTITION_USERS users each); each partition's points
+    are summed by a $group pipeline, in a pool of ``workers`` processes when
+    above one. The partitions come back sorted and are k-way merged into
+    rank order, so the full standings never have to be sorted in one piece.
+    Entries are written to a scratch collection of this run's own, indexed,
+    and swapped in with a single rename, so readers see either the old
+    standings or the new ones; live clients are then told to resync.
+
+    Only one rebuild runs at a time across processes (the REBUILD_LOCK
+    document; RuntimeError when another holds it). Activities written while
+    a rebuild runs are not in its standings if they land after their
+    partition was summed: the swap drops their points from the board until
+    the next rebuild, though users' stored totals keep them.
+
+    Team points are credited to each activity's team_id, as apply_points()
+    credits them, so a rebuild agrees with the incremental updates after a
+    user changes team. Ranks are ordinal with ties broken by user id (team
+    id for teams): the incremental engine relies on every entry having its
+    own rank.
+    ``progress(done, total)`` is called as partitions finish (users), and
+    at least every REBUILD_HEARTBEAT_SECONDS throughout, so a job can use it
+    as its heartbeat. Returns the number of (individual, team) entries.
+    """
+    db = db if db is not None else get_db()
+    lock = MongoLock(REBUILD_LOCK, lease=4 * REBUILD_HEARTBEAT_SECONDS, db=db)
+    if not lock.try_acquire():
+        raise RuntimeError('A leaderboard rebuild is already running')
+    try:
+        # Left behind by rebuilds that died; none can be running now
+        for name in db.list_collection_names():
+            if name.startswith(f'{REBUILD_COLLECTION}_'):
+                db[name].drop()
+        scratch = db[f'{REBUILD_COLLECTION}_{ObjectId()}']
+        try:
+            return _rebuild(db, scratch, lock, progress, workers, partitions)
+        finally:
+            # Already renamed away unless the rebuild failed
+            scratch.drop()
+    finally:
+        lock.release()
+
+
+def _rebuild(db, scratch, lock, progress, workers, partitions):
+    now = timezone.now()
+    workers = max(workers, 1)
+    if not partitions:
+        partitions = max(workers, -(-db.users.estimated_document_count() // REBUILD_PARTITION_USERS))
+    partitions = max(partitions, 1)
+    last_beat = time.monotonic()
+
+    def report(done, total, force=True):
+        nonlocal last_beat
+        if force or time.monotonic() - last_beat >= REBUILD_HEARTBEAT_SECONDS:
+            lock.renew()
+            if progress is not None:
+                progress(done, total)
+            last_beat = time.monotonic()
+
+    buckets = [[] for _ in range(partitions)]
+    for user in db.users.find({}, {'_id': 1}):
+        buckets[rebuild.partition_of(user['_id'], partitions)].append(user['_id'])
+    buckets = [bucket for bucket in buckets if bucket]
+    total = sum(len(bucket) for bucket in buckets)
+
+    results, team_points, done = [], {}, 0
+
+    def collect(result):
+        entries, points = result
+        results.append(entries)
+        for team_id, team_total in points.items():
+            team_points[team_id] = team_points.get(team_id, 0) + team_total
+
+    if workers > 1 and len(buckets) > 1:
+        settings_dict = connections['default'].settings_dict
+        with ProcessPoolExecutor(
+            max_workers=min(workers, len(buckets)), mp_context=multiprocessing.get_context('spawn'),
+            initializer=rebuild.init_worker, initargs=(settings_dict.get('CLIENT', {}), db.name)
+        ) as pool:
+            futures = {pool.submit(rebuild.partition_in_worker, bucket): len(bucket) for bucket in buckets}
+            pending = set(futures)
+            while pending:
+                finished, pending = wait(pending, timeout=REBUILD_HEARTBEAT_SECONDS, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    collect(future.result())
+                    done += futures[future]
+                report(done, total)
+    else:
+        for bucket in buckets:
+            collect(rebuild.partition_standings(db, bucket))
+            done += len(bucket)
+            report(done, total)
+
+    team_names = {}
+    for team in db.teams.find({}, {'name': 1}):
+        team_names[team['_id']] = team['name']
+        team_points.setdefault(team['_id'], 0)
+
+    batch, individual = [], 0
+    for rank, (_, _, entry) in enumerate(heapq.merge(*results), 1):
+        batch.append(dict(entry, rank=rank, leaderboard_type='individual', last_updated=now))
+        if len(batch) >= REBUILD_BATCH_SIZE:
+            scratch.insert_many(batch, ordered=False)
+            individual += len(batch)
+            batch = []
+            report(done, total, force=False)
+    if batch:
+        scratch.insert_many(batch, ordered=False)
+        individual += len(batch)
+
+    standings = sorted(team_points.items(), key=lambda item: (-item[1], item[0]))
+    teams = [
+        {'team_id': team_id, 'team_name': team_names.get(team_id), 'total_points': points,
+         'rank': rank, 'leaderboard_type': 'team', 'last_updated': now}
+        for rank, (team_id, points) in enumerate(standings, 1)
+    ]
+    if teams:
+        scratch.insert_many(teams, ordered=False)
+
+    if not individual and not teams:
+        db.leaderboard.delete_many({})
+    else:
+        for index in Leaderboard.mongo_indexes:
+            index.create(scratch)
+        with ranks_locked(db):
+            scratch.rename('leaderboard', dropTarget=True)
+    live.broker.resync()
+    return individual, len(teams)
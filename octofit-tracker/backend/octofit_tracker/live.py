@@ -0,0 +1,219 @@
+"""
+Live leaderboard updates over server-sent events.
+
+The leaderboard engine publishes every entry it moves (see
+leaderboard.apply_points) to the in-process ``broker``. Each connected
+client has a Subscription that coalesces what it has not been sent yet:
+only the latest rank and points per entry are kept, so a burst of writes
+reaches a slow client as one small batch instead of a backlog. Each move
+also carries the rank it left (``from_rank``), and the ranks of entries
+still queued are shifted by the moves that pass them, so every queued rank
+is the entry's rank after the last move. A client
+that falls more than MAX_PENDING entries behind is sent a single ``resync``
+event instead and should refetch the standings over REST; so is every
+client after a full rebuild (Broker.resync()).
+
+Events on GET /api/live/leaderboard/ (?type=individual|team, default both):
+
+    event: moves
+    data: {"leaderboard_type": "individual",
+           "moves": [{"key": "<user_id>", "rank": 3, "total_points": 420}, ...]}
+
+Moves are sorted by rank. Removing every moved key from the client's board
+and then inserting each at its rank, in that order, reproduces the server's
+standings; the entries they passed shift by one as a result. Publishers
+hand moves over in the order they were applied (leaderboard.py publishes
+while it holds the rank lock).
+
+The broker lives in the serving process, so writes reach the clients of the
+same process; run the ASGI server with one worker per broker (or put a
+shared pub/sub in front of ``publish``) when scaling out.
+"""
+import asyncio
+import json
+import threading
+from urllib.parse import parse_qs
+
+from django.conf import settings
+
+LIVE_PATH = '/api/live/leaderboard/'
+LEADERBOARD_TYPES = ('individual', 'team')
+
+MAX_PENDING = 500
+# Minimum gap between two batches to one client, so bursts coalesce
+COALESCE_SECONDS = 0.5
+KEEPALIVE_SECONDS = 15
+
+
+class Subscription:
+    """Coalescing per-client queue, fed from any thread, drained on its event loop"""
+
+    def __init__(self, loop, leaderboard_types):
+        self.loop = loop
+        self.leaderboard_types = set(leaderboard_types)
+        self.pending = {}
+        self.overflowed = False
+        self.ready = asyncio.Event()
+        self._lock = threading.Lock()
+
+    def offer(self, moves):
+        with self._lock:
+            for move in moves:
+                if move['leaderboard_type'] not in self.leaderboard_types:
+                    continue
+                self._shift_pending(move)
+                self.pending[(move['leaderboard_type'], move['key'])] = dict(move)
+            if len(self.pending) > MAX_PENDING:
+                self.pending.clear()
+                self.overflowed = True
+            notify = bool(self.pending) or self.overflowed
+        if notify:
+            self.loop.call_soon_threadsafe(self.ready.set)
+
+    def _shift_pending(self, move):
+        # The entries between the rank a mover left and the one it took
+        # moved one place the other way
+        rank = move['rank']
+        from_rank = move.get('from_rank', rank)
+        if rank < from_rank:
+            low, high, step = rank, from_rank - 1, 1
+        elif rank > from_rank:
+            low, high, step = from_rank + 1, rank, -1
+        else:
+            return
+        for (board, key), queued in self.pending.items():
+            if board == move['leaderboard_type'] and key != move['key'] and low <= queued['rank'] <= high:
+                queued['rank'] += step
+
+    def request_resync(self):
+        with self._lock:
+            self.pending.clear()
+            self.overflowed = True
+        self.loop.call_soon_threadsafe(self.ready.set)
+
+    def drain(self):
+        """Events accumulated since the last drain, as (name, payload) pairs"""
+        with self._lock:
+            pending, self.pending = self.pending, {}
+            overflowed, self.overflowed = self.overflowed, False
+            self.ready.clear()
+        if overflowed:
+            return [('resync', {'leaderboard_types': sorted(self.leaderboard_types)})]
+        events = []
+        for leaderboard_type in LEADERBOARD_TYPES:
+            moves = sorted(
+                ({'key': move['key'], 'rank': move['rank'], 'total_points': move['total_points']}
+                 for (board, _), move in pending.items() if board == leaderboard_type),
+                key=lambda move: move['rank']
+            )
+            if moves:
+                events.append(('moves', {'leaderboard_type': leaderboard_type, 'moves': moves}))
+        return events
+
+    async def next_events(self, timeout):
+        """Wait up to ``timeout`` for updates, then let a burst settle and drain it"""
+        try:
+            await asyncio.wait_for(self.ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return []
+        await asyncio.sleep(COALESCE_SECONDS)
+        return self.drain()
+
+
+class Broker:
+    def __init__(self):
+        self._subscriptions = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self, leaderboard_types=LEADERBOARD_TYPES):
+        subscription = Subscription(asyncio.get_running_loop(), leaderboard_types)
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    @property
+    def subscriber_count(self):
+        return len(self._subscriptions)
+
+    def resync(self):
+        """Tell every subscriber to refetch the standings, e.g. after a full rebuild"""
+        self._each(lambda subscription: subscription.request_resync())
+
+    def publish(self, moves):
+        """
+        Hand moved entries ({leaderboard_type, key, from_rank, rank,
+        total_points}) to every subscriber, in the order they were applied
+        """
+        if not moves:
+            return
+        self._each(lambda subscription: subscription.offer(moves))
+
+    def _each(self, call):
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            try:
+                call(subscription)
+            except RuntimeError:
+                # The subscriber's event loop has shut down
+                self.unsubscribe(subscription)
+
+
+broker = Broker()
+
+
+def format_event(name, payload):
+    return f'event: {name}\ndata: {json.dumps(payload)}\n\n'.encode('utf-8')
+
+
+def _query_types(scope):
+    params = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    requested = params.get('type', [])
+    return [board for board in LEADERBOARD_TYPES if not requested or board in requested]
+
+
+async def leaderboard_events(scope, receive, send):
+    """ASGI application streaming leaderboard moves as server-sent events"""
+    if scope['method'] not in ('GET', 'HEAD'):
+        await send({'type': 'http.response.start', 'status': 405, 'headers': [(b'allow', b'GET')]})
+        await send({'type': 'http.response.body', 'body': b''})
+        return
+
+    headers = [
+        (b'content-type', b'text/event-stream'),
+        (b'cache-control', b'no-cache'),
+        (b'x-accel-buffering', b'no'),
+    ]
+    if getattr(settings, 'CORS_ALLOW_ALL_ORIGINS', False):
+        headers.append((b'access-control-allow-origin', b'*'))
+    await send({'type': 'http.response.start', 'status': 200, 'headers': headers})
+
+    subscription = broker.subscribe(_query_types(scope))
+    disconnected = asyncio.ensure_future(_wait_for_disconnect(receive))
+    try:
+        await send({'type': 'http.response.body', 'body': b': connected\n\n', 'more_body': True})
+        while not disconnected.done():
+            waiter = asyncio.ensure_future(subscription.next_events(KEEPALIVE_SECONDS))
+            await asyncio.wait({waiter, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+            if disconnected.done():
+                waiter.cancel()
+                break
+            events = waiter.result()
+            body = b''.join(format_event(name, payload) for name, payload in events) or b': keepalive\n\n'
+            # Awaiting the send is the backpressure: while a slow client
+            # drains, its updates keep coalescing in the subscription.
+            await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+    finally:
+        broker.unsubscribe(subscription)
+        disconnected.cancel()
+
+
+async def _wait_for_disconnect(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
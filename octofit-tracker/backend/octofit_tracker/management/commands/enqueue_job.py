@@ -0,0 +1,36 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from octofit_tracker.jobs import enqueue, get_job, task_names, wait_for_jobs
+
+
+class Command(BaseCommand):
+    help = 'Queue a background job (rebuild_leaderboard, recompute_user_points, reindex) and run it'
+
+    def add_arguments(self, parser):
+        parser.add_argument('task', help=f'One of: {", ".join(task_names())}')
+        parser.add_argument('--params', default='{}', help='Job parameters as a JSON object')
+        parser.add_argument('--detach', action='store_true',
+                            help='Only queue the job, for a `manage.py run_jobs` worker to pick up')
+
+    def handle(self, *args, **options):
+        try:
+            params = json.loads(options['params'])
+            job_id = enqueue(options['task'], params, start=not options['detach'])
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        self.stdout.write(f'Queued job {job_id}')
+        if options['detach']:
+            return
+
+        started = time.monotonic()
+        wait_for_jobs()
+        job = get_job(job_id)
+        if job['state'] != 'done':
+            raise CommandError(f'Job {job_id} {job["state"]}: {job.get("error")}')
+        progress = job['progress']
+        self.stdout.write(self.style.SUCCESS(
+            f'Job {job_id} done: {progress["done"]} items in {time.monotonic() - started:.1f}s'
+        ))
@@ -1,303 +1,203 @@
+from argparse import ArgumentTypeError
 from django.core.management.base import BaseCommand
-from pymongo import MongoClient
-from datetime import datetime, timedelta
+from django.utils import timezone
+from bson import ObjectId
+from datetime import timedelta
 import random
 
+from octofit_tracker.cache import bump_versions
+from octofit_tracker.indexes import ensure_indexes
+from octofit_tracker.leaderboard import rebuild_standings, update_rollups
+from octofit_tracker.models import Activity, User, Workout
+from octofit_tracker.mongo import get_db
+from octofit_tracker.search import add_search_terms
+
+
+TEAMS = [
+    {
+        '_id': 'team_marvel',
+        'name': 'Team Marvel',
+        'description': 'Earth\'s Mightiest Heroes',
+    },
+    {
+        '_id': 'team_dc',
+        'name': 'Team DC',
+        'description': 'Justice League United',
+    },
+]
+
+# Superheroes (name, email, hero_name, team_id)
+HEROES = [
+    # Team Marvel
+    ('Tony Stark', 'ironman@marvel.com', 'Iron Man', 'team_marvel'),
+    ('Steve Rogers', 'captainamerica@marvel.com', 'Captain America', 'team_marvel'),
+    ('Natasha Romanoff', 'blackwidow@marvel.com', 'Black Widow', 'team_marvel'),
+    ('Bruce Banner', 'hulk@marvel.com', 'Hulk', 'team_marvel'),
+    ('Thor Odinson', 'thor@marvel.com', 'Thor', 'team_marvel'),
+    # Team DC
+    ('Clark Kent', 'superman@dc.com', 'Superman', 'team_dc'),
+    ('Bruce Wayne', 'batman@dc.com', 'Batman', 'team_dc'),
+    ('Diana Prince', 'wonderwoman@dc.com', 'Wonder Woman', 'team_dc'),
+    ('Barry Allen', 'flash@dc.com', 'Flash', 'team_dc'),
+    ('Arthur Curry', 'aquaman@dc.com', 'Aquaman', 'team_dc'),
+]
+
+WORKOUTS = [
+    {
+        'name': 'Super Strength Training',
+        'type': 'strength',
+        'duration_minutes': 45,
+        'calories_per_session': 400,
+        'description': 'Build strength like a superhero',
+        'difficulty': 'advanced'
+    },
+    {
+        'name': 'Speed Force Cardio',
+        'type': 'cardio',
+        'duration_minutes': 30,
+        'calories_per_session': 350,
+        'description': 'Run at lightning speed',
+        'difficulty': 'intermediate'
+    },
+    {
+        'name': 'Avenger Yoga',
+        'type': 'flexibility',
+        'duration_minutes': 60,
+        'calories_per_session': 200,
+        'description': 'Find your inner peace',
+        'difficulty': 'beginner'
+    },
+    {
+        'name': 'Justice League HIIT',
+        'type': 'hiit',
+        'duration_minutes': 25,
+        'calories_per_session': 450,
+        'description': 'High intensity heroic training',
+        'difficulty': 'advanced'
+    },
+    {
+        'name': 'Web-Slinging Workout',
+        'type': 'mixed',
+        'duration_minutes': 40,
+        'calories_per_session': 380,
+        'description': 'Full body workout',
+        'difficulty': 'intermediate'
+    },
+    {
+        'name': 'Asgardian Battle Training',
+        'type': 'strength',
+        'duration_minutes': 50,
+        'calories_per_session': 420,
+        'description': 'Train like a god',
+        'difficulty': 'advanced'
+    }
+]
+
+ACTIVITY_TYPES = ['running', 'cycling', 'swimming', 'weightlifting', 'yoga', 'hiit']
+
+
+def at_least(minimum):
+    """argparse type for an integer option of at least ``minimum``"""
+    def parse(value):
+        number = int(value)
+        if number < minimum:
+            raise ArgumentTypeError(f'must be at least {minimum}')
+        return number
+    parse.__name__ = 'integer'
+    return parse
+
 
 class Command(BaseCommand):
-    help = 'Populate the octofit_db database with test data'
+    help = 'Populate the configured database (octofit_db) with test data'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=at_least(1), default=len(HEROES),
+                            help='Number of users; beyond the superhero roster users are generated')
+        parser.add_argument('--teams', type=at_least(1), default=len(TEAMS),
+                            help='Number of teams; beyond Marvel and DC teams are generated')
+        parser.add_argument('--activities-per-user', type=at_least(1), default=None,
+                            help='Activities per user (default: random 10-20)')
+        parser.add_argument('--days', type=at_least(0), default=30,
+                            help='Spread activities over this many past days')
+        parser.add_argument('--seed', type=int, default=None,
+                            help='Random seed for reproducible ids and values (dates stay relative to now)')
+        parser.add_argument('--chunk-size', type=at_least(1), default=10000,
+                            help='Documents per insert_many batch')
+
+    def handle(self, *args, **options):
+        # Connect to the MongoDB database from settings
+        db = get_db()
 
-    def handle(self, *args, **kwargs):
-        # Connect to MongoDB
-        client = MongoClient('localhost', 27017)
-        db = client['octofit_db']
-        
         self.stdout.write(self.style.SUCCESS('Connected to MongoDB'))
-        
-        # Clear existing data
+
+        self.rng = random.Random(options['seed'])
+        self.chunk_size = options['chunk_size']
+
+        # Clear existing data. Dropping (rather than emptying) the collections
+        # lets the indexes be built once after the bulk load.
         self.stdout.write('Clearing existing data...')
-        db.users.delete_many({})
-        db.teams.delete_many({})
-        db.activities.delete_many({})
-        db.leaderboard.delete_many({})
-        db.workouts.delete_many({})
-        
-        # Create unique index on email field for users collection
-        db.users.create_index([("email", 1)], unique=True)
-        self.stdout.write(self.style.SUCCESS('Created unique index on email field'))
-        
+        for collection in ('users', 'teams', 'activities', 'leaderboard', 'workouts', 'leaderboard_rollups'):
+            db[collection].drop()
+
         # Insert Teams
-        teams_data = [
-            {
-                '_id': 'team_marvel',
-                'name': 'Team Marvel',
-                'description': 'Earth\'s Mightiest Heroes',
-                'created_at': datetime.now(),
-                'member_count': 0
-            },
-            {
-                '_id': 'team_dc',
-                'name': 'Team DC',
-                'description': 'Justice League United',
-                'created_at': datetime.now(),
-                'member_count': 0
-            }
-        ]
+        teams_data = self.build_teams(options['teams'])
         db.teams.insert_many(teams_data)
         self.stdout.write(self.style.SUCCESS(f'Inserted {len(teams_data)} teams'))
-        
-        # Insert Users (Superheroes)
-        users_data = [
-            # Team Marvel
-            {
-                'name': 'Tony Stark',
-                'email': 'ironman@marvel.com',
-                'hero_name': 'Iron Man',
-                'team_id': 'team_marvel',
-                'total_points': 0,
-                'created_at': datetime.now()
-            },
-            {
-                'name': 'Steve Rogers',
-                'email': 'captainamerica@marvel.com',
-                'hero_name': 'Captain America',
-                'team_id': 'team_marvel',
-                'total_points': 0,
-                'created_at': datetime.now()
-            },
-            {
-                'name': 'Natasha Romanoff',
-                'email': 'blackwidow@marvel.com',
-                'hero_name': 'Black Widow',
-                'team_id': 'team_marvel',
-                'total_points': 0,
-                'created_at': datetime.now()
-            },
-            {
-                'name': 'Bruce Banner',
-                'email': 'hulk@marvel.com',
-                'hero_name': 'Hulk',
-                'team_id': 'team_marvel',
-                'total_points': 0,
-                'created_at': datetime.now()
-            },
-            {
-                'name': 'Thor Odinson',
-                'email': 'thor@marvel.com',
-                'hero_name': 'Thor',
-                'team_id': 'team_marvel',
-                'total_points': 0,
-                'created_at': datetime.now()
-            },
-            # Team DC
-            {
-                'name': 'Clark Kent',
-                'email': 'superman@dc.com',
-                'hero_name': 'Superman',
-                'team_id': 'team_dc',
-                'total_points': 0,
-                'created_at': datetime.now()
-            },
-            {
-                'name': 'Bruce Wayne',
-                'email': 'batman@dc.com',
-                'hero_name': 'Batman',
-                'team_id': 'team_dc',
-                'total_points': 0,
-                'created_at': datetime.now()
-            },
-            {
-                'name': 'Diana Prince',
-                'email': 'wonderwoman@dc.com',
-                'hero_name': 'Wonder Woman',
-                'team_id': 'team_dc',
-                'total_points': 0,
-                'created_at': datetime.now()
-            },
-            {
-                'name': 'Barry Allen',
-                'email': 'flash@dc.com',
-                'hero_name': 'Flash',
-                'team_id': 'team_dc',
-                'total_points': 0,
-                'created_at': datetime.now()
-            },
-            {
-                'name': 'Arthur Curry',
-                'email': 'aquaman@dc.com',
-                'hero_name': 'Aquaman',
-                'team_id': 'team_dc',
-                'total_points': 0,
-                'created_at': datetime.now()
-            }
-        ]
-        result = db.users.insert_many(users_data)
-        user_ids = result.inserted_ids
-        self.stdout.write(self.style.SUCCESS(f'Inserted {len(users_data)} users'))
-        
-        # Update team member counts
-        db.teams.update_one({'_id': 'team_marvel'}, {'$set': {'member_count': 5}})
-        db.teams.update_one({'_id': 'team_dc'}, {'$set': {'member_count': 5}})
-        
+
         # Insert Workouts
-        workouts_data = [
-            {
-                'name': 'Super Strength Training',
-                'type': 'strength',
-                'duration_minutes': 45,
-                'calories_per_session': 400,
-                'description': 'Build strength like a superhero',
-                'difficulty': 'advanced'
-            },
-            {
-                'name': 'Speed Force Cardio',
-                'type': 'cardio',
-                'duration_minutes': 30,
-                'calories_per_session': 350,
-                'description': 'Run at lightning speed',
-                'difficulty': 'intermediate'
-            },
-            {
-                'name': 'Avenger Yoga',
-                'type': 'flexibility',
-                'duration_minutes': 60,
-                'calories_per_session': 200,
-                'description': 'Find your inner peace',
-                'difficulty': 'beginner'
-            },
-            {
-                'name': 'Justice League HIIT',
-                'type': 'hiit',
-                'duration_minutes': 25,
-                'calories_per_session': 450,
-                'description': 'High intensity heroic training',
-                'difficulty': 'advanced'
-            },
-            {
-                'name': 'Web-Slinging Workout',
-                'type': 'mixed',
-                'duration_minutes': 40,
-                'calories_per_session': 380,
-                'description': 'Full body workout',
-                'difficulty': 'intermediate'
-            },
-            {
-                'name': 'Asgardian Battle Training',
-                'type': 'strength',
-                'duration_minutes': 50,
-                'calories_per_session': 420,
-                'description': 'Train like a god',
-                'difficulty': 'advanced'
-            }
-        ]
-        result = db.workouts.insert_many(workouts_data)
-        workout_ids = result.inserted_ids
-        self.stdout.write(self.style.SUCCESS(f'Inserted {len(workouts_data)} workouts'))
-        
-        # Insert Activities (last 30 days)
-        activities_data = []
-        activity_types = ['running', 'cycling', 'swimming', 'weightlifting', 'yoga', 'hiit']
-        
-        for user_id, user in zip(user_ids, users_data):
-            # Each user has 10-20 activities
-            num_activities = random.randint(10, 20)
-            for i in range(num_activities):
-                days_ago = random.randint(0, 30)
-                activity_date = datetime.now() - timedelta(days=days_ago)
-                
-                workout = random.choice(workouts_data)
-                duration = workout['duration_minutes'] + random.randint(-10, 10)
-                calories = workout['calories_per_session'] + random.randint(-50, 50)
-                points = int(calories / 10) + random.randint(0, 20)
-                
-                activity = {
-                    'user_id': user_id,
-                    'user_email': user['email'],
-                    'user_name': user['name'],
-                    'hero_name': user['hero_name'],
-                    'team_id': user['team_id'],
-                    'activity_type': random.choice(activity_types),
-                    'workout_name': workout['name'],
-                    'duration_minutes': duration,
-                    'calories_burned': calories,
-                    'points': points,
-                    'date': activity_date,
-                    'notes': f'{user["hero_name"]} saving the world one workout at a time!'
-                }
-                activities_data.append(activity)
-        
-        db.activities.insert_many(activities_data)
-        self.stdout.write(self.style.SUCCESS(f'Inserted {len(activities_data)} activities'))
-        
-        # Calculate and update user total points
-        for user_id, user in zip(user_ids, users_data):
-            user_activities = [a for a in activities_data if a['user_id'] == user_id]
-            total_points = sum(a['points'] for a in user_activities)
-            db.users.update_one({'_id': user_id}, {'$set': {'total_points': total_points}})
-        
-        self.stdout.write(self.style.SUCCESS('Updated user total points'))
-        
-        # Insert Leaderboard entries
-        leaderboard_data = []
-        
-        # Individual leaderboard
-        users_with_points = []
-        for user_id, user in zip(user_ids, users_data):
-            user_activities = [a for a in activities_data if a['user_id'] == user_id]
-            total_points = sum(a['points'] for a in user_activities)
-            users_with_points.append({
-                'user_id': user_id,
-                'user_email': user['email'],
-                'user_name': user['name'],
-                'hero_name': user['hero_name'],
-                'team_id': user['team_id'],
-                'total_points': total_points
-            })
-        
-        users_with_points.sort(key=lambda x: x['total_points'], reverse=True)
-        
-        for rank, user_data in enumerate(users_with_points, 1):
-            leaderboard_entry = {
-                'user_id': user_data['user_id'],
-                'user_email': user_data['user_email'],
-                'user_name': user_data['user_name'],
-                'hero_name': user_data['hero_name'],
-                'team_id': user_data['team_id'],
-                'total_points': user_data['total_points'],
-                'rank': rank,
-                'leaderboard_type': 'individual',
-                'last_updated': datetime.now()
-            }
-            leaderboard_data.append(leaderboard_entry)
-        
-        # Team leaderboard
-        team_points = {}
-        for team_data in teams_data:
-            team_id = team_data['_id']
-            team_activities = [a for a in activities_data if a['team_id'] == team_id]
-            total_points = sum(a['points'] for a in team_activities)
-            team_points[team_id] = {
-                'team_id': team_id,
-                'team_name': team_data['name'],
-                'total_points': total_points
-            }
-        
-        sorted_teams = sorted(team_points.values(), key=lambda x: x['total_points'], reverse=True)
-        
-        for rank, team_data in enumerate(sorted_teams, 1):
-            leaderboard_entry = {
-                'team_id': team_data['team_id'],
-                'team_name': team_data['team_name'],
-                'total_points': team_data['total_points'],
-                'rank': rank,
-                'leaderboard_type': 'team',
-                'last_updated': datetime.now()
-            }
-            leaderboard_data.append(leaderboard_entry)
-        
-        db.leaderboard.insert_many(leaderboard_data)
-        self.stdout.write(self.style.SUCCESS(f'Inserted {len(leaderboard_data)} leaderboard entries'))
-        
+        db.workouts.insert_many(add_search_terms(Workout, [dict(workout) for workout in WORKOUTS]))
+        self.stdout.write(self.style.SUCCESS(f'Inserted {len(WORKOUTS)} workouts'))
+
+        # Insert Users and their Activities, streamed in chunks. Each user's
+        # activities are generated before the user document is written, so
+        # totals are known up front and never need a second pass.
+        team_ids = [team['_id'] for team in teams_data]
+        user_count = 0
+        member_counts = dict.fromkeys(team_ids, 0)
+        users_chunk, activities_chunk = [], []
+        activity_count = 0
+
+        for user in self.generate_users(options['users'], team_ids):
+            total_points = 0
+            for activity in self.generate_activities(user, options['activities_per_user'], options['days']):
+                total_points += activity['points']
+                activities_chunk.append(activity)
+                if len(activities_chunk) >= self.chunk_size:
+                    activity_count += self.flush_activities(db, activities_chunk)
+                    activities_chunk = []
+
+            user['total_points'] = total_points
+            users_chunk.append(user)
+            if len(users_chunk) >= self.chunk_size:
+                db.users.insert_many(add_search_terms(User, users_chunk), ordered=False)
+                users_chunk = []
+
+            member_counts[user['team_id']] += 1
+            user_count += 1
+
+        if users_chunk:
+            db.users.insert_many(add_search_terms(User, users_chunk), ordered=False)
+        if activities_chunk:
+            activity_count += self.flush_activities(db, activities_chunk)
+        self.stdout.write(self.style.SUCCESS(f'Inserted {user_count} users'))
+        self.stdout.write(self.style.SUCCESS(f'Inserted {activity_count} activities'))
+        self.stdout.write(self.style.SUCCESS('Updated leaderboard rollups'))
+
+        # Update team member counts
+        for team_id, count in member_counts.items():
+            db.teams.update_one({'_id': team_id}, {'$set': {'member_count': count}})
+
+        # Rank the users and teams from the activities just written
+        individual, teams = rebuild_standings(db)
+        self.stdout.write(self.style.SUCCESS(f'Inserted {individual + teams} leaderboard entries'))
+
+        # Create the indexes declared in models.py (including the unique email index)
+        created = ensure_indexes(db)
+        self.stdout.write(self.style.SUCCESS(f'Created {len(created)} indexes'))
+
+        # Cached responses and validators of every process predate this data
+        bump_versions('users', 'teams', 'activities', 'leaderboard', 'workouts')
+
         # Display summary
         self.stdout.write(self.style.SUCCESS('\n=== Database Population Complete ==='))
         self.stdout.write(f'Users: {db.users.count_documents({})}')
@@ -305,6 +205,79 @@ class Command(BaseCommand):
         self.stdout.write(f'Activities: {db.activities.count_documents({})}')
         self.stdout.write(f'Workouts: {db.workouts.count_documents({})}')
         self.stdout.write(f'Leaderboard entries: {db.leaderboard.count_documents({})}')
-        
-        client.close()
+
         self.stdout.write(self.style.SUCCESS('\nDatabase populated successfully!'))
+
+    def build_teams(self, count):
+        teams = [dict(team) for team in TEAMS[:count]]
+        for n in range(len(teams) + 1, count + 1):
+            teams.append({
+                '_id': f'team_{n}',
+                'name': f'Team {n}',
+                'description': f'Generated team number {n}',
+            })
+        for team in teams:
+            team['created_at'] = timezone.now()
+            team['member_count'] = 0
+        return teams
+
+    def generate_users(self, count, team_ids):
+        """The superhero roster first, then generated users spread over the teams"""
+        for n in range(count):
+            if n < len(HEROES):
+                name, email, hero_name, team_id = HEROES[n]
+                if team_id not in team_ids:
+                    team_id = team_ids[n % len(team_ids)]
+            else:
+                name = f'Generated User {n + 1}'
+                email = f'user{n + 1}@octofit.dev'
+                hero_name = f'Hero {n + 1}'
+                team_id = team_ids[n % len(team_ids)]
+            yield {
+                '_id': self.object_id(),
+                'name': name,
+                'email': email,
+                'hero_name': hero_name,
+                'team_id': team_id,
+                'total_points': 0,
+                'created_at': timezone.now()
+            }
+
+    def generate_activities(self, user, per_user, days):
+        # Each user has 10-20 activities unless a fixed count was requested
+        num_activities = per_user if per_user is not None else self.rng.randint(10, 20)
+        now = timezone.now()
+        for i in range(num_activities):
+            days_ago = self.rng.randint(0, days)
+            activity_date = now - timedelta(days=days_ago)
+
+            workout = self.rng.choice(WORKOUTS)
+            duration = workout['duration_minutes'] + self.rng.randint(-10, 10)
+            calories = workout['calories_per_session'] + self.rng.randint(-50, 50)
+            points = int(calories / 10) + self.rng.randint(0, 20)
+
+            yield {
+                '_id': self.object_id(),
+                'user_id': str(user['_id']),
+                'user_email': user['email'],
+                'user_name': user['name'],
+                'hero_name': user['hero_name'],
+                'team_id': user['team_id'],
+                'activity_type': self.rng.choice(ACTIVITY_TYPES),
+                'workout_name': workout['name'],
+                'duration_minutes': duration,
+                'calories_burned': calories,
+                'points': points,
+                'date': activity_date,
+                'notes': f'{user["hero_name"]} saving the world one workout at a time!'
+            }
+
+    def object_id(self):
+        """An ObjectId drawn from the seeded generator, so --seed fixes ids and cursors too"""
+        return ObjectId(self.rng.randbytes(12))
+
+    def flush_activities(self, db, activities):
+        """Insert a chunk of activities and fold it into the rollup buckets"""
+        db.activities.insert_many(add_search_terms(Activity, activities), ordered=False)
+        update_rollups(activities, db=db)
+        return len(activities)
@@ -0,0 +1,40 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from octofit_tracker.cache import bump_versions
+from octofit_tracker.leaderboard import rebuild_standings
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the individual and team leaderboards from the activities and swap them in'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Processes aggregating partitions in parallel (1: in this process)')
+        parser.add_argument('--partitions', type=int, default=None,
+                            help='Hash partitions of the users (default: one per worker, '
+                                 'more for large user counts)')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        reported = set()
+
+        def progress(done, total):
+            # Repeats are heartbeats
+            if done not in reported:
+                reported.add(done)
+                self.stdout.write(f'  {done}/{total} users aggregated')
+
+        try:
+            individual, teams = rebuild_standings(
+                workers=options['workers'], partitions=options['partitions'], progress=progress
+            )
+        except RuntimeError as exc:
+            raise CommandError(str(exc))
+        bump_versions('leaderboard', 'users')
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt leaderboard: {individual} users and {teams} teams ranked '
+            f'in {time.monotonic() - started:.1f}s'
+        ))
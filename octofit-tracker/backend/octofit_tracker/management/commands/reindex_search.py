@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from octofit_tracker.mongo import get_db
+from octofit_tracker.search import reindex, searchable_models
+
+
+class Command(BaseCommand):
+    help = 'Recompute the _search terms behind ?search= for users, workouts and activities'
+
+    def add_arguments(self, parser):
+        parser.add_argument('collections', nargs='*',
+                            help='Collections to reindex (default: all searchable ones)')
+
+    def handle(self, *args, **options):
+        db = get_db()
+        models = {model._meta.db_table: model for model in searchable_models()}
+        names = options['collections'] or list(models)
+        unknown = set(names) - set(models)
+        if unknown:
+            raise CommandError(f'Not searchable: {", ".join(sorted(unknown))}')
+
+        for name in names:
+            updated = reindex(models[name], db=db)
+            self.stdout.write(self.style.SUCCESS(f'Reindexed {name}: {updated} documents updated'))
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from octofit_tracker.jobs import get_runner, recent_jobs, requeue_stale, wait_for_jobs
+
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs, including abandoned ones, until the queue is empty'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--forever', action='store_true',
+                            help='Keep polling the queue instead of exiting when it is empty')
+        parser.add_argument('--interval', type=float, default=5.0, help='Seconds between polls with --forever')
+
+    def handle(self, *args, **options):
+        while True:
+            requeued = requeue_stale()
+            if requeued:
+                self.stdout.write(f'Requeued {requeued} abandoned jobs')
+            if recent_jobs(state='queued', limit=1):
+                get_runner().kick()
+                wait_for_jobs()
+            if not options['forever']:
+                break
+            time.sleep(options['interval'])
+        failed = len(recent_jobs(state='failed'))
+        self.stdout.write(self.style.SUCCESS(f'Queue drained ({failed} recent failed jobs)'))
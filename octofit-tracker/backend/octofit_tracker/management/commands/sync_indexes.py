@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand
+
+from octofit_tracker.indexes import diff_indexes, live_leading_fields
+from octofit_tracker.mongo import get_db
+
+
+class Command(BaseCommand):
+    help = 'Create or drop MongoDB indexes to match the declarations in models.py'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report what would change')
+        parser.add_argument('--keep-extra', action='store_true',
+                            help='Do not drop live indexes that are not declared')
+
+    def handle(self, *args, **options):
+        db = get_db()
+        dry_run = options['dry_run']
+        missing, extra = diff_indexes(db)
+
+        for collection_name, index in missing:
+            self.stdout.write(f'{"Would create" if dry_run else "Creating"} {collection_name}.{index.name}')
+            if not dry_run:
+                index.create(db[collection_name])
+
+        if not options['keep_extra']:
+            for collection_name, name in extra:
+                self.stdout.write(f'{"Would drop" if dry_run else "Dropping"} {collection_name}.{name}')
+                if not dry_run:
+                    db[collection_name].drop_index(name)
+
+        if not missing and (options['keep_extra'] or not extra):
+            self.stdout.write(self.style.SUCCESS('Indexes already in sync'))
+        elif not dry_run:
+            self.stdout.write(self.style.SUCCESS('Indexes synced'))
+
+        self.report_collection_scans(db)
+
+    def report_collection_scans(self, db):
+        """Warn about viewset filters and default orderings no live index can serve"""
+        from octofit_tracker.urls import router
+
+        scans = []
+        for prefix, viewset, _ in router.registry:
+            model = viewset.queryset.model
+            indexed = live_leading_fields(db, model._meta.db_table)
+            for field in getattr(viewset, 'filterset_fields', None) or []:
+                if field not in indexed:
+                    scans.append(f'{viewset.__name__}: /api/{prefix}/?{field}= falls back to a collection scan')
+            ordering = getattr(viewset, 'ordering', None) or []
+            if ordering and ordering[0].lstrip('-') not in indexed:
+                scans.append(f'{viewset.__name__}: default ordering {ordering[0]} is sorted in memory')
+
+        for message in scans:
+            self.stdout.write(self.style.WARNING(message))
@@ -1,6 +1,8 @@
 from djongo import models
 from django.utils import timezone
 
+from .indexes import MongoIndex
+
 
 class Team(models.Model):
     _id = models.CharField(max_length=100, primary_key=True, db_column='_id')
@@ -28,6 +30,15 @@ class User(models.Model):
     class Meta:
         db_table = 'users'
 
+    mongo_indexes = [
+        MongoIndex('email', unique=True),
+        MongoIndex('team_id', '-total_points'),
+        MongoIndex('-total_points', '-_id'),
+        MongoIndex('_search'),
+    ]
+
+    search_weights = {'name': 3, 'hero_name': 3, 'email': 1}
+
     def __str__(self):
         return f"{self.name} ({self.hero_name})"
 
@@ -44,6 +55,12 @@ class Workout(models.Model):
     class Meta:
         db_table = 'workouts'
 
+    mongo_indexes = [
+        MongoIndex('_search'),
+    ]
+
+    search_weights = {'name': 3, 'description': 1}
+
     def __str__(self):
         return self.name
 
@@ -67,6 +84,16 @@ class Activity(models.Model):
         db_table = 'activities'
         ordering = ['-date']
 
+    mongo_indexes = [
+        MongoIndex('-date', '-_id'),
+        MongoIndex('user_id', '-date'),
+        MongoIndex('team_id', '-date'),
+        MongoIndex('activity_type', '-date'),
+        MongoIndex('_search'),
+    ]
+
+    search_weights = {'hero_name': 3, 'user_name': 2, 'workout_name': 2}
+
     def __str__(self):
         return f"{self.hero_name} - {self.activity_type} ({self.date.strftime('%Y-%m-%d')})"
 
@@ -92,6 +119,12 @@ class Leaderboard(models.Model):
         db_table = 'leaderboard'
         ordering = ['leaderboard_type', 'rank']
 
+    mongo_indexes = [
+        MongoIndex('leaderboard_type', 'rank'),
+        MongoIndex('leaderboard_type', 'user_id'),
+        MongoIndex('leaderboard_type', 'team_id'),
+    ]
+
     def __str__(self):
         if self.leaderboard_type == 'individual':
             return f"#{self.rank} {self.hero_name} - {self.total_points} pts"
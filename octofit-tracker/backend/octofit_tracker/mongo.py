@@ -0,0 +1,101 @@
+"""
+Direct pymongo access for code paths that need native MongoDB operations
+(atomic $inc updates, aggregation pipelines, bulk writes) which djongo's
+SQL translation layer cannot express.
+"""
+import time
+import uuid
+from datetime import timedelta
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from django.db import connections
+from django.utils import timezone
+from pymongo.errors import DuplicateKeyError
+
+LOCKS_COLLECTION = 'locks'
+
+
+def get_db(using='default'):
+    """Return the pymongo Database behind the Django connection"""
+    connection = connections[using]
+    connection.ensure_connection()
+    return connection.connection
+
+
+def id_variants(value):
+    """
+    Values a stored id may take. Older populate_db data holds user ids as
+    ObjectId while the API stores them as strings, so lookups have to match
+    both forms.
+    """
+    if value is None:
+        return []
+    variants = [str(value)]
+    try:
+        variants.append(ObjectId(str(value)))
+    except (InvalidId, TypeError):
+        pass
+    return variants
+
+
+class LockLost(Exception):
+    """The lease of a held MongoLock ran out and another owner took it"""
+
+
+class MongoLock:
+    """
+    A named lock shared by every process using the database.
+
+    The lock is a document in ``locks`` naming its owner and when its lease
+    runs out. Acquiring it is one upsert that only matches an expired
+    document, so a holder that died releases the lock when its lease ends.
+    Holders of long critical sections call renew() well within ``lease``
+    seconds.
+    """
+
+    def __init__(self, name, lease=30, db=None):
+        self.name = name
+        self.lease = lease
+        self.db = db if db is not None else get_db()
+        self.owner = uuid.uuid4().hex
+
+    def try_acquire(self):
+        now = timezone.now()
+        try:
+            self.db[LOCKS_COLLECTION].update_one(
+                {'_id': self.name, '$or': [{'expires_at': {'$lte': now}}, {'owner': self.owner}]},
+                {'$set': {'owner': self.owner, 'expires_at': now + timedelta(seconds=self.lease)}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            return False
+        return True
+
+    def acquire(self, timeout=None):
+        """Wait for the lock, at most ``timeout`` seconds (TimeoutError)"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        delay = 0.001
+        while not self.try_acquire():
+            if deadline is not None and time.monotonic() >= deadline:
+                raise TimeoutError(f'Lock {self.name!r} is held elsewhere')
+            time.sleep(delay)
+            delay = min(delay * 2, 0.05)
+
+    def renew(self):
+        expires_at = timezone.now() + timedelta(seconds=self.lease)
+        renewed = self.db[LOCKS_COLLECTION].update_one(
+            {'_id': self.name, 'owner': self.owner}, {'$set': {'expires_at': expires_at}}
+        )
+        if not renewed.matched_count:
+            raise LockLost(f'Lock {self.name!r} expired while held')
+
+    def release(self):
+        self.db[LOCKS_COLLECTION].delete_one({'_id': self.name, 'owner': self.owner})
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
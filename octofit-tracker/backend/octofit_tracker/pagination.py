@@ -0,0 +1,227 @@
+"""
+Keyset (cursor) pagination.
+
+Pages are addressed by the last row seen rather than by an offset: the
+cursor carries the value of the ordering field plus the row's ``_id`` as a
+tie-breaker, and the next page is ``WHERE (field, _id) > (value, id)`` in the
+ordering direction. Every page therefore costs the same index range scan as
+the first one, however deep the client pages.
+"""
+import base64
+import json
+from collections import OrderedDict
+from datetime import date, datetime, timezone
+
+from bson.errors import InvalidId
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Q
+from pymongo import ASCENDING, DESCENDING
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+def _value(row, name):
+    if isinstance(row, dict):
+        return row.get(name)
+    return getattr(row, name)
+
+
+class KeysetPagination(BasePagination):
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+
+        if isinstance(queryset, (list, tuple)):
+            model = queryset[0].__class__ if queryset else None
+            ordering = getattr(view, 'ordering', None) or ['pk']
+            return self.paginate_rows(queryset, request, model, ordering)
+
+        model = queryset.model
+        ordering = list(queryset.query.order_by or model._meta.ordering
+                        or getattr(view, 'ordering', None) or ['pk'])
+        self.field = ordering[0].lstrip('-')
+        self.descending = ordering[0].startswith('-')
+        self.pk_name = model._meta.pk.attname
+
+        cursor = self.decode_cursor(request, model)
+        reverse = bool(cursor and cursor['reverse'])
+        return self.finish_page(self.slice_queryset(queryset, cursor, reverse), cursor, reverse)
+
+    def paginate_rows(self, rows, request, model, ordering):
+        """
+        Keyset pagination over rows already in memory (model instances or
+        raw documents), e.g. ranked search results. Documents without a
+        ``model`` are told apart by their ``_id``.
+        """
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.field = ordering[0].lstrip('-')
+        self.descending = ordering[0].startswith('-')
+        if model is None:
+            self.pk_name = '_id' if rows and isinstance(rows[0], dict) else 'pk'
+        elif rows and isinstance(rows[0], dict):
+            self.pk_name = model._meta.pk.column
+        else:
+            self.pk_name = model._meta.pk.attname
+
+        cursor = self.decode_cursor(request, model)
+        reverse = bool(cursor and cursor['reverse'])
+        return self.finish_page(self.slice_rows(rows, cursor, reverse), cursor, reverse)
+
+    def finish_page(self, rows, cursor, reverse):
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+            self.has_previous, self.has_next = has_more, True
+        else:
+            self.has_previous, self.has_next = cursor is not None, has_more
+        self.first_row = rows[0] if rows else None
+        self.last_row = rows[-1] if rows else None
+        if not rows:
+            self.has_previous = self.has_next = False
+        return rows
+
+    def paginate_documents(self, collection, query, ordering, request, model, projection=None):
+        """
+        Keyset pagination over a raw pymongo collection, issuing the same
+        cursors as paginate_queryset so both read paths are interchangeable.
+        """
+        query, sort, limit = self.document_page_query(query, ordering, request, model)
+        documents = collection.find(query, projection).sort(sort).limit(limit)
+        return self.finish_document_page(list(documents))
+
+    def document_page_query(self, query, ordering, request, model):
+        """
+        (query, sort, limit) fetching the requested page, for any Mongo
+        driver; hand the fetched documents to finish_document_page.
+        Documents without a ``model`` are told apart by their ``_id``,
+        compared as stored in the cursor.
+        """
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.field = ordering[0].lstrip('-')
+        self.descending = ordering[0].startswith('-')
+        self.pk_name = model._meta.pk.column if model is not None else '_id'
+
+        cursor = self.decode_cursor(request, model)
+        reverse = bool(cursor and cursor['reverse'])
+        descending = self.descending != reverse
+        if cursor is not None:
+            op = '$lt' if descending else '$gt'
+            query = {'$and': [query, {'$or': [
+                {self.field: {op: cursor['value']}},
+                {self.field: cursor['value'], self.pk_name: {op: cursor['pk']}},
+            ]}]}
+        direction = DESCENDING if descending else ASCENDING
+        self.document_cursor = cursor
+        return query, [(self.field, direction), (self.pk_name, direction)], self.page_size + 1
+
+    def finish_document_page(self, documents):
+        cursor = self.document_cursor
+        return self.finish_page(documents, cursor, bool(cursor and cursor['reverse']))
+
+    def slice_queryset(self, queryset, cursor, reverse):
+        # Walking backwards flips both the comparison and the sort order
+        descending = self.descending != reverse
+        prefix = '-' if descending else ''
+        if cursor is not None:
+            op = 'lt' if descending else 'gt'
+            queryset = queryset.filter(
+                Q(**{f'{self.field}__{op}': cursor['value']})
+                | Q(**{self.field: cursor['value'], f'{self.pk_name}__{op}': cursor['pk']})
+            )
+        queryset = queryset.order_by(prefix + self.field, prefix + self.pk_name)
+        return list(queryset[:self.page_size + 1])
+
+    def slice_rows(self, rows, cursor, reverse):
+        descending = self.descending != reverse
+        rows = sorted(rows, key=self.sort_key, reverse=descending)
+        if cursor is not None:
+            position = (cursor['value'], str(cursor['pk']))
+            if descending:
+                rows = [row for row in rows if self.sort_key(row) < position]
+            else:
+                rows = [row for row in rows if self.sort_key(row) > position]
+        return rows[:self.page_size + 1]
+
+    def sort_key(self, row):
+        return _value(row, self.field), str(_value(row, self.pk_name))
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            data = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+            if data['f'] != self.field:
+                raise ValueError('cursor was issued for another ordering')
+            value = data['v']
+            pk = data['pk']
+            if model is not None:
+                try:
+                    value = model._meta.get_field(self.field).to_python(value)
+                except FieldDoesNotExist:
+                    pass  # a computed ordering such as search_score
+                pk = model._meta.pk.to_python(pk)
+        except (InvalidId, TypeError, ValueError, KeyError, UnicodeDecodeError, json.JSONDecodeError):
+            raise NotFound(self.invalid_cursor_message)
+        return {'value': value, 'pk': pk, 'reverse': bool(data.get('r'))}
+
+    def encode_cursor(self, row, reverse=False):
+        value = _value(row, self.field)
+        if isinstance(value, datetime) and value.tzinfo is None:
+            # pymongo hands back naive UTC datetimes
+            value = value.replace(tzinfo=timezone.utc)
+        if isinstance(value, (datetime, date)):
+            value = value.isoformat()
+        data = {'f': self.field, 'v': value, 'pk': str(_value(row, self.pk_name))}
+        if reverse:
+            data['r'] = 1
+        encoded = base64.urlsafe_b64encode(json.dumps(data).encode('utf-8')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.encode_cursor(self.last_row)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        return self.encode_cursor(self.first_row, reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
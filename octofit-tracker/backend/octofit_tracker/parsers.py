@@ -0,0 +1,53 @@
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser, JSONParser
+
+from . import fastjson
+
+
+class FastJSONParser(JSONParser):
+    """JSONParser backed by orjson when it is installed"""
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if not fastjson.HAVE_ORJSON:
+            return super().parse(stream, media_type, parser_context)
+        try:
+            return fastjson.loads(stream.read())
+        except ValueError as exc:
+            raise ParseError(f'JSON parse error - {exc}')
+
+
+class MalformedLine:
+    """Placeholder for an NDJSON line that is not valid JSON"""
+
+    def __init__(self, message):
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+
+class NDJSONParser(BaseParser):
+    """
+    Newline-delimited JSON: one document per line. Blank lines are skipped
+    and malformed lines become MalformedLine items, so one bad record does
+    not reject the rest of the upload.
+    """
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        items = []
+        try:
+            for line in stream:
+                line = line.decode(encoding).strip()
+                if not line:
+                    continue
+                try:
+                    items.append(fastjson.loads(line))
+                except ValueError as exc:
+                    items.append(MalformedLine(f'Malformed JSON: {exc}'))
+        except UnicodeDecodeError as exc:
+            raise ParseError(f'NDJSON parse error - {exc}')
+        return items
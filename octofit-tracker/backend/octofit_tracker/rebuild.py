@@ -0,0 +1,86 @@
+"""
+Partition work for the full leaderboard rebuild (leaderboard.rebuild_standings).
+
+Users are split into partitions by a hash of their id. For each partition
+one $group pipeline sums the points of its users' activities, and the
+users' entries come back sorted best first, ready for a k-way merge. Team
+points are summed by each activity's own team_id, as the incremental
+updates credit them, so a user's points from before a team change stay
+with the old team until the change is propagated to their activities.
+
+This module imports no Django code, so a spawned worker process only needs
+pymongo: init_worker() opens the process's own MongoClient.
+"""
+import zlib
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import MongoClient, UpdateOne
+
+USER_FIELDS = {'_id': 1, 'email': 1, 'name': 1, 'hero_name': 1, 'team_id': 1, 'total_points': 1}
+
+_db = None
+
+
+def partition_of(user_id, partitions):
+    """Stable partition number of a user id, whether stored as ObjectId or string"""
+    return zlib.crc32(str(user_id).encode('utf-8')) % partitions
+
+
+def _variants(user_id):
+    # mongo.id_variants without the Django import
+    variants = [str(user_id)]
+    try:
+        variants.append(ObjectId(str(user_id)))
+    except (InvalidId, TypeError):
+        pass
+    return variants
+
+
+def partition_standings(db, user_ids):
+    """
+    (entries, team points) for one partition of users. Entries are
+    (-total_points, user_id, entry) tuples, best first, with points summed
+    from their activities; team points are {team_id: points} of the same
+    activities by their team_id. Stored user totals that disagree are
+    corrected on the way, unless they moved since they were read: the users
+    are read before the activities are summed, so a total that moved
+    includes points the sum may have missed.
+    """
+    users = list(db.users.find({'_id': {'$in': list(user_ids)}}, USER_FIELDS))
+    variants = [variant for user_id in user_ids for variant in _variants(user_id)]
+    totals, team_points = {}, {}
+    for row in db.activities.aggregate([
+        {'$match': {'user_id': {'$in': variants}}},
+        {'$group': {'_id': {'user_id': {'$toString': '$user_id'}, 'team_id': '$team_id'},
+                    'total_points': {'$sum': '$points'}}},
+    ], allowDiskUse=True):
+        user_id, team_id = row['_id']['user_id'], row['_id'].get('team_id')
+        totals[user_id] = totals.get(user_id, 0) + row['total_points']
+        if team_id:
+            team_points[team_id] = team_points.get(team_id, 0) + row['total_points']
+
+    entries, corrections = [], []
+    for user in users:
+        user_id = str(user['_id'])
+        points = totals.get(user_id, 0)
+        if user.get('total_points') != points:
+            corrections.append(UpdateOne({'_id': user['_id'], 'total_points': user.get('total_points')},
+                                         {'$set': {'total_points': points}}))
+        entries.append((-points, user_id, {
+            'user_id': user_id, 'user_email': user.get('email'), 'user_name': user.get('name'),
+            'hero_name': user.get('hero_name'), 'team_id': user.get('team_id'), 'total_points': points,
+        }))
+    if corrections:
+        db.users.bulk_write(corrections, ordered=False)
+    entries.sort(key=lambda entry: entry[:2])
+    return entries, team_points
+
+
+def init_worker(client_settings, database_name):
+    global _db
+    _db = MongoClient(**client_settings)[database_name]
+
+
+def partition_in_worker(user_ids):
+    return partition_standings(_db, user_ids)
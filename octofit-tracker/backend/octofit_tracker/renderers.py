@@ -0,0 +1,26 @@
+from rest_framework.renderers import JSONRenderer
+
+from . import fastjson
+from .instrumentation import timer
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer backed by orjson when it is installed. Indented output (the
+    browsable API, ?indent=) and installs without orjson go through DRF's
+    stdlib path with an ObjectId-aware encoder.
+    """
+    encoder_class = fastjson.OctofitJSONEncoder
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with timer('render'):
+            return self._render(data, accepted_media_type, renderer_context)
+
+    def _render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        renderer_context = renderer_context or {}
+        if not fastjson.HAVE_ORJSON or self.get_indent(accepted_media_type, renderer_context):
+            return super().render(data, accepted_media_type, renderer_context)
+        # Match JSONRenderer, which escapes these for embedding in JavaScript
+        return fastjson.dumps(data).replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
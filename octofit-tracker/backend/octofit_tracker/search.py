@@ -0,0 +1,166 @@
+"""
+Indexed, ranked search.
+
+Models list their searchable fields with a weight in ``search_weights``.
+Every document of such a model carries a ``_search`` array holding each
+word of those fields together with all of its prefixes, under a multikey
+index. ``?search=iron ma`` then becomes an index seek,
+``{'_search': {'$all': ['iron', 'ma']}}``, instead of a case-insensitive
+regex scan over every document, and matches word prefixes as the user
+types. Unlike SearchFilter's substring match, a query word only matches
+the start of a word: "man" finds "Iron Man" but not "Superman".
+
+Matches are ranked by relevance: a query word matching a whole word scores
+twice the field's weight, a prefix match scores the weight. Each document
+keeps the best score of every one of its terms in ``_search_scores``, so
+the ranking is an $addFields summing those scores followed by a $sort and
+the page's $limit, all in Mongo, over every match. Without an explicit
+?ordering= the list is returned in relevance order.
+"""
+import re
+
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from rest_framework import filters
+
+from .mongo import get_db
+
+SEARCH_FIELD = '_search'
+SCORE_FIELD = '_search_scores'
+RELEVANCE_FIELD = 'search_score'
+RANKED_ORDERING = ['-' + RELEVANCE_FIELD]
+MAX_PREFIX_LENGTH = 20
+REINDEX_BATCH_SIZE = 1000
+
+_WORD = re.compile(r'\w+')
+
+
+def tokenize(text):
+    return _WORD.findall(str(text).lower()) if text else []
+
+
+def search_columns(model):
+    """Document keys of the model's weighted search fields"""
+    return {model._meta.get_field(name).column: weight for name, weight in model.search_weights.items()}
+
+
+def search_scores(model, document):
+    """{term: best score} for every word of a document's search fields and its prefixes"""
+    scores = {}
+    for column, weight in search_columns(model).items():
+        for word in tokenize(document.get(column)):
+            word = word[:MAX_PREFIX_LENGTH]
+            for length in range(1, len(word) + 1):
+                score = 2 * weight if length == len(word) else weight
+                if score > scores.get(word[:length], 0):
+                    scores[word[:length]] = score
+    return scores
+
+
+def search_document(model, document):
+    """The ``_search`` and ``_search_scores`` fields of a document"""
+    scores = search_scores(model, document)
+    return {SEARCH_FIELD: sorted(scores), SCORE_FIELD: scores}
+
+
+def add_search_terms(model, documents):
+    """Set the search fields on raw documents about to be inserted with pymongo"""
+    for document in documents:
+        document.update(search_document(model, document))
+    return documents
+
+
+def index_instance(instance, db=None):
+    """Refresh the search fields after an ORM write"""
+    db = db if db is not None else get_db()
+    model = type(instance)
+    document = {field.column: field.value_from_object(instance) for field in model._meta.concrete_fields}
+    db[model._meta.db_table].update_one(
+        {model._meta.pk.column: instance.pk}, {'$set': search_document(model, document)}
+    )
+
+
+def reindex(model, db=None, query=None):
+    """Recompute the search fields of every document (or those matching ``query``)"""
+    db = db if db is not None else get_db()
+    collection = db[model._meta.db_table]
+    projection = dict.fromkeys(search_columns(model), 1)
+    requests, count = [], 0
+    for document in collection.find(query or {}, projection).batch_size(REINDEX_BATCH_SIZE):
+        requests.append(UpdateOne({'_id': document['_id']},
+                                  {'$set': search_document(model, document)}))
+        if len(requests) >= REINDEX_BATCH_SIZE:
+            count += collection.bulk_write(requests, ordered=False).modified_count
+            requests = []
+    if requests:
+        count += collection.bulk_write(requests, ordered=False).modified_count
+    return count
+
+
+def search_clause(text):
+    """Query clause matching documents that contain every query word as a prefix"""
+    words = tokenize(text)
+    if not words:
+        return None
+    return {SEARCH_FIELD: {'$all': sorted({word[:MAX_PREFIX_LENGTH] for word in words})}}
+
+
+def relevance(text):
+    """Aggregation expression scoring a matching document for a query"""
+    return {'$add': [{'$ifNull': [f'${SCORE_FIELD}.{word[:MAX_PREFIX_LENGTH]}', 0]}
+                     for word in tokenize(text)]}
+
+
+def ranked_pipeline(query, text, page_query=None, sort=None, limit=0, projection=None):
+    """
+    Aggregation pipeline returning the documents matching ``query``, best
+    first, each with its ``search_score``. ``query`` must already include
+    search_clause(text); ``page_query``, ``sort`` and ``limit`` select a
+    page, as KeysetPagination.document_page_query builds them for
+    RANKED_ORDERING.
+    """
+    pipeline = [{'$match': query}, {'$addFields': {RELEVANCE_FIELD: relevance(text)}}]
+    if page_query:
+        pipeline.append({'$match': page_query})
+    pipeline.append({'$sort': dict(sort or [(RELEVANCE_FIELD, DESCENDING), ('_id', ASCENDING)])})
+    if limit:
+        pipeline.append({'$limit': limit})
+    if projection is not None:
+        pipeline.append({'$project': dict(projection, **{RELEVANCE_FIELD: 1})})
+    return pipeline
+
+
+class SearchIndexFilter(filters.SearchFilter):
+    """
+    SearchFilter replacement that seeks the ``_search`` index. On the ORM
+    path it narrows the queryset to the matching primary keys; relevance
+    ordering is applied by MongoReadMixin.list.
+    """
+
+    def get_search_text(self, request):
+        return ' '.join(self.get_search_terms(request))
+
+    def filter_queryset(self, request, queryset, view):
+        model = queryset.model
+        clause = search_clause(self.get_search_text(request))
+        if clause is None or not hasattr(model, 'search_weights'):
+            return super().filter_queryset(request, queryset, view)
+        pk = model._meta.pk
+        documents = get_db()[model._meta.db_table].find(clause, {pk.column: 1})
+        return queryset.filter(pk__in=[pk.to_python(document[pk.column]) for document in documents])
+
+
+def ranked_search_text(view, request):
+    """The ?search= text when the list should come back in relevance order"""
+    if SearchIndexFilter not in view.filter_backends:
+        return None
+    if request.query_params.get(filters.OrderingFilter.ordering_param):
+        return None
+    text = SearchIndexFilter().get_search_text(request)
+    return text if search_clause(text) else None
+
+
+def searchable_models():
+    from django.apps import apps
+
+    return [model for model in apps.get_app_config('octofit_tracker').get_models()
+            if hasattr(model, 'search_weights')]
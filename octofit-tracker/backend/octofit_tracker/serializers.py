@@ -1,34 +1,106 @@
 from rest_framework import serializers
+from django.core.exceptions import FieldDoesNotExist
 from django.db import models as django_models
+from .instrumentation import timer
 from .models import User, Team, Activity, Leaderboard, Workout
 
 
-class TeamSerializer(serializers.ModelSerializer):
+def team_members_context(teams):
+    """
+    Load the members of a page of teams with a single query and bucket
+    them by team_id.
+    """
+    team_ids = [str(team._id) for team in teams]
+    members = {team_id: [] for team_id in team_ids}
+    if team_ids:
+        users = User.objects.filter(team_id__in=team_ids).values_list('team_id', 'name', 'hero_name', 'email')
+        for team_id, name, hero_name, email in users:
+            members.setdefault(str(team_id), []).append(
+                {'name': name, 'hero_name': hero_name, 'email': email}
+            )
+    return {'team_members': members}
+
+
+class DynamicFieldsMixin:
+    """
+    Drop the fields not selected by ``context['fields']`` or listed in
+    ``context['exclude']``. ``Meta.field_dependencies`` names the model
+    fields a computed field reads, for projection pushdown.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        selected = self.context.get('fields')
+        excluded = self.context.get('exclude', ())
+        for name in list(self.fields):
+            if (selected is not None and name not in selected) or name in excluded:
+                self.fields.pop(name)
+
+    def get_model_fields(self):
+        """Model fields the remaining serializer fields read"""
+        meta = self.Meta.model._meta
+        dependencies = getattr(self.Meta, 'field_dependencies', {})
+        names = {meta.pk.name}
+        for name, field in self.fields.items():
+            if name in dependencies:
+                names.update(dependencies[name])
+                continue
+            if field.source == '*' or not field.source_attrs:
+                continue
+            try:
+                names.add(meta.get_field(field.source_attrs[0]).name)
+            except FieldDoesNotExist:
+                pass
+        return names
+
+    def to_representation(self, instance):
+        with timer('serialize'):
+            return super().to_representation(instance)
+
+
+class TeamSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     members = serializers.SerializerMethodField()
     
     class Meta:
         model = Team
         fields = ['_id', 'name', 'description', 'created_at', 'member_count', 'members']
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if not self.context.get('include_members', True):
+            self.fields.pop('members', None)
     
     def get_members(self, obj):
         """Get list of users belonging to this team"""
+        limit = self.context.get('members_limit')
+        if 'team_members' in self.context:
+            members = self.context['team_members'].get(str(obj._id), [])
+            return members[:limit] if limit is not None else members
         users = User.objects.filter(team_id=obj._id)
+        if limit is not None:
+            users = users[:limit]
         return [{'name': user.name, 'hero_name': user.hero_name, 'email': user.email} for user in users]
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    _id = serializers.ReadOnlyField()
+
     class Meta:
         model = User
         fields = ['_id', 'name', 'email', 'hero_name', 'team_id', 'total_points', 'created_at']
 
 
-class WorkoutSerializer(serializers.ModelSerializer):
+class WorkoutSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    _id = serializers.ReadOnlyField()
+
     class Meta:
         model = Workout
         fields = ['_id', 'name', 'type', 'duration_minutes', 'calories_per_session', 'description', 'difficulty']
 
 
-class ActivitySerializer(serializers.ModelSerializer):
+class ActivitySerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    _id = serializers.ReadOnlyField()
+
     class Meta:
         model = Activity
         fields = ['_id', 'user_id', 'user_email', 'user_name', 'hero_name', 'team_id', 
@@ -36,7 +108,44 @@ class ActivitySerializer(serializers.ModelSerializer):
                   'points', 'date', 'notes']
 
 
-class LeaderboardSerializer(serializers.ModelSerializer):
+def leaderboard_context(entries, activity_totals=None):
+    """
+    Resolve team names, calorie totals and activity counts for a page of
+    leaderboard entries with one grouped query each, instead of three
+    queries per row. Precomputed ``activity_totals`` (user_id -> (calories,
+    count)) skip the activities aggregation.
+    """
+    user_ids = {str(entry.user_id) for entry in entries
+                if entry.leaderboard_type == 'individual' and entry.user_id}
+    team_ids = {str(entry.team_id) for entry in entries
+                if entry.leaderboard_type == 'individual' and entry.team_id}
+
+    team_names = {}
+    if team_ids:
+        team_names = {
+            str(team_id): name
+            for team_id, name in Team.objects.filter(_id__in=list(team_ids)).values_list('_id', 'name')
+        }
+
+    if activity_totals is not None:
+        return {'team_names': team_names, 'activity_totals': activity_totals}
+
+    activity_totals = {}
+    if user_ids:
+        rows = Activity.objects.filter(user_id__in=list(user_ids)).values('user_id').annotate(
+            total_calories=django_models.Sum('calories_burned'),
+            activity_count=django_models.Count('user_id')
+        )
+        activity_totals = {
+            str(row['user_id']): (row['total_calories'] or 0, row['activity_count'])
+            for row in rows
+        }
+
+    return {'team_names': team_names, 'activity_totals': activity_totals}
+
+
+class LeaderboardSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    _id = serializers.ReadOnlyField()
     team_name_display = serializers.SerializerMethodField()
     total_calories = serializers.SerializerMethodField()
     activity_count = serializers.SerializerMethodField()
@@ -46,10 +155,16 @@ class LeaderboardSerializer(serializers.ModelSerializer):
         fields = ['_id', 'leaderboard_type', 'rank', 'total_points', 'last_updated',
                   'user_id', 'user_email', 'user_name', 'hero_name', 'team_id', 'team_name',
                   'team_name_display', 'total_calories', 'activity_count']
+        field_dependencies = {
+            name: ['leaderboard_type', 'user_id', 'team_id', 'team_name']
+            for name in ('team_name_display', 'total_calories', 'activity_count')
+        }
     
     def get_team_name_display(self, obj):
         """Get the team name for individual leaderboard entries"""
         if obj.leaderboard_type == 'individual' and obj.team_id:
+            if 'team_names' in self.context:
+                return self.context['team_names'].get(str(obj.team_id))
             try:
                 team = Team.objects.get(_id=obj.team_id)
                 return team.name
@@ -60,6 +175,8 @@ class LeaderboardSerializer(serializers.ModelSerializer):
     def get_total_calories(self, obj):
         """Calculate total calories burned by this user"""
         if obj.leaderboard_type == 'individual' and obj.user_id:
+            if 'activity_totals' in self.context:
+                return self.context['activity_totals'].get(str(obj.user_id), (0, 0))[0]
             total = Activity.objects.filter(user_id=obj.user_id).aggregate(
                 total=django_models.Sum('calories_burned')
             )['total']
@@ -69,5 +186,7 @@ class LeaderboardSerializer(serializers.ModelSerializer):
     def get_activity_count(self, obj):
         """Count total activities for this user"""
         if obj.leaderboard_type == 'individual' and obj.user_id:
+            if 'activity_totals' in self.context:
+                return self.context['activity_totals'].get(str(obj.user_id), (0, 0))[1]
             return Activity.objects.filter(user_id=obj.user_id).count()
         return 0
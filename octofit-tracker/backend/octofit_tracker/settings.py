@@ -52,6 +52,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'octofit_tracker.instrumentation.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -99,6 +100,78 @@ DATABASES = {
 }
 
 
+# Caches
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+#
+# 'responses' backs the versioned response cache for the leaderboard and
+# team endpoints. LocMemCache evicts least-recently-used entries beyond
+# MAX_ENTRIES; point it at a local Redis with
+# 'django.core.cache.backends.redis.RedisCache' and LOCATION
+# 'redis://127.0.0.1:6379' to share it between processes.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'responses': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'octofit-responses',
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 1000,
+        },
+    },
+}
+
+
+# Django REST framework
+# https://www.django-rest-framework.org/api-guide/settings/
+#
+# The JSON renderer/parser use orjson when it is installed and fall back to
+# the stdlib json module otherwise.
+
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'octofit_tracker.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'octofit_tracker.parsers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+}
+
+
+# OctoFit performance settings
+
+# Viewsets (by router basename) whose list/retrieve actions read through
+# pymongo directly instead of djongo's SQL translation, e.g.
+# ['activity', 'user', 'leaderboard']
+OCTOFIT_FAST_READS = []
+
+# Documents fetched per server-side cursor batch by /api/activities/export/
+OCTOFIT_EXPORT_BATCH_SIZE = 1000
+
+# Serve leaderboard and team reads from the 'responses' cache
+OCTOFIT_RESPONSE_CACHE = True
+
+# Per-request timing breakdown in a Server-Timing response header
+OCTOFIT_SERVER_TIMING = True
+
+# Log requests slower than this many milliseconds to the
+# 'octofit_tracker.performance' logger; None disables the log
+OCTOFIT_SLOW_REQUEST_MS = None
+
+# Background job worker threads per process (see jobs.py)
+OCTOFIT_JOB_WORKERS = 2
+
+# Run the test suite against an in-process MongoDB stand-in (mongomock)
+# instead of the server above: OCTOFIT_TEST_MONGO=memory
+OCTOFIT_TEST_MONGO = os.environ.get('OCTOFIT_TEST_MONGO', '')
+TEST_RUNNER = 'octofit_tracker.testing.OctofitTestRunner'
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
 
@@ -0,0 +1,26 @@
+from django.db.models.signals import post_delete, post_migrate, post_save
+from django.dispatch import receiver
+
+from .cache import bump_versions, response_cache
+from .search import index_instance
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def bump_collection_version(sender, **kwargs):
+    """ORM writes (admin, shell, tests) invalidate cached responses too"""
+    if sender._meta.app_label == 'octofit_tracker':
+        bump_versions(sender._meta.db_table)
+
+
+@receiver(post_save)
+def refresh_search_terms(sender, instance, raw=False, **kwargs):
+    """Keep the _search terms of ORM-written documents current"""
+    if hasattr(sender, 'search_weights') and not raw:
+        index_instance(instance)
+
+
+@receiver(post_migrate)
+def clear_response_cache(sender, **kwargs):
+    """migrate and flush rebuild the data wholesale"""
+    response_cache().clear()
@@ -0,0 +1,180 @@
+"""
+Grouped activity statistics.
+
+Sums, means, extremes and percentiles of the activity measures, bucketed
+by day, ISO week, activity type, user or team, computed by Mongo
+aggregation pipelines. Percentiles are picked on the server: a
+$setWindowFields stage numbers each group's values in order, and only the
+two values either side of each requested rank come back, so no group's
+values are ever gathered into one document or shipped to the client. The
+result is the linear interpolation numpy.percentile computes by default.
+
+Servers without window functions (before MongoDB 5.0, and the in-memory
+test mode) get the percentiles from a projected fetch of the measures
+instead, computed with NumPy when it is installed.
+"""
+from pymongo.errors import OperationFailure
+from rest_framework.exceptions import ValidationError
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover - exercised when numpy is absent
+    numpy = None
+
+STAT_FIELDS = ('points', 'calories_burned', 'duration_minutes')
+
+GROUP_KEYS = {
+    'day': {'$dateToString': {'format': '%Y-%m-%d', 'date': '$date'}},
+    'week': {'$dateToString': {'format': '%G-W%V', 'date': '$date'}},
+    'activity_type': '$activity_type',
+    'user': {'$toString': '$user_id'},
+    'team': '$team_id',
+    'none': None,
+}
+
+DEFAULT_PERCENTILES = (50, 90, 99)
+
+# OperationFailure code for a pipeline stage the server does not know
+UNRECOGNIZED_STAGE = 40324
+
+
+def _position(count, rank):
+    """(lower index, upper index, fraction) of a percentile among ``count`` sorted values"""
+    position = (count - 1) * rank / 100
+    lower = int(position)
+    return lower, min(lower + 1, count - 1), position - lower
+
+
+def percentiles(values, ranks):
+    """Linearly interpolated percentiles, matching numpy.percentile's default"""
+    if not values:
+        return [None] * len(ranks)
+    if numpy is not None:
+        return [float(value) for value in numpy.percentile(numpy.asarray(values, dtype=float), ranks)]
+    values = sorted(values)
+    results = []
+    for rank in ranks:
+        lower, upper, fraction = _position(len(values), rank)
+        results.append(float(values[lower] + (values[upper] - values[lower]) * fraction))
+    return results
+
+
+def stats_pipeline(match, group_by):
+    group = {'_id': GROUP_KEYS[group_by], 'count': {'$sum': 1}}
+    for field in STAT_FIELDS:
+        group[f'{field}__sum'] = {'$sum': f'${field}'}
+        group[f'{field}__min'] = {'$min': f'${field}'}
+        group[f'{field}__max'] = {'$max': f'${field}'}
+        group[f'{field}__count'] = {'$sum': {'$cond': [{'$isNumber': f'${field}'}, 1, 0]}}
+    return [{'$match': match}, {'$group': group}, {'$sort': {'_id': 1}}]
+
+
+def _field_percentile_stages(match, group_by, field, ranks):
+    # Indexes (0-based) of the values each rank interpolates between, as
+    # _position() computes them, from the group's value count $n
+    last = {'$subtract': ['$n', 1]}
+    indexes = []
+    for rank in ranks:
+        lower = {'$floor': {'$divide': [{'$multiply': [last, rank]}, 100]}}
+        indexes += [lower, {'$min': [{'$add': [lower, 1]}, last]}]
+
+    window = {'sortBy': {field: 1}, 'output': {'n': {'$count': {}}, 'i': {'$documentNumber': {}}}}
+    if GROUP_KEYS[group_by] is not None:
+        window['partitionBy'] = GROUP_KEYS[group_by]
+    return [
+        {'$match': {'$and': [match, {field: {'$type': 'number'}}]}},
+        {'$setWindowFields': window},
+        {'$match': {'$expr': {'$in': [{'$subtract': ['$i', 1]}, indexes]}}},
+        {'$group': {
+            '_id': {'key': GROUP_KEYS[group_by], 'field': field},
+            'n': {'$first': '$n'},
+            'picked': {'$push': {'i': {'$subtract': ['$i', 1]}, 'v': f'${field}'}},
+        }},
+    ]
+
+
+def percentile_pipeline(collection_name, match, group_by, ranks):
+    """One pipeline picking every field's percentile values, a $unionWith per extra field"""
+    first, *rest = STAT_FIELDS
+    pipeline = _field_percentile_stages(match, group_by, first, ranks)
+    for field in rest:
+        pipeline.append({'$unionWith': {
+            'coll': collection_name, 'pipeline': _field_percentile_stages(match, group_by, field, ranks),
+        }})
+    return pipeline
+
+
+def _server_percentiles(collection, match, group_by, ranks):
+    results = {}
+    for row in collection.aggregate(percentile_pipeline(collection.name, match, group_by, ranks),
+                                    allowDiskUse=True):
+        picked = {int(item['i']): item['v'] for item in row['picked']}
+        values = []
+        for rank in ranks:
+            lower, upper, fraction = _position(row['n'], rank)
+            values.append(float(picked[lower] + (picked[upper] - picked[lower]) * fraction))
+        results[(row['_id'].get('key'), row['_id']['field'])] = values
+    return results
+
+
+def _fetched_percentiles(collection, match, group_by, ranks):
+    columns = {}
+    projection = {'_id': 0, 'key': GROUP_KEYS[group_by] or {'$literal': None}}
+    projection.update((field, 1) for field in STAT_FIELDS)
+    for row in collection.aggregate([{'$match': match}, {'$project': projection}], allowDiskUse=True):
+        for field in STAT_FIELDS:
+            value = row.get(field)
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                columns.setdefault((row.get('key'), field), []).append(value)
+    return {key: percentiles(values, ranks) for key, values in columns.items()}
+
+
+def group_percentiles(collection, match, group_by, ranks):
+    """{(group key, field): [percentile per rank]} over the matching activities"""
+    try:
+        return _server_percentiles(collection, match, group_by, ranks)
+    except OperationFailure as exc:
+        if exc.code != UNRECOGNIZED_STAGE:
+            raise
+    except NotImplementedError:
+        pass  # the in-memory test mode
+    return _fetched_percentiles(collection, match, group_by, ranks)
+
+
+def activity_stats(collection, match, group_by, ranks=DEFAULT_PERCENTILES):
+    """Run the pipelines over ``collection`` (activities) and shape the groups"""
+    quantiles = group_percentiles(collection, match, group_by, ranks)
+    groups = []
+    for row in collection.aggregate(stats_pipeline(match, group_by), allowDiskUse=True):
+        group = {'key': row['_id'], 'count': row['count']}
+        for field in STAT_FIELDS:
+            count = row[f'{field}__count']
+            summary = {
+                'sum': row[f'{field}__sum'],
+                'mean': row[f'{field}__sum'] / count if count else None,
+                'min': row[f'{field}__min'],
+                'max': row[f'{field}__max'],
+            }
+            values = quantiles.get((row['_id'], field), [None] * len(ranks))
+            for rank, value in zip(ranks, values):
+                summary[f'p{rank:g}'] = value
+            group[field] = summary
+        groups.append(group)
+    return groups
+
+
+def parse_stats_params(request, default_group):
+    """(group_by, percentile ranks) from ?group_by= and ?percentiles="""
+    group_by = request.query_params.get('group_by', default_group)
+    if group_by not in GROUP_KEYS:
+        raise ValidationError({'group_by': f'Must be one of: {", ".join(GROUP_KEYS)}.'})
+    ranks = DEFAULT_PERCENTILES
+    value = request.query_params.get('percentiles')
+    if value:
+        try:
+            ranks = tuple(float(rank) for rank in value.split(','))
+        except ValueError:
+            raise ValidationError({'percentiles': 'Must be comma-separated numbers.'})
+        if not all(0 <= rank <= 100 for rank in ranks):
+            raise ValidationError({'percentiles': 'Must be between 0 and 100.'})
+    return group_by, ranks
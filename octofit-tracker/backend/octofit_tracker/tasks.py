@@ -0,0 +1,83 @@
+"""
+Maintenance tasks for the job runner (see jobs.py).
+
+- ``rebuild_leaderboard``: recompute every user's and team's points from
+  the activities and swap the new standings in (one job at a time);
+  ``{"workers": N}`` spreads the aggregation over N processes
+- ``recompute_user_points``: recompute users' totals from their activities,
+  in chunks of users; ``{"rebuild_leaderboard": true}`` queues a rebuild
+  once the totals are in
+- ``reindex``: recompute ``_search`` terms, ``{"collections": [...]}``
+  (default all searchable collections), in chunks of documents
+"""
+from pymongo import UpdateOne
+
+from . import denorm  # noqa: F401 - registers propagate_user
+from .cache import bump_versions
+from .jobs import enqueue, id_chunks, task
+from .leaderboard import rebuild_standings
+from .mongo import id_variants
+from .search import reindex, searchable_models
+
+
+def _validate_rebuild(params):
+    workers = params.get('workers', 1)
+    if not isinstance(workers, int) or isinstance(workers, bool) or workers < 1:
+        raise ValueError('workers must be a positive integer')
+
+
+@task('rebuild_leaderboard', max_concurrency=1, validate=_validate_rebuild)
+def rebuild_leaderboard(context):
+    rebuild_standings(context.db, progress=context.progress, workers=context.params.get('workers', 1))
+    bump_versions('leaderboard', 'users')
+
+
+@task('recompute_user_points')
+def recompute_user_points(context):
+    db = context.db
+    done = context.checkpoint.get('done', 0)
+    context.progress(done, db.users.estimated_document_count())
+    for ids in id_chunks(db.users, {}, context.checkpoint.get('last_id')):
+        variants = [variant for user_id in ids for variant in id_variants(user_id)]
+        totals = {
+            row['_id']: row['total_points'] for row in db.activities.aggregate([
+                {'$match': {'user_id': {'$in': variants}}},
+                {'$group': {'_id': {'$toString': '$user_id'}, 'total_points': {'$sum': '$points'}}},
+            ])
+        }
+        db.users.bulk_write([
+            UpdateOne({'_id': user_id}, {'$set': {'total_points': totals.get(str(user_id), 0)}})
+            for user_id in ids
+        ], ordered=False)
+        done += len(ids)
+        context.save({'last_id': ids[-1], 'done': done}, done=done)
+    bump_versions('users')
+    if context.params.get('rebuild_leaderboard'):
+        enqueue('rebuild_leaderboard', db=db)
+
+
+def _validate_reindex(params):
+    names = {model._meta.db_table for model in searchable_models()}
+    unknown = set(params.get('collections') or ()) - names
+    if unknown:
+        raise ValueError(f'Not searchable: {", ".join(sorted(unknown))}')
+
+
+@task('reindex', validate=_validate_reindex)
+def reindex_search(context):
+    db = context.db
+    models = {model._meta.db_table: model for model in searchable_models()}
+    names = context.params.get('collections') or sorted(models)
+    checkpoint = context.checkpoint
+    done = checkpoint.get('done', 0)
+    context.progress(done, sum(db[name].estimated_document_count() for name in names))
+
+    # Resume inside the collection that was being worked on
+    start = names.index(checkpoint['collection']) if checkpoint.get('collection') in names else 0
+    for name in names[start:]:
+        last_id = checkpoint.get('last_id') if name == checkpoint.get('collection') else None
+        for ids in id_chunks(db[name], {}, last_id):
+            reindex(models[name], db, {'_id': {'$in': ids}})
+            done += len(ids)
+            context.save({'collection': name, 'last_id': ids[-1], 'done': done}, done=done)
+    bump_versions(*names)
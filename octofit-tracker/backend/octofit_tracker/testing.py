@@ -0,0 +1,117 @@
+"""
+Test support: an in-memory MongoDB mode and round-trip assertions.
+
+With ``OCTOFIT_TEST_MONGO=memory`` in the environment (see settings.py) the
+test runner points djongo and the pymongo code paths at one in-process
+mongomock client (pinned in requirements.txt), so the suite needs no
+MongoDB server:
+
+    OCTOFIT_TEST_MONGO=memory python manage.py test octofit_tracker
+
+mongomock does not emit pymongo's command monitoring events, so in this
+mode its collection operations are reported to the instrumentation
+directly; round-trip counts then match a real server's, one per
+operation (getMore batches aside).
+
+RoundTripAssertionsMixin.assertMaxQueries() fails a test when the block
+makes more SQL queries (djongo) or Mongo commands than allowed, which is
+how per-row lookups in serializers get caught.
+"""
+import functools
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.test.runner import DiscoverRunner
+
+from . import async_mongo
+from .instrumentation import capture_round_trips, record_mongo_command
+
+try:
+    import mongomock
+except ImportError:  # pragma: no cover - exercised when mongomock is absent
+    mongomock = None
+
+# mongomock.Collection methods that are one round trip on a real server
+COLLECTION_COMMANDS = (
+    'find', 'find_one', 'aggregate', 'count_documents', 'estimated_document_count', 'distinct',
+    'insert_one', 'insert_many', 'update_one', 'update_many', 'replace_one', 'delete_one',
+    'delete_many', 'bulk_write', 'find_one_and_update', 'find_one_and_replace',
+    'find_one_and_delete', 'create_index', 'create_indexes', 'drop_index', 'index_information',
+    'drop', 'rename',
+)
+
+_in_operation = threading.local()
+
+
+def _counted(method):
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        # mongomock implements some operations on top of others (find_one
+        # calls find); count the outermost call only
+        if getattr(_in_operation, 'active', False):
+            return method(*args, **kwargs)
+        _in_operation.active = True
+        try:
+            return method(*args, **kwargs)
+        finally:
+            _in_operation.active = False
+            record_mongo_command(0.0)
+    wrapper.counts_round_trips = True
+    return wrapper
+
+
+def use_in_memory_mongo():
+    """Route every MongoClient this project opens to one shared mongomock client"""
+    if mongomock is None:
+        raise ImproperlyConfigured('OCTOFIT_TEST_MONGO=memory requires mongomock (pip install mongomock)')
+    import pymongo
+    from djongo import database
+
+    client = mongomock.MongoClient()
+    factory = lambda *args, **kwargs: client  # noqa: E731
+    database.MongoClient = factory
+    database.clients.clear()
+    pymongo.MongoClient = factory
+    # Motor would connect to a real server; use the thread-pool fallback
+    async_mongo.HAVE_MOTOR = False
+
+    for name in COLLECTION_COMMANDS:
+        method = getattr(mongomock.collection.Collection, name, None)
+        if method is not None and not getattr(method, 'counts_round_trips', False):
+            setattr(mongomock.collection.Collection, name, _counted(method))
+    return client
+
+
+class OctofitTestRunner(DiscoverRunner):
+    """DiscoverRunner that honours settings.OCTOFIT_TEST_MONGO"""
+
+    def setup_databases(self, **kwargs):
+        mode = getattr(settings, 'OCTOFIT_TEST_MONGO', '')
+        if mode == 'memory':
+            use_in_memory_mongo()
+        elif mode:
+            raise ImproperlyConfigured(f'Unknown OCTOFIT_TEST_MONGO mode {mode!r}; use "memory" or leave it empty')
+        return super().setup_databases(**kwargs)
+
+
+class RoundTripAssertionsMixin:
+    """assertMaxQueries() for TestCase classes"""
+
+    @contextmanager
+    def assertMaxQueries(self, queries, mongo_commands=None):
+        """
+        Fail if the block makes more than ``queries`` SQL queries through
+        djongo, or more than ``mongo_commands`` Mongo commands when given.
+        """
+        with capture_round_trips() as counts:
+            yield counts
+        self.assertLessEqual(
+            counts.queries, queries, f'{counts.queries} SQL queries executed, at most {queries} expected'
+        )
+        if mongo_commands is not None:
+            self.assertLessEqual(
+                counts.mongo_commands, mongo_commands,
+                f'{counts.mongo_commands} Mongo commands sent, at most {mongo_commands} expected'
+            )
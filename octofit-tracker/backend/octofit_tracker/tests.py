@@ -3,6 +3,27 @@ from rest_framework.test import APITestCase, APIClient
 from rest_framework import status
 from django.urls import reverse
 from django.utils import timezone
+import asyncio
+import base64
+import copy
+import json
+import threading
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from bson import ObjectId
+from . import cache, denorm, fastjson, jobs, leaderboard, live, stats
+from .cache import VERSIONS_COLLECTION, bump_versions
+from .indexes import diff_indexes
+from .mongo import LockLost, MongoLock, get_db
+from .search import add_search_terms
+from .testing import RoundTripAssertionsMixin
 from .models import User, Team, Activity, Leaderboard, Workout
 
 
@@ -90,6 +111,21 @@ class TeamAPITestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data['name'], 'Test Team')
 
+    def test_get_teams_list_members(self):
+        """Test that team members are nested, capped or skipped on request"""
+        for i in range(3):
+            User.objects.create(
+                name=f'Hero {i}', email=f'hero{i}@hero.com', hero_name=f'Hero {i}',
+                team_id='test_team'
+            )
+        url = reverse('team-list')
+        response = self.client.get(url)
+        self.assertEqual(len(response.data[0]['members']), 3)
+        response = self.client.get(url, {'members_limit': 2})
+        self.assertEqual(len(response.data[0]['members']), 2)
+        response = self.client.get(url, {'members': 'false'})
+        self.assertNotIn('members', response.data[0])
+
 
 class UserAPITestCase(APITestCase):
     """Test cases for User API endpoints"""
@@ -109,7 +145,7 @@ class UserAPITestCase(APITestCase):
         url = reverse('user-list')
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
+        self.assertEqual(len(response.data['results']), 1)
 
 
 class WorkoutAPITestCase(APITestCase):
@@ -159,7 +195,653 @@ class ActivityAPITestCase(APITestCase):
         url = reverse('activity-list')
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
+        self.assertEqual(len(response.data['results']), 1)
+
+
+class ActivityLeaderboardSyncTestCase(APITestCase):
+    """Test that activity writes keep points and ranks up to date"""
+
+    def setUp(self):
+        self.client = APIClient()
+        get_db().leaderboard_rollups.delete_many({})
+        Team.objects.create(_id='test_team', name='Test Team', description='A test team')
+        self.leader = User.objects.create(
+            name='Leader', email='leader@hero.com', hero_name='The Leader',
+            team_id='test_team', total_points=100
+        )
+        self.chaser = User.objects.create(
+            name='Chaser', email='chaser@hero.com', hero_name='The Chaser',
+            team_id='test_team', total_points=50
+        )
+        for rank, user in enumerate((self.leader, self.chaser), 1):
+            Leaderboard.objects.create(
+                leaderboard_type='individual', rank=rank, total_points=user.total_points,
+                user_id=str(user._id), user_email=user.email, user_name=user.name,
+                hero_name=user.hero_name, team_id=user.team_id
+            )
+
+    def post_activity(self, user, points):
+        return self.client.post(reverse('activity-list'), {
+            'user_id': str(user._id), 'user_email': user.email, 'user_name': user.name,
+            'hero_name': user.hero_name, 'team_id': user.team_id, 'activity_type': 'running',
+            'workout_name': 'Test Workout', 'duration_minutes': 30, 'calories_burned': 300,
+            'points': points, 'date': timezone.now().isoformat()
+        }, format='json')
+
+    def rank_of(self, user):
+        return Leaderboard.objects.get(leaderboard_type='individual', user_id=str(user._id)).rank
+
+    def test_create_activity_updates_ranks(self):
+        """Test that overtaking another user swaps their ranks"""
+        response = self.post_activity(self.chaser, 60)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(User.objects.get(email='chaser@hero.com').total_points, 110)
+        self.assertEqual(self.rank_of(self.chaser), 1)
+        self.assertEqual(self.rank_of(self.leader), 2)
+        team_entry = Leaderboard.objects.get(leaderboard_type='team', team_id='test_team')
+        self.assertEqual(team_entry.total_points, 60)
+        self.assertEqual(team_entry.team_name, 'Test Team')
+
+    def test_retract_activity_restores_ranks(self):
+        """Test that retracting an activity moves its points back out"""
+        self.post_activity(self.chaser, 60)
+        activity = Activity.objects.get(user_email='chaser@hero.com')
+        leaderboard.record_activity(activity, sign=-1)
+        self.assertEqual(User.objects.get(email='chaser@hero.com').total_points, 50)
+        self.assertEqual(self.rank_of(self.leader), 1)
+        self.assertEqual(self.rank_of(self.chaser), 2)
+
+    def test_rank_moves_wait_for_other_processes(self):
+        """Test that a rank move waits while another process holds the rank lock"""
+        other_process = MongoLock(leaderboard.RANK_LOCK)
+        other_process.acquire()
+        mover = threading.Thread(target=leaderboard.apply_points, args=(str(self.chaser._id), 'test_team', 60))
+        mover.start()
+        mover.join(0.2)
+        self.assertTrue(mover.is_alive())
+        self.assertEqual(self.rank_of(self.chaser), 2)
+        other_process.release()
+        mover.join(5)
+        self.assertEqual(self.rank_of(self.chaser), 1)
+        self.assertEqual(self.rank_of(self.leader), 2)
+
+    def test_windowed_leaderboard(self):
+        """Test that only activities in the current week count for ?window=week"""
+        self.post_activity(self.chaser, 60)
+        response = self.client.get(reverse('leaderboard-individual'), {'window': 'week'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['hero_name'], 'The Chaser')
+        self.assertEqual(response.data['results'][0]['total_points'], 60)
+        self.assertEqual(response.data['results'][0]['activity_count'], 1)
+        self.assertEqual(response.data['results'][0]['team_name_display'], 'Test Team')
+        response = self.client.get(reverse('leaderboard-team'), {'window': 'month'})
+        self.assertEqual(response.data['results'][0]['team_name'], 'Test Team')
+        response = self.client.get(reverse('leaderboard-team'), {'window': 'year'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_windowed_leaderboard_pages(self):
+        """Test that windowed standings can be paged through by cursor"""
+        self.post_activity(self.chaser, 60)
+        self.post_activity(self.leader, 20)
+        response = self.client.get(reverse('leaderboard-individual'), {'window': 'week', 'page_size': 1})
+        self.assertEqual(response.data['results'][0]['hero_name'], 'The Chaser')
+        response = self.client.get(response.data['next'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        self.assertEqual([row['hero_name'] for row in response.data['results']], ['The Leader'])
+        self.assertEqual(response.data['results'][0]['rank'], 2)
+        self.assertIsNone(response.data['next'])
+
+    def test_windowed_leaderboard_ties_rank_in_page_order(self):
+        """Test that tied windowed entries get distinct ranks on every page, both ways"""
+        self.post_activity(self.chaser, 30)
+        self.post_activity(self.leader, 30)
+        first = self.client.get(reverse('leaderboard-individual'), {'window': 'day', 'page_size': 1})
+        second = self.client.get(first.data['next'])
+        self.assertEqual([first.data['results'][0]['rank'], second.data['results'][0]['rank']], [1, 2])
+        self.assertNotEqual(first.data['results'][0]['user_id'], second.data['results'][0]['user_id'])
+        back = self.client.get(second.data['previous'])
+        self.assertEqual(back.data['results'], first.data['results'])
+
+
+class UserDenormalizationTestCase(APITestCase):
+    """Test that user edits reach the activity and leaderboard copies"""
+
+    def setUp(self):
+        self.client = APIClient()
+        get_db().leaderboard_rollups.delete_many({})
+        get_db()[jobs.JOBS_COLLECTION].delete_many({})
+        Team.objects.create(_id='team_a', name='Team A', description='First team')
+        Team.objects.create(_id='team_b', name='Team B', description='Second team')
+        self.user = User.objects.create(name='Old Name', email='mover@hero.com', hero_name='The Mover',
+                                        team_id='team_a')
+        for points in (30, 40, 50):
+            self.client.post(reverse('activity-list'), {
+                'user_id': str(self.user._id), 'user_email': self.user.email, 'user_name': self.user.name,
+                'hero_name': self.user.hero_name, 'team_id': 'team_a', 'activity_type': 'running',
+                'workout_name': 'Test Workout', 'duration_minutes': 30, 'calories_burned': 300,
+                'points': points, 'date': timezone.now().isoformat()
+            }, format='json')
+
+    def move_user(self):
+        user = User.objects.get(email='mover@hero.com')
+        previous = copy.copy(user)
+        user.name = 'New Name'
+        user.team_id = 'team_b'
+        user.save()
+        return previous, user
+
+    def team_points(self, team_id):
+        return Leaderboard.objects.get(leaderboard_type='team', team_id=team_id).total_points
+
+    def test_propagates_changes_and_team_points(self):
+        """Test that a rename and team move rewrite the copies and transfer the points"""
+        previous, user = self.move_user()
+        denorm.propagate_user(previous, user)
+        jobs.wait_for_jobs(timeout=30)
+        activities = Activity.objects.filter(user_email='mover@hero.com')
+        self.assertEqual({(a.user_name, a.team_id) for a in activities}, {('New Name', 'team_b')})
+        entry = Leaderboard.objects.get(leaderboard_type='individual', user_id=str(user._id))
+        self.assertEqual((entry.user_name, entry.team_id), ('New Name', 'team_b'))
+        self.assertEqual(self.team_points('team_a'), 0)
+        self.assertEqual(self.team_points('team_b'), 120)
+        self.assertEqual(Leaderboard.objects.get(leaderboard_type='team', team_id='team_b').rank, 1)
+        response = self.client.get(reverse('activity-list'), {'search': 'new'})
+        self.assertEqual(len(response.data['results']), 3)
+        response = self.client.get(reverse('leaderboard-team'), {'window': 'week'})
+        self.assertEqual([(row['team_id'], row['total_points']) for row in response.data['results']],
+                         [('team_b', 120)])
+
+    def test_resume_is_idempotent(self):
+        """Test that an interrupted job finishes from its checkpoint and transfers points once"""
+        previous, user = self.move_user()
+        with mock.patch.object(jobs.Runner, 'kick'):
+            job_id = denorm.propagate_user(previous, user)
+        first = get_db().activities.find_one({'user_email': 'mover@hero.com'}, sort=[('_id', 1)])
+        get_db()[jobs.JOBS_COLLECTION].update_one(
+            {'_id': job_id}, {'$set': {'checkpoint': {'last_id': first['_id'], 'done': 1}}}
+        )
+        jobs.get_runner().kick()
+        jobs.wait_for_jobs(timeout=30)
+        names = [a['user_name'] for a in get_db().activities.find({'user_email': 'mover@hero.com'}).sort('_id', 1)]
+        self.assertEqual(names, ['Old Name', 'New Name', 'New Name'])
+        self.assertEqual(jobs.get_job(job_id)['progress']['done'], 3)
+
+        get_db()[jobs.JOBS_COLLECTION].update_one({'_id': job_id}, {'$set': {'state': 'queued'}})
+        jobs.get_runner().kick()
+        jobs.wait_for_jobs(timeout=30)
+        self.assertEqual(self.team_points('team_b'), 120)
+        self.assertEqual(self.team_points('team_a'), 0)
+
+    def test_rebuild_credits_activity_teams(self):
+        """Test that a rebuild credits each activity's team, as the incremental updates do"""
+        get_db().users.update_one({'_id': self.user._id}, {'$set': {'team_id': 'team_b'}})
+        self.assertEqual(self.team_points('team_a'), 120)
+        leaderboard.rebuild_standings()
+        self.assertEqual((self.team_points('team_a'), self.team_points('team_b')), (120, 0))
+
+    def test_interrupted_transfer_completes_once(self):
+        """Test that rerunning a transfer cut short after the team entries moves only the rest"""
+        previous, user = self.move_user()
+        transfer = (str(user._id), 120, 'team_a', 'team_b', 'job-1')
+        with mock.patch.object(leaderboard, 'ensure_rollup_indexes', side_effect=RuntimeError('lost lease')):
+            with self.assertRaises(RuntimeError):
+                leaderboard.transfer_team_points(*transfer)
+        self.assertEqual(self.team_points('team_b'), 120)
+        leaderboard.transfer_team_points(*transfer)
+        leaderboard.transfer_team_points(*transfer)
+        self.assertEqual((self.team_points('team_a'), self.team_points('team_b')), (0, 120))
+        buckets = get_db().leaderboard_rollups.find({'window': 'week', 'leaderboard_type': 'team'})
+        self.assertEqual({bucket['key']: bucket['total_points'] for bucket in buckets},
+                         {'team_a': 0, 'team_b': 120})
+
+
+class JobRunnerTestCase(APITestCase):
+    """Test cases for the background job runner and its maintenance tasks"""
+
+    def setUp(self):
+        self.client = APIClient()
+        get_db()[jobs.JOBS_COLLECTION].delete_many({})
+        Team.objects.create(_id='team_a', name='Team A', description='First team')
+        Team.objects.create(_id='team_b', name='Team B', description='Second team')
+        for i, points in enumerate((10, 30, 20)):
+            user = User.objects.create(name=f'Hero {i}', email=f'hero{i}@hero.com', hero_name=f'Hero {i}',
+                                       team_id='team_a' if i < 2 else 'team_b', total_points=999)
+            Activity.objects.create(
+                user_id=str(user._id), user_email=user.email, user_name=user.name, hero_name=user.hero_name,
+                team_id=user.team_id, activity_type='running', workout_name='Test Workout',
+                duration_minutes=30, calories_burned=100, points=points, date=timezone.now(), notes=''
+            )
+
+    def run_job(self, task, params=None):
+        response = self.client.post(reverse('job-list'), {'task': task, 'params': params or {}}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        jobs.wait_for_jobs(timeout=30)
+        return self.client.get(reverse('job-detail', kwargs={'pk': response.data['id']})).data
+
+    def test_recompute_points_and_rebuild(self):
+        """Test that totals are recomputed from activities and the standings rebuilt from them"""
+        job = self.run_job('recompute_user_points', {'rebuild_leaderboard': True})
+        self.assertEqual(job['state'], 'done')
+        self.assertEqual(job['progress'], {'done': 3, 'total': 3})
+        self.assertEqual(sorted(User.objects.values_list('total_points', flat=True)), [10, 20, 30])
+        self.assertEqual(self.client.get(reverse('job-list'), {'state': 'done'}).data[0]['task'],
+                         'rebuild_leaderboard')
+        standings = [(row.hero_name, row.rank) for row in Leaderboard.objects.filter(leaderboard_type='individual')]
+        self.assertEqual(sorted(standings, key=lambda row: row[1]), [('Hero 1', 1), ('Hero 2', 2), ('Hero 0', 3)])
+        teams = Leaderboard.objects.filter(leaderboard_type='team')
+        self.assertEqual(sorted((row.rank, row.team_id, row.total_points) for row in teams),
+                         [(1, 'team_a', 40), (2, 'team_b', 20)])
+
+    def test_reindex(self):
+        """Test that a reindex job restores the search terms"""
+        get_db().users.update_many({}, {'$unset': {'_search': ''}})
+        self.assertEqual(len(self.client.get(reverse('user-list'), {'search': 'hero'}).data['results']), 0)
+        self.assertEqual(self.run_job('reindex', {'collections': ['users']})['state'], 'done')
+        self.assertEqual(len(self.client.get(reverse('user-list'), {'search': 'hero'}).data['results']), 3)
+
+    def test_rejects_bad_jobs(self):
+        """Test that unknown tasks and parameters are refused at enqueue time"""
+        response = self.client.post(reverse('job-list'), {'task': 'bogus'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(reverse('job-list'), {'task': 'reindex', 'params': {'collections': ['teams']}},
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_failed_job(self):
+        """Test that a task's exception marks the job failed with the error"""
+        jobs.task('explode')(lambda context: 1 / 0)
+        self.addCleanup(jobs._tasks.pop, 'explode')
+        with self.assertLogs('octofit_tracker.jobs', level='ERROR'):
+            job = self.run_job('explode')
+        self.assertEqual(job['state'], 'failed')
+        self.assertIn('ZeroDivisionError', job['error'])
+
+    def test_concurrency_limit_spans_processes(self):
+        """Test that a task's jobs never overlap across runners and wait for a slot held elsewhere"""
+        running, peak = [], []
+
+        def hold(context):
+            running.append(context.id)
+            peak.append(len(running))
+            context.progress(1)
+            time.sleep(0.05)
+            running.remove(context.id)
+
+        jobs.task('hold', max_concurrency=1)(hold)
+        self.addCleanup(jobs._tasks.pop, 'hold')
+        job_ids = [jobs.enqueue('hold', start=False) for _ in range(4)]
+        runners = [jobs.Runner(2), jobs.Runner(2)]
+        for runner in runners * 2:
+            runner.kick()
+        for runner in runners:
+            runner.wait(timeout=30)
+        self.assertEqual(max(peak), 1)
+        self.assertEqual([jobs.get_job(job_id)['state'] for job_id in job_ids], ['done'] * 4)
+
+        other_process = MongoLock('job:hold:0', lease=jobs.LEASE_SECONDS)
+        other_process.acquire()
+        job_id = jobs.enqueue('hold')
+        jobs.wait_for_jobs(timeout=30)
+        self.assertEqual(jobs.get_job(job_id)['state'], 'queued')
+        other_process.release()
+        jobs.get_runner().kick()
+        jobs.wait_for_jobs(timeout=30)
+        self.assertEqual(jobs.get_job(job_id)['state'], 'done')
+
+    def test_rebuild_command(self):
+        """Test that a partitioned rebuild ranks from the activities and tells live clients to resync"""
+        Leaderboard.objects.create(leaderboard_type='individual', rank=1, total_points=5000,
+                                   user_id='stale', user_name='Stale Entry')
+
+        async def scenario():
+            subscription = live.broker.subscribe()
+            try:
+                await asyncio.to_thread(
+                    call_command, 'rebuild_leaderboard', '--workers', '1', '--partitions', '3', stdout=output
+                )
+                return subscription.drain()
+            finally:
+                live.broker.unsubscribe(subscription)
+
+        output = StringIO()
+        events = asyncio.run(scenario())
+        self.assertEqual(events, [('resync', {'leaderboard_types': ['individual', 'team']})])
+        self.assertIn('3 users and 2 teams ranked', output.getvalue())
+        entries = Leaderboard.objects.filter(leaderboard_type='individual')
+        self.assertEqual(sorted((row.rank, row.hero_name, row.total_points) for row in entries),
+                         [(1, 'Hero 1', 30), (2, 'Hero 2', 20), (3, 'Hero 0', 10)])
+        self.assertEqual(sorted(User.objects.values_list('total_points', flat=True)), [10, 20, 30])
+        self.assertIn('leaderboard_type_1_rank_1', get_db().leaderboard.index_information())
+        self.assertFalse([name for name in get_db().list_collection_names()
+                          if name.startswith(leaderboard.REBUILD_COLLECTION)])
+
+    def test_one_rebuild_at_a_time(self):
+        """Test that a rebuild refuses to start while another process is rebuilding"""
+        other_process = MongoLock(leaderboard.REBUILD_LOCK)
+        other_process.acquire()
+        self.addCleanup(other_process.release)
+        with self.assertRaisesMessage(CommandError, 'already running'):
+            call_command('rebuild_leaderboard', '--workers', '1', stdout=StringIO())
+        self.assertEqual(sorted(User.objects.values_list('total_points', flat=True)), [999] * 3)
+
+    def test_enqueue_command(self):
+        """Test that manage.py enqueue_job runs the job to completion"""
+        output = StringIO()
+        call_command('enqueue_job', 'rebuild_leaderboard', stdout=output)
+        self.assertIn('done', output.getvalue())
+        self.assertEqual(Leaderboard.objects.filter(leaderboard_type='individual').count(), 3)
+
+
+class PopulateDBTestCase(APITestCase):
+    """Test cases for the populate_db command"""
+
+    def test_activities_reference_users_by_string_id(self):
+        """Test that seeded activities are found by the API's string user ids"""
+        call_command('populate_db', '--users', '3', '--activities-per-user', '2', '--seed', '1',
+                     stdout=StringIO())
+        user = User.objects.first()
+        response = self.client.get(reverse('activity-list'), {'user_id': str(user._id)})
+        self.assertEqual(len(response.data['results']), 2)
+        response = self.client.get(reverse('leaderboard-individual'))
+        self.assertEqual([row['activity_count'] for row in response.data['results']], [2, 2, 2])
+
+    def test_seed_fixes_ids(self):
+        """Test that two runs with the same --seed produce the same user and activity ids"""
+        def ids():
+            call_command('populate_db', '--users', '2', '--activities-per-user', '2', '--seed', '7',
+                         stdout=StringIO())
+            return sorted(map(str, get_db().users.distinct('_id') + get_db().activities.distinct('_id')))
+        self.assertEqual(ids(), ids())
+
+    def test_rejects_empty_counts(self):
+        """Test that zero or negative sizes are refused before anything is dropped"""
+        for option in ('--teams', '--users', '--activities-per-user'):
+            with self.assertRaises(CommandError):
+                call_command('populate_db', option, '0', stdout=StringIO())
+
+
+class LiveLeaderboardTestCase(TestCase):
+    """Test cases for the server-sent leaderboard updates"""
+
+    def setUp(self):
+        get_db().leaderboard_rollups.delete_many({})
+        Team.objects.create(_id='live_team', name='Live Team', description='A test team')
+        self.user = User.objects.create(name='Live', email='live@hero.com', hero_name='Live',
+                                        team_id='live_team')
+
+    def test_subscription_coalesces_and_overflows(self):
+        """Test that bursts collapse to the latest move per entry and overflow to a resync"""
+        async def scenario():
+            subscription = live.broker.subscribe(['individual'])
+            try:
+                for points in (10, 20, 30):
+                    live.broker.publish([
+                        {'leaderboard_type': 'individual', 'key': 'u1', 'rank': 1, 'total_points': points},
+                        {'leaderboard_type': 'team', 'key': 't1', 'rank': 1, 'total_points': points},
+                    ])
+                first = subscription.drain()
+                live.broker.publish([
+                    {'leaderboard_type': 'individual', 'key': f'u{n}', 'rank': n, 'total_points': 0}
+                    for n in range(live.MAX_PENDING + 1)
+                ])
+                return first, subscription.drain()
+            finally:
+                live.broker.unsubscribe(subscription)
+
+        first, second = asyncio.run(scenario())
+        self.assertEqual(first, [('moves', {'leaderboard_type': 'individual', 'moves': [
+            {'key': 'u1', 'rank': 1, 'total_points': 30}]})])
+        self.assertEqual(second, [('resync', {'leaderboard_types': ['individual']})])
+
+    def test_coalesced_moves_rebuild_the_board(self):
+        """Test that a batch of overlapping moves replays to the server's standings"""
+        board = ['a', 'b', 'c']
+        for rank, (key, points) in enumerate(zip(board, (30, 20, 10)), 1):
+            Leaderboard.objects.create(leaderboard_type='individual', rank=rank, total_points=points, user_id=key)
+
+        async def scenario():
+            subscription = live.broker.subscribe(['individual'])
+            try:
+                # c passes b, then a falls below c
+                await asyncio.to_thread(leaderboard.apply_points, 'c', None, 15)
+                await asyncio.to_thread(leaderboard.apply_points, 'a', None, -10)
+                return subscription.drain()
+            finally:
+                live.broker.unsubscribe(subscription)
+
+        [(name, payload)] = asyncio.run(scenario())
+        moves = payload['moves']
+        board = [key for key in board if key not in {move['key'] for move in moves}]
+        for move in moves:
+            board.insert(move['rank'] - 1, move['key'])
+        standings = Leaderboard.objects.filter(leaderboard_type='individual').order_by('rank')
+        self.assertEqual(board, [row.user_id for row in standings])
+        self.assertEqual(board, ['c', 'a', 'b'])
+
+    @mock.patch.object(live, 'COALESCE_SECONDS', 0)
+    def test_event_stream_receives_moves(self):
+        """Test that activity points written elsewhere reach a connected client"""
+        user_id = str(self.user._id)
+
+        async def scenario():
+            sent = []
+            disconnect = asyncio.Event()
+
+            async def receive():
+                await disconnect.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                sent.append(message)
+                if b'event: moves' in message.get('body', b''):
+                    disconnect.set()
+
+            scope = {'type': 'http', 'method': 'GET', 'path': live.LIVE_PATH, 'query_string': b'type=individual'}
+            stream = asyncio.ensure_future(live.leaderboard_events(scope, receive, send))
+            while live.broker.subscriber_count == 0:
+                await asyncio.sleep(0)
+            await asyncio.to_thread(leaderboard.apply_points, user_id, 'live_team', 25)
+            await asyncio.wait_for(stream, 5)
+            return sent
+
+        sent = asyncio.run(scenario())
+        self.assertEqual(sent[0]['status'], 200)
+        body = b''.join(message.get('body', b'') for message in sent[1:]).decode()
+        self.assertIn('event: moves', body)
+        payload = json.loads(body.split('data: ')[1].split('\n')[0])
+        self.assertEqual(payload['moves'], [{'key': user_id, 'rank': 1, 'total_points': 25}])
+        self.assertEqual(live.broker.subscriber_count, 0)
+
+
+class ActivityBulkAPITestCase(APITestCase):
+    """Test cases for bulk activity ingestion"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create(
+            name='Test Hero', email='test@hero.com', hero_name='The Tester',
+            team_id='test_team', total_points=0
+        )
+
+    def activity(self, points, **overrides):
+        item = {
+            'user_id': str(self.user._id), 'activity_type': 'running', 'workout_name': 'Test Workout',
+            'duration_minutes': 30, 'calories_burned': 300, 'points': points,
+            'date': timezone.now().isoformat()
+        }
+        item.update(overrides)
+        return item
+
+    def test_bulk_json_array(self):
+        """Test that valid items are inserted and invalid ones reported by index"""
+        items = [self.activity(10), self.activity(20, duration_minutes='long'),
+                 self.activity(30, user_id='nobody'), self.activity(40)]
+        response = self.client.post(reverse('activity-bulk'), items, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual([error['index'] for error in response.data['errors']], [1, 2])
+        activity = Activity.objects.filter(user_email='test@hero.com').first()
+        self.assertEqual(activity.hero_name, 'The Tester')
+        self.assertEqual(User.objects.get(email='test@hero.com').total_points, 50)
+
+    def test_bulk_ndjson(self):
+        """Test NDJSON uploads, including a malformed line"""
+        body = '\n'.join([json.dumps(self.activity(5)), '{not json', json.dumps(self.activity(7))])
+        response = self.client.post(reverse('activity-bulk'), body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(response.data['errors'][0]['index'], 1)
+
+    def test_bulk_ignores_client_user_fields(self):
+        """Test that a client-sent team_id or name cannot override the looked-up user"""
+        item = self.activity(25, team_id='other_team', user_name='Somebody Else')
+        response = self.client.post(reverse('activity-bulk'), [item], format='json')
+        self.assertEqual(response.data['created'], 1)
+        activity = Activity.objects.get(user_id=str(self.user._id))
+        self.assertEqual((activity.team_id, activity.user_name), ('test_team', 'Test Hero'))
+        self.assertFalse(Leaderboard.objects.filter(leaderboard_type='team', team_id='other_team').exists())
+        self.assertEqual(Leaderboard.objects.get(leaderboard_type='team', team_id='test_team').total_points, 25)
+
+
+class ActivityExportTestCase(APITestCase):
+    """Test cases for the streaming activity export"""
+
+    def setUp(self):
+        self.client = APIClient()
+        for days_ago, activity_type in ((1, 'running'), (3, 'yoga'), (10, 'running')):
+            Activity.objects.create(
+                user_id='test_user_id', user_email='test@hero.com', user_name='Test Hero',
+                hero_name='The Tester', team_id='test_team', activity_type=activity_type,
+                workout_name='Test Workout', duration_minutes=30, calories_burned=300,
+                points=50, date=timezone.now() - timedelta(days=days_ago), notes='Test'
+            )
+
+    def test_export_ndjson_honours_filters(self):
+        """Test NDJSON export with filterset and date range parameters"""
+        after = (timezone.now() - timedelta(days=5)).isoformat()
+        response = self.client.get(reverse('activity-export'),
+                                   {'activity_type': 'running', 'date_after': after, 'batch_size': 1})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['activity_type'], 'running')
+
+    def test_export_csv(self):
+        """Test CSV export has a header and one line per activity"""
+        response = self.client.get(reverse('activity-export'), {'output': 'csv'})
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0].split(',')[:2], ['_id', 'user_id'])
+        self.assertEqual(len(lines), 4)
+
+    def test_list_honours_date_range(self):
+        """Test that the list endpoint applies the same date range filter"""
+        before = (timezone.now() - timedelta(days=2)).isoformat()
+        response = self.client.get(reverse('activity-list'), {'date_before': before})
+        self.assertEqual(len(response.data['results']), 2)
+
+
+class ActivityStatsTestCase(APITestCase):
+    """Test cases for the activity statistics actions"""
+
+    def setUp(self):
+        self.client = APIClient()
+        now = timezone.now()
+        for n, (team_id, activity_type, points) in enumerate([
+            ('team_a', 'running', 10), ('team_a', 'running', 20), ('team_a', 'yoga', 5), ('team_b', 'running', 40),
+        ]):
+            user = User.objects.create(name=f'Stat {n}', email=f'stat{n}@test.com', hero_name=f'Stat {n}',
+                                       team_id=team_id)
+            Activity.objects.create(
+                user_id=str(user._id), user_email=user.email, user_name=user.name, hero_name=user.hero_name,
+                team_id=team_id, activity_type=activity_type, workout_name='Test Workout',
+                duration_minutes=30, calories_burned=points * 10, points=points,
+                date=now - timedelta(days=n), notes=''
+            )
+
+    def test_activity_stats_by_type(self):
+        """Test grouped sums, means and percentiles honouring the list filters"""
+        response = self.client.get(reverse('activity-stats'), {'group_by': 'activity_type', 'percentiles': '50'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        running = response.data['groups'][0]
+        self.assertEqual((running['key'], running['count']), ('running', 3))
+        self.assertEqual(running['points'], {'sum': 70, 'mean': 70 / 3, 'min': 10, 'max': 40, 'p50': 20.0})
+        self.assertEqual(running['calories_burned']['p50'], 200.0)
+
+        response = self.client.get(reverse('activity-stats'), {'group_by': 'none', 'team_id': 'team_a'})
+        self.assertEqual(response.data['groups'][0]['points']['p90'], 18.0)
+        response = self.client.get(reverse('activity-stats'), {'group_by': 'day'})
+        self.assertEqual(len(response.data['groups']), 4)
+        response = self.client.get(reverse('activity-stats'), {'group_by': 'month'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_percentiles_picked_on_the_server(self):
+        """Test that the values the window pipeline picks interpolate to numpy's percentiles"""
+        values = [(n * 37) % 101 for n in range(101)]
+        ranks = (0, 29, 50, 90, 99.5, 100)
+        stages = stats._field_percentile_stages({}, 'none', 'points', ranks)
+        indexes = stages[2]['$match']['$expr']['$in'][1]
+        [row] = get_db().activities.aggregate([
+            {'$limit': 1}, {'$addFields': {'n': len(values)}},
+            {'$project': dict({f'i{n}': index for n, index in enumerate(indexes)}, _id=0)},
+        ])
+        ordered = sorted(values)
+        collection = mock.Mock()
+        collection.aggregate.return_value = [{
+            '_id': {'field': 'points'}, 'n': len(values),
+            'picked': [{'i': i, 'v': ordered[int(i)]} for i in set(row.values())],
+        }]
+        result = stats._server_percentiles(collection, {}, 'none', ranks)
+        self.assertEqual(result, {(None, 'points'): stats.percentiles(values, ranks)})
+        self.assertEqual(result[(None, 'points')][1], 29.0)
+
+    def test_user_stats_by_team(self):
+        """Test that user stats aggregate the activities of the filtered users"""
+        response = self.client.get(reverse('user-stats'), {'team_id': 'team_a', 'group_by': 'team'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([(group['key'], group['points']['sum']) for group in response.data['groups']],
+                         [('team_a', 35)])
+        response = self.client.get(reverse('user-stats'))
+        self.assertEqual(len(response.data['groups']), 4)
+
+
+class ActivityPaginationTestCase(APITestCase):
+    """Test cursor pagination over activities"""
+
+    def setUp(self):
+        self.client = APIClient()
+        same_day = timezone.now()
+        for i in range(5):
+            Activity.objects.create(
+                user_id='test_user_id', user_email='test@hero.com', user_name='Test Hero',
+                hero_name='The Tester', team_id='test_team', activity_type='running',
+                workout_name=f'Workout {i}', duration_minutes=30, calories_burned=300,
+                points=i, date=same_day
+            )
+
+    def test_cursor_walks_every_row_once(self):
+        """Test that paging forward and back visits each activity exactly once"""
+        response = self.client.get(reverse('activity-list'), {'page_size': 2})
+        self.assertIsNone(response.data['previous'])
+        seen = [row['_id'] for row in response.data['results']]
+        pages = [seen[:]]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            pages.append([row['_id'] for row in response.data['results']])
+            seen.extend(pages[-1])
+        self.assertEqual(len(seen), 5)
+        self.assertEqual(len(set(seen)), 5)
+        response = self.client.get(response.data['previous'])
+        self.assertEqual([row['_id'] for row in response.data['results']], pages[-2])
+
+    def test_invalid_cursor(self):
+        """Test that a garbled cursor is rejected"""
+        response = self.client.get(reverse('activity-list'), {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        tampered = base64.urlsafe_b64encode(json.dumps({'f': 'date', 'v': None, 'pk': 'None'}).encode())
+        response = self.client.get(reverse('activity-list'), {'cursor': tampered.decode()})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
 
 class LeaderboardAPITestCase(APITestCase):
@@ -183,14 +865,522 @@ class LeaderboardAPITestCase(APITestCase):
         url = reverse('leaderboard-list')
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
+        self.assertEqual(len(response.data['results']), 1)
     
     def test_get_individual_leaderboard(self):
         """Test retrieving individual leaderboard"""
         url = reverse('leaderboard-individual')
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
+        self.assertEqual(len(response.data['results']), 1)
+
+    def test_rank_lookup(self):
+        """Test that the rank lookup returns the entry and its neighbours on both boards"""
+        for rank in range(2, 9):
+            Leaderboard.objects.create(
+                leaderboard_type='individual', rank=rank, total_points=500 - 10 * rank,
+                user_id=f'user_{rank}', user_name=f'User {rank}', team_id='test_team'
+            )
+        Leaderboard.objects.create(leaderboard_type='team', rank=1, total_points=900,
+                                   team_id='test_team', team_name='Test Team')
+        response = self.client.get(reverse('leaderboard-rank'), {'user_id': 'user_5', 'around': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['rank'], 5)
+        self.assertEqual(response.data['entry']['user_id'], 'user_5')
+        self.assertEqual([row['rank'] for row in response.data['above']], [3, 4])
+        self.assertEqual([row['rank'] for row in response.data['below']], [6, 7])
+
+        response = self.client.get(reverse('leaderboard-rank'), {'user_id': 'test_user_id'})
+        self.assertEqual(response.data['above'], [])
+        self.assertEqual(len(response.data['below']), 5)
+        response = self.client.get(reverse('leaderboard-rank'), {'team_id': 'test_team'})
+        self.assertEqual((response.data['leaderboard_type'], response.data['rank']), ('team', 1))
+        response = self.client.get(reverse('leaderboard-rank'), {'user_id': 'nobody'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_individual_leaderboard_aggregates(self):
+        """Test that team names and activity totals are resolved for each row"""
+        Team.objects.create(_id='test_team', name='Test Team', description='A test team')
+        for calories in (100, 250):
+            Activity.objects.create(
+                user_id='test_user_id', user_email='test@hero.com', user_name='Test Hero',
+                hero_name='The Tester', team_id='test_team', activity_type='running',
+                workout_name='Test Workout', duration_minutes=30, calories_burned=calories,
+                points=10, date=timezone.now()
+            )
+        response = self.client.get(reverse('leaderboard-individual'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'][0]['team_name_display'], 'Test Team')
+        self.assertEqual(response.data['results'][0]['total_calories'], 350)
+        self.assertEqual(response.data['results'][0]['activity_count'], 2)
+
+    def test_individual_leaderboard_query_count_is_constant(self):
+        """Test that adding leaderboard rows does not add queries"""
+        url = reverse('leaderboard-individual')
+        with CaptureQueriesContext(connection) as single_row:
+            self.client.get(url)
+        for rank in range(2, 6):
+            Leaderboard.objects.create(
+                leaderboard_type='individual', rank=rank, total_points=500 - rank,
+                user_id=f'user_{rank}', user_email=f'user{rank}@hero.com',
+                user_name=f'Hero {rank}', hero_name=f'Hero {rank}', team_id='test_team'
+            )
+        with CaptureQueriesContext(connection) as many_rows:
+            response = self.client.get(url)
+        self.assertEqual(len(response.data['results']), 5)
+        self.assertEqual(len(many_rows), len(single_row))
+
+
+class FastReadPathTestCase(APITestCase):
+    """Test that the pymongo read path matches the ORM path"""
+
+    def setUp(self):
+        self.client = APIClient()
+        Team.objects.create(_id='test_team', name='Test Team', description='A test team')
+        for i in range(4):
+            user = User.objects.create(
+                name=f'Hero {i}', email=f'hero{i}@hero.com', hero_name=f'Hero {i}',
+                team_id='test_team', total_points=10 * i
+            )
+            Activity.objects.create(
+                user_id=str(user._id), user_email=user.email, user_name=user.name,
+                hero_name=user.hero_name, team_id='test_team', activity_type='running' if i % 2 else 'yoga',
+                workout_name='Test Workout', duration_minutes=30, calories_burned=100 * i,
+                points=10 * i, date=timezone.now(), notes=''
+            )
+            Leaderboard.objects.create(
+                leaderboard_type='individual', rank=4 - i, total_points=10 * i,
+                user_id=str(user._id), user_email=user.email, user_name=user.name,
+                hero_name=user.hero_name, team_id='test_team'
+            )
+
+    def assert_same_response(self, url, params=None):
+        orm = self.client.get(url, params)
+        with override_settings(OCTOFIT_FAST_READS=['activity', 'user', 'leaderboard']):
+            fast = self.client.get(url, params)
+        self.assertEqual(fast.status_code, orm.status_code)
+        self.assertEqual(fast.json(), orm.json())
+        return fast
+
+    def test_lists_match(self):
+        """Test list, filter, search, ordering and paging against the ORM path"""
+        self.assert_same_response(reverse('activity-list'))
+        self.assert_same_response(reverse('activity-list'), {'activity_type': 'yoga'})
+        self.assert_same_response(reverse('activity-list'), {'ordering': 'points', 'page_size': 2})
+        self.assert_same_response(reverse('user-list'), {'search': 'hero 2'})
+        response = self.assert_same_response(reverse('user-list'), {'page_size': 3})
+        self.assert_same_response(response.json()['next'])
+        self.assert_same_response(reverse('leaderboard-list'))
+
+    def test_retrieve(self):
+        """Test that a single document is served by primary key"""
+        user = User.objects.get(email='hero1@hero.com')
+        with override_settings(OCTOFIT_FAST_READS=['user']):
+            response = self.client.get(reverse('user-detail', kwargs={'pk': str(user._id)}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['email'], 'hero1@hero.com')
+        with override_settings(OCTOFIT_FAST_READS=['user']):
+            response = self.client.get(reverse('user-detail', kwargs={'pk': 'not-an-id'}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_sparse_fieldsets(self):
+        """Test that ?fields= and ?exclude= trim the response and the read on both paths"""
+        response = self.assert_same_response(reverse('activity-list'), {'fields': 'points,date'})
+        self.assertEqual(set(response.json()['results'][0]), {'points', 'date'})
+        response = self.assert_same_response(reverse('activity-list'), {'exclude': 'notes', 'page_size': 2})
+        self.assertNotIn('notes', response.json()['results'][0])
+        self.assert_same_response(response.json()['next'])
+        response = self.assert_same_response(reverse('leaderboard-list'), {'fields': 'rank,total_calories'})
+        self.assertEqual(response.json()['results'][0], {'rank': 1, 'total_calories': 300})
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('activity-list'), {'exclude': 'notes'})
+        self.assertIn('"points"', queries[-1]['sql'])
+        self.assertNotIn('notes', queries[-1]['sql'])
+        response = self.client.get(reverse('activity-list'), {'fields': 'points,bogus'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(OCTOFIT_FAST_READS=['activity'])
+    def test_bypasses_sql_translation(self):
+        """Test that the fast path issues no djongo SQL queries"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('activity-list'))
+        self.assertEqual(len(response.data['results']), 4)
+        self.assertIn('ETag', response)
+        self.assertEqual(len(queries), 0)
+
+
+class SearchIndexTestCase(APITestCase):
+    """Test cases for the indexed ?search= backend"""
+
+    def setUp(self):
+        self.client = APIClient()
+        for name, hero_name, email in [
+            ('Riri Williams', 'Ironheart', 'riri@marvel.com'),
+            ('Tony Stark', 'Iron Man', 'tony@marvel.com'),
+            ('Steve Rogers', 'Captain America', 'steve@marvel.com'),
+        ]:
+            User.objects.create(name=name, hero_name=hero_name, email=email, team_id='team_marvel')
+
+    def search(self, params):
+        response = self.client.get(reverse('user-list'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [row['hero_name'] for row in response.data['results']]
+
+    def test_ranked_prefix_search(self):
+        """Test that whole-word matches outrank prefix matches and prefixes match as typed"""
+        self.assertEqual(self.search({'search': 'iron'}), ['Iron Man', 'Ironheart'])
+        self.assertEqual(self.search({'search': 'ton sta'}), ['Iron Man'])
+        self.assertEqual(self.search({'search': 'iron', 'ordering': '-name'}), ['Iron Man', 'Ironheart'])
+        self.assertEqual(self.search({'search': 'iron', 'ordering': 'name'}), ['Ironheart', 'Iron Man'])
+        self.assertEqual(self.search({'search': 'hulk'}), [])
+
+    def test_search_matches_word_prefixes_only(self):
+        """Test that query words match the start of a word, not any substring"""
+        User.objects.create(name='Clark Kent', hero_name='Superman', email='clark@dc.com', team_id='team_dc')
+        self.assertEqual(self.search({'search': 'man'}), ['Iron Man'])
+        self.assertEqual(self.search({'search': 'super'}), ['Superman'])
+
+    def test_ranking_covers_every_match(self):
+        """Test that the best match is found among more matches than any candidate cap"""
+        filler = [{'_id': ObjectId(), 'name': f'Fan {n}', 'hero_name': f'Ironclad Mantis {n}',
+                   'email': f'fan{n}@octofit.dev', 'team_id': 'team_fans'} for n in range(1500)]
+        get_db().users.insert_many(add_search_terms(User, filler))
+        # The best match is stored after all of them
+        tony = User.objects.get(email='tony@marvel.com')
+        tony.delete()
+        User.objects.create(name=tony.name, hero_name=tony.hero_name, email=tony.email, team_id=tony.team_id)
+        response = self.client.get(reverse('user-list'), {'search': 'iron man', 'page_size': 1})
+        self.assertEqual([row['hero_name'] for row in response.data['results']], ['Iron Man'])
+        response = self.client.get(response.data['next'])
+        self.assertTrue(response.data['results'][0]['hero_name'].startswith('Ironclad Mantis'))
+
+    def test_search_pages_and_fast_path(self):
+        """Test that ranked results page by cursor and match on the fast path"""
+        response = self.client.get(reverse('user-list'), {'search': 'marvel', 'page_size': 2})
+        first = [row['email'] for row in response.data['results']]
+        second = [row['email'] for row in self.client.get(response.data['next']).data['results']]
+        self.assertEqual(len(first + second), 3)
+        self.assertEqual(set(first + second), {'riri@marvel.com', 'tony@marvel.com', 'steve@marvel.com'})
+        with override_settings(OCTOFIT_FAST_READS=['user']):
+            fast = self.client.get(reverse('user-list'), {'search': 'iron', 'ordering': 'name'})
+        self.assertEqual([row['hero_name'] for row in fast.data['results']], ['Ironheart', 'Iron Man'])
+
+    def test_reindex_command(self):
+        """Test that reindex_search rebuilds terms for documents written without them"""
+        get_db().users.update_many({}, {'$unset': {'_search': ''}})
+        self.assertEqual(self.search({'search': 'steve'}), [])
+        call_command('reindex_search', 'users', stdout=StringIO())
+        self.assertEqual(self.search({'search': 'steve'}), ['Captain America'])
+
+
+class AsyncReadPathTestCase(APITestCase):
+    """Test cases for the async read endpoints against the sync API"""
+
+    def setUp(self):
+        FastReadPathTestCase.setUp(self)
+
+    def assert_same_as_sync(self, async_name, sync_url, params=None):
+        response = self.client.get(reverse(async_name), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['results'], self.client.get(sync_url, params).json()['results'])
+        return response
+
+    def test_async_lists_match(self):
+        """Test that async lists, search, paging and standings match the sync endpoints"""
+        self.assert_same_as_sync('async-activity-list', reverse('activity-list'), {'activity_type': 'yoga'})
+        response = self.assert_same_as_sync('async-user-list', reverse('user-list'), {'page_size': 3})
+        next_page = response.json()['next'].replace('/api/async/users/', '/api/users/')
+        self.assertEqual(self.client.get(response.json()['next']).json()['results'],
+                         self.client.get(next_page).json()['results'])
+        self.assert_same_as_sync('async-user-list', reverse('user-list'), {'search': 'hero'})
+        self.assert_same_as_sync('async-leaderboard-individual', reverse('leaderboard-individual'),
+                                 {'fields': 'rank,hero_name,total_calories'})
+
+    def test_async_user_detail(self):
+        """Test that a user is looked up by primary key"""
+        user = User.objects.get(email='hero2@hero.com')
+        response = self.client.get(reverse('async-user-detail', kwargs={'pk': str(user._id)}))
+        self.assertEqual(response.json()['hero_name'], 'Hero 2')
+        response = self.client.get(reverse('async-user-detail', kwargs={'pk': str(ObjectId())}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.get(reverse('async-user-detail', kwargs={'pk': 'bad'}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class ResponseCacheTestCase(APITestCase):
+    """Test cases for the versioned response cache"""
+
+    def setUp(self):
+        self.client = APIClient()
+        Team.objects.create(_id='test_team', name='Test Team', description='A test team')
+
+    def test_repeat_read_is_a_hit(self):
+        """Test that an identical request is served from the cache"""
+        url = reverse('team-list')
+        self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get(url)['X-Cache'], 'HIT')
+        self.assertEqual(self.client.get(url, {'members': 'false'})['X-Cache'], 'MISS')
+        stats = self.client.get(reverse('cache-stats')).data
+        self.assertGreaterEqual(stats['hits'], 1)
+
+    def test_write_invalidates(self):
+        """Test that a write through the API bumps the collection version"""
+        url = reverse('team-list')
+        self.client.get(url)
+        self.client.post(url, {'_id': 'other_team', 'name': 'Other Team', 'description': 'Another'},
+                         format='json')
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(len(response.data), 2)
+
+    def test_versions_read_once_per_request(self):
+        """Test that the ETag and the cache key of a response share one versions read"""
+        url = reverse('team-list')
+        for expected in ('MISS', 'HIT'):
+            with mock.patch.object(cache, '_version_documents', wraps=cache._version_documents) as read:
+                response = self.client.get(url)
+            self.assertEqual(response['X-Cache'], expected)
+            self.assertIn('ETag', response)
+            self.assertEqual(read.call_count, 1)
+
+
+class ConditionalGetTestCase(APITestCase):
+    """Test cases for ETag / Last-Modified handling"""
+
+    def setUp(self):
+        self.client = APIClient()
+        Leaderboard.objects.create(
+            leaderboard_type='individual', rank=1, total_points=500, user_id='test_user_id',
+            user_email='test@hero.com', user_name='Test Hero', hero_name='The Tester',
+            team_id='test_team'
+        )
+
+    def age_versions(self, seconds=5):
+        get_db()[VERSIONS_COLLECTION].update_many({}, {'$inc': {'modified_at': -seconds}})
+
+    def test_if_none_match(self):
+        """Test that a matching ETag gets a 304 until the data changes"""
+        url = reverse('leaderboard-list')
+        self.age_versions()
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertIn('Last-Modified', response)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b'')
+        Leaderboard.objects.create(
+            leaderboard_type='team', rank=1, total_points=500, team_id='test_team', team_name='Test Team'
+        )
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_if_modified_since(self):
+        """Test that Last-Modified is honoured on its own and moves with any write"""
+        url = reverse('leaderboard-individual')
+        self.assertNotIn('Last-Modified', self.client.get(url))
+        self.age_versions()
+        last_modified = self.client.get(url)['Last-Modified']
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        # A rename leaves last_updated alone
+        get_db().leaderboard.update_many({}, {'$set': {'hero_name': 'Renamed'}})
+        bump_versions('leaderboard')
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_versions_are_shared(self):
+        """Test that validators see writes recorded by other processes and skip counting rows"""
+        url = reverse('user-list')
+        etag = self.client.get(url)['ETag']
+        get_db()[VERSIONS_COLLECTION].update_one({'_id': 'users'}, {'$set': {'version': 'elsewhere'}},
+                                                 upsert=True)
+        self.assertNotEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code,
+                            status.HTTP_304_NOT_MODIFIED)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('activity-list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(len(queries), 1)
+
+    def test_etag_depends_on_query(self):
+        """Test that different filters get different validators"""
+        url = reverse('activity-list')
+        first = self.client.get(url, {'user_id': 'a'})['ETag']
+        second = self.client.get(url, {'user_id': 'b'})['ETag']
+        self.assertNotEqual(first, second)
+
+
+class MongoLockTestCase(TestCase):
+    """Test cases for the cross-process lock"""
+
+    def test_lock_is_exclusive(self):
+        """Test that a held lock cannot be taken until it is released"""
+        holder, other = MongoLock('test_lock'), MongoLock('test_lock')
+        self.assertTrue(holder.try_acquire())
+        self.assertFalse(other.try_acquire())
+        with self.assertRaises(TimeoutError):
+            other.acquire(timeout=0.01)
+        holder.release()
+        self.assertTrue(other.try_acquire())
+        other.release()
+
+    def test_expired_lease_is_taken_over(self):
+        """Test that a holder that stopped renewing loses the lock"""
+        stale, fresh = MongoLock('test_lock', lease=-1), MongoLock('test_lock')
+        self.assertTrue(stale.try_acquire())
+        self.assertTrue(fresh.try_acquire())
+        with self.assertRaises(LockLost):
+            stale.renew()
+        fresh.renew()
+        fresh.release()
+
+
+class SyncIndexesTestCase(TestCase):
+    """Test cases for the sync_indexes management command"""
+
+    def test_sync_creates_declared_indexes(self):
+        """Test that after a sync nothing declared is missing"""
+        call_command('sync_indexes', stdout=StringIO())
+        missing, _ = diff_indexes(get_db())
+        self.assertEqual(missing, [])
+        output = StringIO()
+        call_command('sync_indexes', '--dry-run', '--keep-extra', stdout=output)
+        self.assertIn('Indexes already in sync', output.getvalue())
+        self.assertNotIn('/api/activities/?user_id=', output.getvalue())
+
+
+class FastJSONTestCase(APITestCase):
+    """Test cases for the JSON renderer and parser"""
+
+    def test_encodes_object_ids_and_aware_datetimes(self):
+        """Test that ObjectId and aware datetimes encode without conversion"""
+        object_id = ObjectId()
+        when = timezone.now().replace(microsecond=0)
+        payload = fastjson.loads(fastjson.dumps({'_id': object_id, 'date': when}))
+        self.assertEqual(payload['_id'], str(object_id))
+        self.assertEqual(payload['date'], when.isoformat().replace('+00:00', 'Z'))
+
+    def test_api_round_trip(self):
+        """Test that the API parses and renders activities through the fast JSON path"""
+        user = User.objects.create(name='Json User', email='json@test.com', hero_name='Json', team_id='team_json')
+        response = self.client.post(reverse('activity-list'), json.dumps({
+            'user_id': str(user._id), 'user_email': user.email, 'user_name': user.name,
+            'hero_name': user.hero_name, 'team_id': user.team_id, 'activity_type': 'running',
+            'workout_name': 'Json Workout', 'duration_minutes': 30, 'calories_burned': 300,
+            'points': 30, 'date': timezone.now().isoformat()
+        }), content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        row = json.loads(self.client.get(reverse('activity-list')).content)['results'][0]
+        self.assertEqual(row['user_id'], str(user._id))
+        self.assertIsInstance(row['_id'], str)
+
+
+class PerformanceInstrumentationTestCase(APITestCase):
+    """Test cases for the request instrumentation middleware"""
+
+    def setUp(self):
+        self.client = APIClient()
+        Team.objects.create(_id='test_team', name='Test Team', description='A test team')
+
+    def test_server_timing_header(self):
+        """Test that responses carry the per-request timing breakdown"""
+        response = self.client.get(reverse('team-list'))
+        timing = response['Server-Timing']
+        for metric in ('total;dur=', 'db;dur=', 'mongo;dur=', 'translate;dur=', 'render;dur='):
+            self.assertIn(metric, timing)
+        self.assertRegex(timing, r'db;dur=[\d.]+;desc="\d+ queries"')
+
+    def test_metrics_endpoint(self):
+        """Test that per-endpoint aggregates and cache counters are exported"""
+        self.client.get(reverse('team-list'))
+        response = self.client.get(reverse('metrics'))
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        body = response.content.decode()
+        self.assertIn('octofit_requests_total{method="GET",endpoint="team-list",status="200"}', body)
+        self.assertIn('octofit_request_duration_seconds_bucket{method="GET",endpoint="team-list",le="+Inf"}', body)
+        self.assertIn('octofit_response_cache_requests_total{result="miss"}', body)
+
+    @override_settings(OCTOFIT_SLOW_REQUEST_MS=0)
+    def test_slow_request_log(self):
+        """Test that requests over the threshold are logged with their breakdown"""
+        with self.assertLogs('octofit_tracker.performance', level='WARNING') as logs:
+            self.client.get(reverse('team-list'))
+        self.assertIn('Slow request GET /api/teams/ (team-list)', logs.output[0])
+
+
+@override_settings(OCTOFIT_RESPONSE_CACHE=False)
+class QueryCountTestCase(RoundTripAssertionsMixin, APITestCase):
+    """Test that list endpoints make a fixed number of round trips, whatever the row count"""
+
+    def setUp(self):
+        self.client = APIClient()
+        for t in range(3):
+            Team.objects.create(_id=f'team_{t}', name=f'Team {t}', description='A test team')
+        for i in range(6):
+            user = User.objects.create(
+                name=f'Hero {i}', email=f'hero{i}@hero.com', hero_name=f'Hero {i}',
+                team_id=f'team_{i % 3}', total_points=10 * i
+            )
+            Activity.objects.create(
+                user_id=str(user._id), user_email=user.email, user_name=user.name,
+                hero_name=user.hero_name, team_id=user.team_id, activity_type='running',
+                workout_name='Test Workout', duration_minutes=30, calories_burned=100,
+                points=10 * i, date=timezone.now(), notes=''
+            )
+            Leaderboard.objects.create(
+                leaderboard_type='individual', rank=6 - i, total_points=10 * i,
+                user_id=str(user._id), user_email=user.email, user_name=user.name,
+                hero_name=user.hero_name, team_id=user.team_id
+            )
+        for t in range(3):
+            Leaderboard.objects.create(leaderboard_type='team', rank=t + 1, total_points=100 - t,
+                                       team_id=f'team_{t}', team_name=f'Team {t}')
+        Workout.objects.create(name='Test Workout', type='cardio', duration_minutes=30,
+                               calories_per_session=300, description='A test workout', difficulty='beginner')
+
+    # (url name, params, SQL queries, Mongo commands) with six users and three teams
+    ORM_READS = [
+        ('team-list', {}, 3, 3),
+        ('user-list', {}, 2, 2),
+        ('user-by-team', {'team_id': 'team_0'}, 2, 2),
+        ('workout-list', {}, 2, 2),
+        ('activity-list', {}, 2, 2),
+        ('activity-by-team', {'team_id': 'team_0'}, 2, 2),
+        ('leaderboard-list', {}, 4, 4),
+        ('leaderboard-individual', {}, 4, 4),
+        ('leaderboard-team', {}, 2, 2),
+    ]
+    FAST_READS = [
+        ('user-list', {}, 0, 2),
+        ('workout-list', {}, 0, 2),
+        ('activity-list', {}, 0, 2),
+        ('leaderboard-list', {}, 0, 5),
+        ('leaderboard-individual', {}, 3, 5),
+        ('leaderboard-team', {}, 1, 3),
+    ]
+
+    def assert_round_trips(self, endpoints):
+        for name, params, queries, mongo_commands in endpoints:
+            with self.subTest(endpoint=name):
+                with self.assertMaxQueries(queries, mongo_commands):
+                    response = self.client.get(reverse(name), params)
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_orm_reads(self):
+        """Test the round trips of each list action on the djongo path"""
+        self.assert_round_trips(self.ORM_READS)
+
+    @override_settings(OCTOFIT_FAST_READS=['activity', 'user', 'leaderboard', 'workout'])
+    def test_fast_reads(self):
+        """Test the round trips of each list action on the pymongo path"""
+        self.assert_round_trips(self.FAST_READS)
+
+    def test_per_row_query_fails(self):
+        """Test that a query per serialized row exceeds the limit"""
+        with self.assertRaises(AssertionError):
+            with self.assertMaxQueries(3):
+                for user in User.objects.all():
+                    Team.objects.filter(_id=user.team_id).first()
 
 
 class APIRootTestCase(APITestCase):
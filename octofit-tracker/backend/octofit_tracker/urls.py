@@ -20,9 +20,11 @@ from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework.reverse import reverse
 import os
+from . import async_views
+from .instrumentation import metrics_view
 from .views import (
     TeamViewSet, UserViewSet, ActivityViewSet, 
-    LeaderboardViewSet, WorkoutViewSet
+    LeaderboardViewSet, WorkoutViewSet, job_detail, job_list, response_cache_stats
 )
 
 
@@ -44,6 +46,7 @@ def api_root(request, format=None):
         'activities': f'{base_url}/api/activities/',
         'workouts': f'{base_url}/api/workouts/',
         'leaderboard': f'{base_url}/api/leaderboard/',
+        'jobs': f'{base_url}/api/jobs/',
         'admin': f'{base_url}/admin/',
     })
 
@@ -58,6 +61,18 @@ router.register(r'leaderboard', LeaderboardViewSet, basename='leaderboard')
 
 urlpatterns = [
     path('', api_root, name='api-root'),
+    path('api/cache/stats/', response_cache_stats, name='cache-stats'),
+    path('metrics', metrics_view, name='metrics'),
+    path('api/jobs/', job_list, name='job-list'),
+    path('api/jobs/<str:pk>/', job_detail, name='job-detail'),
+    path('api/async/activities/', async_views.activity_list, name='async-activity-list'),
+    path('api/async/users/', async_views.user_list, name='async-user-list'),
+    path('api/async/users/<str:pk>/', async_views.user_detail, name='async-user-detail'),
+    path('api/async/leaderboard/', async_views.leaderboard_list, name='async-leaderboard-list'),
+    path('api/async/leaderboard/individual/', async_views.leaderboard_list,
+         {'leaderboard_type': 'individual'}, name='async-leaderboard-individual'),
+    path('api/async/leaderboard/team/', async_views.leaderboard_list,
+         {'leaderboard_type': 'team'}, name='async-leaderboard-team'),
     path('api/', include(router.urls)),
     path('admin/', admin.site.urls),
 ]
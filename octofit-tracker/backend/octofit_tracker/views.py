@@ -1,15 +1,31 @@
-from rest_framework import viewsets, filters
-from rest_framework.decorators import action
+import copy
+
+from rest_framework import viewsets, filters, serializers
+from rest_framework.decorators import action, api_view
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
+from . import denorm, jobs, leaderboard
+from .bulk import MAX_BULK_ITEMS, ingest_activities
+from .cache import InvalidatesCacheMixin, cache_stats, cached_response
+from .conditional import ConditionalGetMixin
+from .export import EXPORT_FORMATS, stream_export
+from .fastpath import MongoReadMixin, build_query, leaderboard_document_context
+from .fieldsets import SparseFieldsetMixin
 from .models import User, Team, Activity, Leaderboard, Workout
+from .mongo import get_db, id_variants
+from .pagination import KeysetPagination
+from .parsers import FastJSONParser, NDJSONParser
+from .search import SearchIndexFilter
+from .stats import activity_stats, parse_stats_params
 from .serializers import (
     UserSerializer, TeamSerializer, ActivitySerializer, 
-    LeaderboardSerializer, WorkoutSerializer
+    LeaderboardSerializer, WorkoutSerializer, leaderboard_context,
+    team_members_context
 )
 
 
-class TeamViewSet(viewsets.ModelViewSet):
+class TeamViewSet(ConditionalGetMixin, InvalidatesCacheMixin, SparseFieldsetMixin, viewsets.ModelViewSet):
     """
     API endpoint for teams
     """
@@ -19,19 +35,77 @@ class TeamViewSet(viewsets.ModelViewSet):
     search_fields = ['name', 'description']
     ordering_fields = ['name', 'member_count', 'created_at']
     ordering = ['name']
+    invalidates = ('teams',)
+    conditional_collections = ('teams', 'users')
+
+    @cached_response('teams', 'users')
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    def get_serializer_context(self):
+        """Honour ?members=false and ?members_limit=N for the nested member list"""
+        context = super().get_serializer_context()
+        params = self.request.query_params
+        if params.get('members', '').lower() in ('false', '0', 'no') or not self.field_selected('members'):
+            context['include_members'] = False
+        members_limit = params.get('members_limit')
+        if members_limit is not None:
+            try:
+                context['members_limit'] = max(int(members_limit), 0)
+            except ValueError:
+                raise ValidationError({'members_limit': 'Must be an integer.'})
+        return context
 
+    def get_serializer(self, *args, **kwargs):
+        """Load members for every team on the page with one query"""
+        if kwargs.get('many') and args:
+            teams = list(args[0])
+            context = self.get_serializer_context()
+            if context.get('include_members', True):
+                context.update(team_members_context(teams))
+            kwargs['context'] = context
+            args = (teams,) + args[1:]
+        return super().get_serializer(*args, **kwargs)
 
-class UserViewSet(viewsets.ModelViewSet):
+
+class UserViewSet(ConditionalGetMixin, InvalidatesCacheMixin, SparseFieldsetMixin, MongoReadMixin,
+                  viewsets.ModelViewSet):
     """
     API endpoint for users
     """
     queryset = User.objects.all()
     serializer_class = UserSerializer
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    pagination_class = KeysetPagination
+    filter_backends = [DjangoFilterBackend, SearchIndexFilter, filters.OrderingFilter]
     filterset_fields = ['team_id', 'email']
     search_fields = ['name', 'hero_name', 'email']
     ordering_fields = ['name', 'total_points', 'created_at']
     ordering = ['-total_points']
+    invalidates = ('users',)
+    conditional_collections = ('users',)
+
+    def get_conditional_collections(self):
+        if self.action == 'stats':
+            return self.conditional_collections + ('activities',)
+        return self.conditional_collections
+
+    def perform_update(self, serializer):
+        previous = copy.copy(serializer.instance)
+        user = serializer.save()
+        denorm.propagate_user(previous, user)
+
+    @action(detail=False, methods=['get'])
+    def stats(self, request):
+        """Activity statistics of the filtered users, per user by default (?group_by=)"""
+        group_by, ranks = parse_stats_params(request, 'user')
+        users, query, _ = build_query(self, request)
+        match = {}
+        if query:
+            user_ids = []
+            for user in users.find(query, {'_id': 1}):
+                user_ids.extend(id_variants(user['_id']))
+            match = {'user_id': {'$in': user_ids}}
+        return Response({'group_by': group_by, 'groups': activity_stats(get_db().activities, match, group_by, ranks)})
 
     @action(detail=False, methods=['get'])
     def by_team(self, request):
@@ -39,35 +113,109 @@ class UserViewSet(viewsets.ModelViewSet):
         team_id = request.query_params.get('team_id', None)
         if team_id:
             users = User.objects.filter(team_id=team_id)
-            serializer = self.get_serializer(users, many=True)
-            return Response(serializer.data)
+            page = self.paginate_queryset(users)
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
         return Response({'error': 'team_id parameter is required'}, status=400)
 
 
-class WorkoutViewSet(viewsets.ModelViewSet):
+class WorkoutViewSet(ConditionalGetMixin, SparseFieldsetMixin, MongoReadMixin, viewsets.ModelViewSet):
     """
     API endpoint for workouts
     """
     queryset = Workout.objects.all()
     serializer_class = WorkoutSerializer
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [DjangoFilterBackend, SearchIndexFilter, filters.OrderingFilter]
     filterset_fields = ['type', 'difficulty']
     search_fields = ['name', 'description']
     ordering_fields = ['name', 'duration_minutes', 'calories_per_session', 'difficulty']
     ordering = ['name']
+    conditional_collections = ('workouts',)
 
 
-class ActivityViewSet(viewsets.ModelViewSet):
+class ActivityViewSet(ConditionalGetMixin, InvalidatesCacheMixin, SparseFieldsetMixin, MongoReadMixin,
+                      viewsets.ModelViewSet):
     """
     API endpoint for activities
     """
     queryset = Activity.objects.all()
     serializer_class = ActivitySerializer
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    pagination_class = KeysetPagination
+    filter_backends = [DjangoFilterBackend, SearchIndexFilter, filters.OrderingFilter]
     filterset_fields = ['user_id', 'team_id', 'activity_type']
     search_fields = ['user_name', 'hero_name', 'workout_name']
     ordering_fields = ['date', 'points', 'calories_burned', 'duration_minutes']
     ordering = ['-date']
+    invalidates = ('activities', 'users', 'leaderboard')
+    conditional_collections = ('activities',)
+
+    def get_date_range(self):
+        """Bounds from ?date_after= (inclusive) and ?date_before= (exclusive)"""
+        field = serializers.DateTimeField()
+        bounds = {}
+        for param, lookup in (('date_after', 'gte'), ('date_before', 'lt')):
+            value = self.request.query_params.get(param)
+            if value:
+                try:
+                    bounds[lookup] = field.to_internal_value(value)
+                except ValidationError as exc:
+                    raise ValidationError({param: exc.detail})
+        return bounds
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        bounds = self.get_date_range()
+        return queryset.filter(**{f'date__{lookup}': value for lookup, value in bounds.items()})
+
+    def get_mongo_clauses(self):
+        bounds = self.get_date_range()
+        if not bounds:
+            return []
+        return [{'date': {f'${lookup}': value for lookup, value in bounds.items()}}]
+
+    def perform_create(self, serializer):
+        activity = serializer.save()
+        leaderboard.record_activity(activity)
+
+    def perform_update(self, serializer):
+        previous = copy.copy(serializer.instance)
+        activity = serializer.save()
+        leaderboard.replace_activity(previous, activity)
+
+    def perform_destroy(self, instance):
+        instance.delete()
+        leaderboard.record_activity(instance, sign=-1)
+
+    @action(detail=False, methods=['post'], url_path='bulk', parser_classes=[FastJSONParser, NDJSONParser])
+    def bulk(self, request):
+        """Create many activities from a JSON array or an NDJSON stream"""
+        items = request.data
+        if not isinstance(items, list):
+            return Response({'error': 'Expected a JSON array or an NDJSON stream'}, status=400)
+        if len(items) > MAX_BULK_ITEMS:
+            return Response({'error': f'At most {MAX_BULK_ITEMS} activities per request'}, status=400)
+
+        inserted, errors = ingest_activities(items, self.get_serializer())
+        return Response({
+            'created': len(inserted),
+            'ids': [str(document['_id']) for document in inserted],
+            'errors': errors,
+        }, status=201 if inserted else 400)
+
+    @action(detail=False, methods=['get'])
+    def stats(self, request):
+        """Grouped sums, means and percentiles of the filtered activities, per day by default (?group_by=)"""
+        group_by, ranks = parse_stats_params(request, 'day')
+        collection, query, _ = build_query(self, request)
+        return Response({'group_by': group_by, 'groups': activity_stats(collection, query, group_by, ranks)})
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """Stream the filtered activities as NDJSON (default) or CSV via ?output="""
+        output = request.query_params.get('output', 'ndjson')
+        if output not in EXPORT_FORMATS:
+            return Response({'error': f'output must be one of: {", ".join(EXPORT_FORMATS)}'}, status=400)
+        return stream_export(self, request, output)
 
     @action(detail=False, methods=['get'])
     def by_user(self, request):
@@ -75,8 +223,9 @@ class ActivityViewSet(viewsets.ModelViewSet):
         user_id = request.query_params.get('user_id', None)
         if user_id:
             activities = Activity.objects.filter(user_id=user_id)
-            serializer = self.get_serializer(activities, many=True)
-            return Response(serializer.data)
+            page = self.paginate_queryset(activities)
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
         return Response({'error': 'user_id parameter is required'}, status=400)
 
     @action(detail=False, methods=['get'])
@@ -85,32 +234,160 @@ class ActivityViewSet(viewsets.ModelViewSet):
         team_id = request.query_params.get('team_id', None)
         if team_id:
             activities = Activity.objects.filter(team_id=team_id)
-            serializer = self.get_serializer(activities, many=True)
-            return Response(serializer.data)
+            page = self.paginate_queryset(activities)
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
         return Response({'error': 'team_id parameter is required'}, status=400)
 
 
-class LeaderboardViewSet(viewsets.ReadOnlyModelViewSet):
+class LeaderboardViewSet(ConditionalGetMixin, SparseFieldsetMixin, MongoReadMixin, viewsets.ReadOnlyModelViewSet):
     """
     API endpoint for leaderboard (read-only)
     """
     queryset = Leaderboard.objects.all()
     serializer_class = LeaderboardSerializer
+    pagination_class = KeysetPagination
     filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
     filterset_fields = ['leaderboard_type', 'team_id']
     ordering_fields = ['rank', 'total_points']
     ordering = ['rank']
+    conditional_collections = ('leaderboard', 'activities', 'teams')
+
+    aggregate_fields = ('team_name_display', 'total_calories', 'activity_count')
+
+    def aggregates_selected(self):
+        return any(self.field_selected(name) for name in self.aggregate_fields)
+
+    def get_serializer(self, *args, **kwargs):
+        """Batch the per-row aggregate lookups when serializing many entries"""
+        if kwargs.get('many') and args and 'context' not in kwargs and self.aggregates_selected():
+            entries = list(args[0])
+            context = self.get_serializer_context()
+            context.update(leaderboard_context(entries))
+            kwargs['context'] = context
+            args = (entries,) + args[1:]
+        return super().get_serializer(*args, **kwargs)
+
+    def get_document_context(self, documents):
+        if not self.aggregates_selected():
+            return {}
+        return leaderboard_document_context(documents)
+
+    @cached_response('leaderboard', 'activities', 'teams')
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
 
     @action(detail=False, methods=['get'])
+    @cached_response('leaderboard', 'activities', 'teams')
     def individual(self, request):
         """Get individual leaderboard"""
-        leaderboard = Leaderboard.objects.filter(leaderboard_type='individual').order_by('rank')
-        serializer = self.get_serializer(leaderboard, many=True)
-        return Response(serializer.data)
+        return self.standings_response(request, 'individual')
 
     @action(detail=False, methods=['get'])
+    @cached_response('leaderboard', 'activities', 'teams')
     def team(self, request):
         """Get team leaderboard"""
-        leaderboard = Leaderboard.objects.filter(leaderboard_type='team').order_by('rank')
-        serializer = self.get_serializer(leaderboard, many=True)
-        return Response(serializer.data)
+        return self.standings_response(request, 'team')
+
+    @action(detail=False, methods=['get'])
+    @cached_response('leaderboard', 'activities', 'teams')
+    def rank(self, request):
+        """A user's (?user_id=) or team's (?team_id=) rank and the ?around=K entries either side"""
+        params = request.query_params
+        if params.get('user_id'):
+            leaderboard_type = 'individual'
+            match = {'user_id': {'$in': id_variants(params['user_id'])}}
+        elif params.get('team_id'):
+            leaderboard_type = 'team'
+            match = {'team_id': params['team_id']}
+        else:
+            return Response({'error': 'user_id or team_id parameter is required'}, status=400)
+        try:
+            around = min(max(int(params.get('around', leaderboard.DEFAULT_RANK_AROUND)), 0),
+                         leaderboard.MAX_RANK_AROUND)
+        except ValueError:
+            return Response({'error': 'around must be an integer'}, status=400)
+
+        entry, band = leaderboard.rank_window(leaderboard_type, match, around)
+        if entry is None:
+            return Response({'error': 'No leaderboard entry found'}, status=404)
+        results = self.serialize_documents(band)
+        position = [document['_id'] for document in band].index(entry['_id'])
+        return Response({
+            'leaderboard_type': leaderboard_type,
+            'rank': entry['rank'],
+            'entry': results[position],
+            'above': results[:position],
+            'below': results[position + 1:],
+        })
+
+    def standings_response(self, request, leaderboard_type):
+        """All-time standings, or ?window=day|week|month from the rollup buckets"""
+        window = request.query_params.get('window', 'all')
+        if window == 'all':
+            entries = Leaderboard.objects.filter(leaderboard_type=leaderboard_type).order_by('rank')
+            page = self.paginate_queryset(entries)
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        if window not in leaderboard.WINDOWS:
+            choices = ', '.join(['all'] + list(leaderboard.WINDOWS))
+            return Response({'error': f'window must be one of: {choices}'}, status=400)
+
+        # Page over the buckets, whose _ids break ties, and number the page
+        # from its first bucket; the rows built from them are never saved
+        query = leaderboard.windowed_query(leaderboard_type, window)
+        page = self.paginator.paginate_documents(
+            get_db().leaderboard_rollups, query, ['-total_points'], request, None
+        )
+        first_rank = leaderboard.windowed_rank(query, page[0]) if page else 1
+        entries = []
+        activity_totals = {}
+        for rank, bucket in enumerate(page, first_rank):
+            entries.append(Leaderboard(
+                leaderboard_type=leaderboard_type, rank=rank,
+                total_points=bucket['total_points'], last_updated=bucket['last_updated'],
+                user_id=bucket.get('key') if leaderboard_type == 'individual' else None,
+                user_email=bucket.get('user_email'), user_name=bucket.get('user_name'),
+                hero_name=bucket.get('hero_name'), team_id=bucket.get('team_id'),
+                team_name=bucket.get('team_name')
+            ))
+            activity_totals[str(bucket['key'])] = (bucket['total_calories'], bucket['activity_count'])
+
+        context = self.get_serializer_context()
+        if self.aggregates_selected():
+            context.update(leaderboard_context(entries, activity_totals=activity_totals))
+        serializer = self.get_serializer(entries, many=True, context=context)
+        return self.get_paginated_response(serializer.data)
+
+
+@api_view(['GET'])
+def response_cache_stats(request):
+    """Hit/miss counters of the response cache in this process"""
+    return Response(cache_stats())
+
+
+@api_view(['GET', 'POST'])
+def job_list(request):
+    """Recent background jobs (?state=), or queue one with {"task": ..., "params": {...}}"""
+    if request.method == 'POST':
+        if not isinstance(request.data, dict):
+            raise ValidationError({'detail': 'Expected a JSON object'})
+        try:
+            job_id = jobs.enqueue(request.data.get('task'), request.data.get('params'))
+        except ValueError as exc:
+            raise ValidationError({'detail': str(exc)})
+        return Response(jobs.job_data(jobs.get_job(job_id)), status=202)
+
+    state = request.query_params.get('state')
+    if state and state not in jobs.STATES:
+        raise ValidationError({'state': f'Must be one of: {", ".join(jobs.STATES)}.'})
+    return Response([jobs.job_data(job) for job in jobs.recent_jobs(state)])
+
+
+@api_view(['GET'])
+def job_detail(request, pk):
+    """A background job's state, progress and error"""
+    job = jobs.get_job(pk)
+    if job is None:
+        raise NotFound()
+    return Response(jobs.job_data(job))